@@ -0,0 +1,286 @@
+import http.client
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlencode, urlsplit
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import Max
+from django.test import Client
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+from posts.models import Post, TimelineEntry
+
+User = get_user_model()  # Custom user model
+
+# HTTP benchmark of the main endpoints.
+#
+# Benchmark replays a weighted mix of OPERATIONS, each request sent as a random client
+# user with a JWT access token, from `concurrency` threads in a closed loop: each thread
+# sends its next request as soon as the previous one is answered. Requests go through
+# Django's test client in this process (the middleware, URL routing, views and database,
+# without a server) or over HTTP to a running server. The result is a JSON report of the
+# latency percentiles, throughput, statuses and, read from the Server-Timing header (see
+# social_media_api.instrumentation), the mean query count of every operation.
+
+TOKEN_LIFETIME = timedelta(hours=12)  # Outlasts any run, unlike the usual ten minutes
+QUERIES = re.compile(r'desc="(\d+) queries"')
+PAGE_SIZE = 20
+
+DEFAULT_MIX = {'feed': 35, 'posts': 20, 'post': 10, 'like': 20, 'follow': 5, 'notifications': 10}
+
+
+def feed(state, rng):
+    return 'get', reverse('post_feed'), {'page_size': PAGE_SIZE}
+
+
+def posts(state, rng):
+    return 'get', reverse('post-viewset-list-list'), {'page_size': PAGE_SIZE, 'mode': 'summary'}
+
+
+def post(state, rng):
+    post_id, _ = rng.choice(state.posts)
+    return 'get', reverse('post-viewset-list-detail', args=[post_id]), None
+
+
+def like(state, rng):
+    # Idempotent like or unlike of someone else's post
+    for _ in range(5):
+        post_id, author_id = rng.choice(state.posts)
+        if author_id != state.user_id:
+            break
+    return rng.choice(['put', 'delete']), reverse('like_post', args=[post_id]), None
+
+
+def follow(state, rng):
+    # Follow or unfollow, so the graph stays about the same size whatever the run length
+    user_id = rng.choice(state.users)
+    return 'post', reverse(rng.choice(['follow_user', 'unfollow_user']), args=[user_id]), None
+
+
+def notifications(state, rng):
+    return 'get', reverse('notification-list'), {'page_size': PAGE_SIZE}
+
+
+# Operations: name -> (request builder, statuses that count as success)
+OPERATIONS = {
+    'feed': (feed, {200}),
+    'posts': (posts, {200}),
+    'post': (post, {200}),
+    'like': (like, {200, 202}),
+    'follow': (follow, {200, 400}),  # 400: already followed, not followed, or oneself
+    'notifications': (notifications, {200}),
+}
+
+
+def parse_mix(value):
+    # {"feed": 3, "like": 1} from "feed=3,like=1"
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}.")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid weight for {name!r}.")
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("The mix needs at least one operation with a positive weight.")
+    return mix
+
+
+def percentile(ordered, q):
+    # Nearest-rank percentile of sorted values
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(samples, seconds):
+    # Statistics of (latency, ok, queries) samples; latencies in milliseconds
+    latencies = sorted(latency * 1000 for latency, _, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, ok, _ in samples if not ok),
+        'throughput': round(len(samples) / seconds, 2) if seconds else None,
+        'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'p50': round(percentile(latencies, 50), 3) if latencies else None,
+        'p95': round(percentile(latencies, 95), 3) if latencies else None,
+        'p99': round(percentile(latencies, 99), 3) if latencies else None,
+        'max': round(latencies[-1], 3) if latencies else None,
+        'queries': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+class InProcessTransport:
+    """
+    Sends requests through Django's test client, one client per thread.
+    """
+    name = 'in-process'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def send(self, method, path, params, token):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(raise_request_exception=False)  # Errors are reported as 500s
+        if method == 'get':
+            response = client.get(path, params, HTTP_AUTHORIZATION=f'Bearer {token}')
+        else:
+            response = getattr(client, method)(path, HTTP_AUTHORIZATION=f'Bearer {token}')
+        response.close()
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class HttpTransport:
+    """
+    Sends requests to a running server, over one keep-alive connection per thread.
+    """
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Invalid server URL {base_url!r}.")
+        self.name = base_url
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host, self.port, self.prefix = parts.hostname, parts.port, parts.path.rstrip('/')
+        self.local = threading.local()
+
+    def send(self, method, path, params, token):
+        url = self.prefix + path + (f'?{urlencode(params)}' if params else '')
+        headers = {'Authorization': f'Bearer {token}', 'Content-Length': '0'}
+        for attempt in (1, 2):
+            connection = getattr(self.local, 'connection', None)
+            if connection is None:
+                connection = self.local.connection = self.connection_class(self.host, self.port, timeout=60)
+            try:
+                connection.request(method.upper(), url, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                return response.status, response.getheader('Server-Timing', '')
+            except (http.client.HTTPException, OSError):
+                # The server closed an idle keep-alive connection: reconnect once
+                connection.close()
+                self.local.connection = None
+                if attempt == 2:
+                    raise
+
+
+class ClientState:
+    # The benchmark's view of one client user and the IDs its requests pick from
+    def __init__(self, user_id, token, posts, users):
+        self.user_id, self.token, self.posts, self.users = user_id, token, posts, users
+
+
+def sample_ids(model, count, rng, **filters):
+    # About `count` random existing primary keys, without sorting the whole table
+    last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    if not last:
+        return []
+    candidates = rng.sample(range(1, last + 1), min(count * 2, last))
+    return list(model.objects.filter(pk__in=candidates, **filters).values_list('pk', flat=True)[:count])
+
+
+class Benchmark:
+    def __init__(self, transport, mix=None, clients=50, concurrency=1, pool=1000, seed=0):
+        self.transport = transport
+        self.mix = mix or DEFAULT_MIX
+        self.concurrency = concurrency
+        self.seed = seed
+        rng = random.Random(seed)
+
+        # Clients read their own feed: prefer users with a materialized timeline
+        client_ids = list(TimelineEntry.objects.values_list('user_id', flat=True).distinct().order_by('user_id')[:clients])
+        if len(client_ids) < clients:
+            client_ids += [pk for pk in sample_ids(User, clients, rng, is_active=True) if pk not in client_ids]
+        client_ids = client_ids[:clients]
+        if not client_ids:
+            raise ValueError("There are no users to send requests as; run generate_data first.")
+        post_ids = sample_ids(Post, pool, rng)
+        post_pool = list(Post.objects.filter(pk__in=post_ids).values_list('pk', 'author_id'))
+        if not post_pool and any(name in self.mix for name in ('post', 'like')):
+            raise ValueError("There are no posts to request; run generate_data first.")
+        user_pool = sample_ids(User, pool, rng, is_active=True)
+
+        self.clients = []
+        for user_id in client_ids:
+            token = AccessToken()
+            token.set_exp(lifetime=TOKEN_LIFETIME)
+            token['user_id'] = user_id
+            self.clients.append(ClientState(user_id, str(token), post_pool, user_pool))
+
+    def worker(self, index, budget, deadline, record):
+        rng = random.Random(self.seed * 1000 + index)
+        names, weights = zip(*self.mix.items())
+        try:
+            while budget() and time.perf_counter() < deadline:
+                name = rng.choices(names, weights=weights)[0]
+                build, expected = OPERATIONS[name]
+                state = rng.choice(self.clients)
+                method, path, params = build(state, rng)
+                started = time.perf_counter()
+                try:
+                    status, timing = self.transport.send(method, path, params, state.token)
+                except (http.client.HTTPException, OSError):
+                    record(name, time.perf_counter() - started, False, None, None)  # No response
+                    continue
+                match = QUERIES.search(timing)
+                record(name, time.perf_counter() - started, status in expected, int(match.group(1)) if match else None, status)
+        finally:
+            connections.close_all()  # This thread's database connections, opened by in-process requests
+
+    def run(self, requests=1000, duration=None, warmup=0):
+        """
+        Send `requests` requests (or as many as fit in `duration` seconds) after `warmup`
+        unrecorded ones. Returns the report as a dict.
+        """
+        if warmup:
+            self.replay(warmup, None)
+        samples, seconds = self.replay(requests, duration)
+        report = {
+            'target': self.transport.name,
+            'mix': self.mix,
+            'concurrency': self.concurrency,
+            'clients': len(self.clients),
+            'seconds': round(seconds, 3),
+            'total': summarize([sample[1:4] for sample in samples], seconds),
+            'operations': {},
+        }
+        for name in self.mix:
+            selected = [sample for sample in samples if sample[0] == name]
+            statuses = Counter(str(sample[4]) for sample in selected)
+            report['operations'][name] = {**summarize([sample[1:4] for sample in selected], seconds), 'statuses': dict(sorted(statuses.items()))}
+        return report
+
+    def replay(self, requests, duration):
+        # Run the workers; returns the (name, latency, ok, queries, status) samples and the elapsed time
+        samples, lock = [], threading.Lock()
+        remaining = [requests] if requests else None
+
+        def budget():
+            if remaining is None:
+                return True
+            with lock:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+                return True
+
+        def record(name, latency, ok, queries, status):
+            with lock:
+                samples.append((name, latency, ok, queries, status))
+
+        deadline = time.perf_counter() + duration if duration else math.inf
+        threads = [threading.Thread(target=self.worker, args=(index, budget, deadline, record)) for index in range(self.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - started
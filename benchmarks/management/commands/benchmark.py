@@ -0,0 +1,69 @@
+import json
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from benchmarks.harness import Benchmark, HttpTransport, InProcessTransport, DEFAULT_MIX, OPERATIONS, parse_mix
+
+
+def current_commit():
+    # The checked-out commit, so reports can be compared across commits
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a mix of feed, post list, post, like, follow and notification requests, in this process or against "
+        "a running server, and report p50/p95/p99 latency and throughput as JSON."
+    )
+
+    def add_arguments(self, parser):
+        mix = ','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items())
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000 (default: in this process, through the test client).")
+        parser.add_argument('--requests', type=int, default=1000, help="Requests to send (0 for no limit, with --duration).")
+        parser.add_argument('--duration', type=float, help="Stop after this many seconds.")
+        parser.add_argument('--warmup', type=int, default=50, help="Requests sent first and left out of the report.")
+        parser.add_argument('--concurrency', type=int, default=1, help="Concurrent clients. In this process, SQLite serializes writes, so keep it low.")
+        parser.add_argument('--clients', type=int, default=50, help="Users the requests are sent as, preferably users with a timeline.")
+        parser.add_argument('--mix', default=mix, help=f"Weighted operations among {', '.join(OPERATIONS)} (default {mix}).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the request sequence.")
+        parser.add_argument('--label', default='', help="Free text stored in the report, e.g. what is being compared.")
+        parser.add_argument('-o', '--output', help="File to write the JSON report to (standard output by default).")
+
+    def handle(self, *args, **options):
+        if not options['requests'] and not options['duration']:
+            raise CommandError("Give --requests or --duration.")
+        if options['concurrency'] < 1 or options['clients'] < 1:
+            raise CommandError("--concurrency and --clients must be positive.")
+        try:
+            mix = parse_mix(options['mix'])
+            transport = HttpTransport(options['url']) if options['url'] else InProcessTransport()
+            benchmark = Benchmark(transport, mix, clients=options['clients'], concurrency=options['concurrency'], seed=options['seed'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        report = {
+            'label': options['label'],
+            'commit': current_commit(),
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            **benchmark.run(options['requests'], options['duration'], options['warmup']),
+        }
+        output = json.dumps(report, indent=2) + '\n'
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output, ending='')
+
+        total = report['total']
+        self.stderr.write(
+            f"{total['requests']} requests in {report['seconds']}s: {total['throughput']} req/s, "
+            f"p50 {total['p50']} ms, p95 {total['p95']} ms, p99 {total['p99']} ms, {total['errors']} errors"
+        )
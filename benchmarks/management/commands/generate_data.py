@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from benchmarks.synthetic import Generator
+from social_media_api import caching
+
+
+class Command(BaseCommand):
+    help = "Append synthetic users, power-law follow edges, posts, comments, likes and notifications, for load tests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help="Users to create.")
+        parser.add_argument('--follows', type=int, default=200000, help="Follow edges, about.")
+        parser.add_argument('--posts', type=int, default=100000, help="Posts to create.")
+        parser.add_argument('--comments', type=int, default=200000, help="Comments, about.")
+        parser.add_argument('--likes', type=int, default=500000, help="Likes, about.")
+        parser.add_argument('--notifications', type=int, default=200000, help="Notifications, about.")
+        parser.add_argument('--timelines', type=int, default=1000, help="Users whose feed timeline is rebuilt (0 for none).")
+        parser.add_argument('--alpha', type=float, default=1.0, help="Power-law exponent of user popularity; higher is more skewed.")
+        parser.add_argument('--days', type=int, default=90, help="Period the timestamps are spread over, ending now.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed on the same database gives the same data.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows inserted per transaction.")
+        parser.add_argument('--password', default='password', help="Password of every generated user.")
+        parser.add_argument('--prefix', default='synthetic', help="Username prefix, followed by the user ID.")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--users and --batch-size must be positive.")
+        generator = Generator(
+            seed=options['seed'], days=options['days'], alpha=options['alpha'], batch_size=options['batch_size'],
+            password=options['password'], prefix=options['prefix'], log=self.stdout.write,
+        )
+        started = time.perf_counter()
+        generator.users(options['users'])
+        generator.follows(options['follows'])
+        generator.posts(options['posts'], comments=options['comments'], likes=options['likes'])
+        generator.notifications(options['notifications'])
+        generator.reset_sequences()
+        caching.bump_all()  # Rows are inserted without signals
+        if options['timelines']:
+            generator.timelines(options['timelines'])
+        total = sum(generator.counts.values())
+        self.stdout.write(self.style.SUCCESS(f"Generated {total} rows in {time.perf_counter() - started:.1f}s."))
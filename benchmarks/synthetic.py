@@ -0,0 +1,311 @@
+import itertools
+import json
+import random
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from notifications.models import Notification, NotificationActor
+from posts import threads, timeline
+from posts.models import Post, Comment, Like
+from social_media_api import caching
+
+User = get_user_model()  # Custom user model
+Follow = User.followers.through  # from_customuser is the followed user, to_customuser the follower
+
+# Synthetic data for load tests.
+#
+# Generator appends users, follow edges, posts, comments, likes and notifications to the
+# database, reproducibly for a given seed. Rows are built as plain tuples with their IDs
+# assigned up front and written with one executemany() per batch, skipping model
+# instances and signals, so millions of rows take minutes. The denormalized counters are
+# computed while generating and stored with the rows, so no reconcile_counters run is
+# needed afterwards. The full-text index follows through its triggers; timelines are
+# rebuilt for a sample of users only (see Generator.timelines).
+#
+# Popularity follows a power law: the user of rank r (by ID) is followed with a weight
+# proportional to 1 / r**alpha, so a few users have most of the followers, as on real
+# networks, and the busiest ones take the celebrity path of the feed. Posting activity
+# is skewed the same way, more gently, and likes and comments per post are Pareto
+# distributed.
+
+ACTIVITY_ALPHA = 0.5  # Skew of the number of posts per user
+PARETO_SHAPE = 1.5  # Tail of likes and comments per post; a mean of SHAPE / (SHAPE - 1)
+REPLY_RATE = 0.3  # Share of comments replying to an earlier comment of the post
+FOLLOW_DRAWS = 5  # Rounds of drawing followed users, topping up after duplicates
+READ_RATE = 0.7  # Share of notifications already read
+VERBS = [('liked your post', 0.5), ('followed you', 0.3), ('commented on your post', 0.2)]  # Notification mix
+
+
+class BatchWriter:
+    """
+    Collects the rows of one table and writes them with executemany(), a transaction per
+    batch, after flushing the writers of the rows they reference (`after`).
+    """
+    def __init__(self, model, columns, batch_size, after=()):
+        quote = connection.ops.quote_name
+        self.sql = (
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        self.batch_size = batch_size
+        self.after = after
+        self.rows = []
+        self.written = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for writer in self.after:
+            writer.flush()
+        if self.rows:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(self.sql, self.rows)
+            self.written += len(self.rows)
+            self.rows = []
+
+
+def cumulative_weights(count, alpha):
+    # Zipf weights 1 / rank**alpha of `count` items, accumulated for random.choices() and bisect
+    return list(itertools.accumulate(1 / (rank ** alpha) for rank in range(1, count + 1)))
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Generator:
+    def __init__(self, seed=0, days=90, alpha=1.0, batch_size=5000, password='password', prefix='synthetic', log=None):
+        self.random = random.Random(seed)
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.password = password
+        self.prefix = prefix
+        self.log = log or (lambda message: None)
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=days)
+        self.adapt_datetime = connection.ops.adapt_datetimefield_value  # Looked up once: connection is a thread-local proxy
+        self.user_ids = range(0)  # IDs of the generated users, most popular first
+        self.post_ids = range(0)
+        self.post_authors = array('q')  # Author of each generated post, by position in post_ids
+        self.counts = {}  # Rows written per table
+
+    def timestamp(self, position, total):
+        # Times spread over the period in generation order, so IDs and dates grow together
+        moment = self.start + (self.end - self.start) * ((position + self.random.random()) / max(total, 1))
+        return self.adapt_datetime(moment)
+
+    def heavy_tailed(self, mean):
+        # Pareto distributed count with the given mean, rounded at random so small means keep their value
+        return int(mean / (PARETO_SHAPE / (PARETO_SHAPE - 1)) * self.random.paretovariate(PARETO_SHAPE) + self.random.random())
+
+    def report(self, name, written, started):
+        elapsed = time.perf_counter() - started
+        self.counts[name] = written
+        self.log(f"{name}: {written} rows in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} rows/s)")
+
+    def users(self, count):
+        started = time.perf_counter()
+        first = next_id(User)
+        self.user_ids = range(first, first + count)
+        password = make_password(self.password)  # One hash shared by every generated user
+        writer = BatchWriter(User, [
+            'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'is_staff', 'is_active',
+            'date_joined', 'email', 'bio', 'follower_count', 'following_count', 'unread_notification_count', 'notification_version', 'version',
+        ], self.batch_size)
+        for position, pk in enumerate(self.user_ids):
+            username = f'{self.prefix}{pk}'
+            writer.add((pk, password, False, username, '', '', False, True,
+                        self.timestamp(position, count), f'{username}@example.com', '', 0, 0, 0, 0, caching.new_version()))
+        writer.flush()
+        self.report('users', writer.written, started)
+
+    def follows(self, count):
+        """
+        About `count` follow edges, `count / users` per user on average, with followed users
+        drawn by power-law popularity.
+        """
+        started = time.perf_counter()
+        users = len(self.user_ids)
+        if users < 2 or not count:
+            return
+        weights = cumulative_weights(users, self.alpha)
+        followers, following = array('q', [0]) * users, array('q', [0]) * users
+        writer = BatchWriter(Follow, ['id', 'from_customuser_id', 'to_customuser_id'], self.batch_size)
+        pk = next_id(Follow)
+        mean = count / users
+        for follower in range(users):
+            wanted = min(round(self.random.expovariate(1 / mean)), users - 1)
+            if not wanted:
+                continue
+            targets = set()
+            for _ in range(FOLLOW_DRAWS):
+                # Popular users come up again and again: draw again for the duplicates
+                targets.update(self.random.choices(range(users), cum_weights=weights, k=wanted - len(targets)))
+                targets.discard(follower)
+                if len(targets) >= wanted:
+                    break
+            for followed in sorted(targets):
+                writer.add((pk, self.user_ids[followed], self.user_ids[follower]))
+                pk += 1
+                followers[followed] += 1
+            following[follower] += len(targets)
+        writer.flush()
+        self.update_users({'follower_count': followers, 'following_count': following})
+        self.report('follows', writer.written, started)
+
+    def posts(self, count, comments=0, likes=0):
+        """
+        `count` posts, each written with its likes and comments (about `likes` and
+        `comments` in all), so their counters are known when the post row is written.
+        """
+        started = time.perf_counter()
+        users = len(self.user_ids)
+        if not users or not count:
+            return
+        authors = cumulative_weights(users, ACTIVITY_ALPHA)
+        max_depth = settings.COMMENT_MAX_DEPTH
+
+        post_writer = BatchWriter(Post, [
+            'id', 'title', 'content', 'author_id', 'media', 'created_at', 'updated_at', 'like_count', 'comment_count', 'version',
+        ], self.batch_size)
+        like_writer = BatchWriter(Like, ['id', 'user_id', 'post_id'], self.batch_size, after=[post_writer])
+        comment_writer = BatchWriter(Comment, [
+            'id', 'post_id', 'author_id', 'parent_id', 'content', 'created_at', 'updated_at', 'path', 'depth', 'reply_count',
+        ], self.batch_size, after=[post_writer])
+        post_pk, like_pk, comment_pk = next_id(Post), next_id(Like), next_id(Comment)
+        self.post_ids = range(post_pk, post_pk + count)
+        self.post_authors = array('q')
+
+        for position, post_pk in enumerate(self.post_ids):
+            author = self.user_ids[bisect_left(authors, self.random.random() * authors[-1])]
+            self.post_authors.append(author)
+            created = self.timestamp(position, count)
+
+            # Likes by distinct users other than the author
+            wanted = min(self.heavy_tailed(likes / count), users)
+            likers = [user for user in self.random.sample(self.user_ids, wanted) if user != author]
+
+            # Comments in creation order, some replying to an earlier comment of the post
+            thread = []  # [pk, parent_pk, path, depth, reply_count, author] of this post's comments
+            for _ in range(self.heavy_tailed(comments / count)):
+                parent = self.random.choice(thread) if thread and self.random.random() < REPLY_RATE else None
+                if parent is not None and parent[3] >= max_depth:
+                    parent = None
+                path = (parent[2] if parent else '') + threads.encode(comment_pk)
+                thread.append([comment_pk, parent[0] if parent else None, path, parent[3] + 1 if parent else 0, 0,
+                               self.random.choice(self.user_ids)])
+                if parent is not None:
+                    parent[4] += 1
+                comment_pk += 1
+
+            # The post before its likes and comments, which flush the posts first
+            post_writer.add((post_pk, f'Post {post_pk} by user {author}', f'Synthetic post number {post_pk}.',
+                             author, '', created, created, len(likers), len(thread), caching.new_version()))
+            for user in likers:
+                like_writer.add((like_pk, user, post_pk))
+                like_pk += 1
+            for pk, parent_pk, path, depth, reply_count, commenter in thread:
+                comment_writer.add((pk, post_pk, commenter, parent_pk, f'Comment {pk} by user {commenter}',
+                                    created, created, path, depth, reply_count))
+
+        like_writer.flush()
+        comment_writer.flush()
+        self.report('posts', post_writer.written, started)
+        self.counts.update(likes=like_writer.written, comments=comment_writer.written)
+        self.log(f"likes: {like_writer.written} rows, comments: {comment_writer.written} rows")
+
+    def notifications(self, count):
+        """
+        `count` likes, follows and comments notified, READ_RATE of them already read.
+        """
+        started = time.perf_counter()
+        users = len(self.user_ids)
+        if users < 2 or not count:
+            return
+        popularity = cumulative_weights(users, self.alpha)
+        post_type, user_type = ContentType.objects.get_for_model(Post).id, ContentType.objects.get_for_model(User).id
+        verbs, verb_weights = zip(*VERBS)
+        unread = array('q', [0]) * users
+        first_user = self.user_ids[0]
+        writer = BatchWriter(Notification, [
+            'id', 'recipient_id', 'actor_id', 'actor_count', 'recent_actors', 'verb', 'target_content_type_id',
+            'target_object_id', 'is_read', 'timestamp',
+        ], self.batch_size)
+        actor_writer = BatchWriter(NotificationActor, ['notification_id', 'actor_id'], self.batch_size, after=(writer,))
+        pk = next_id(Notification)
+        for position in range(count):
+            verb = self.random.choices(verbs, weights=verb_weights)[0]
+            if verb == 'followed you' or not self.post_ids:
+                verb = 'followed you'
+                recipient = self.user_ids[bisect_left(popularity, self.random.random() * popularity[-1])]
+                target_type, target_id = user_type, recipient
+            else:
+                index = self.random.randrange(len(self.post_ids))
+                recipient = self.post_authors[index]
+                target_type, target_id = post_type, self.post_ids[index]
+            actor = self.random.choice(self.user_ids)
+            if actor == recipient:
+                continue
+            is_read = self.random.random() < READ_RATE
+            if not is_read:
+                unread[recipient - first_user] += 1
+            writer.add((pk, recipient, actor, 1, json.dumps([actor]), verb, target_type, target_id, is_read,
+                        self.timestamp(position, count)))
+            actor_writer.add((pk, actor))
+            pk += 1
+        actor_writer.flush()
+        self.update_users({'unread_notification_count': unread})
+        self.report('notifications', writer.written, started)
+
+    def update_users(self, counters):
+        # Store per-user counters computed while generating, one executemany per batch
+        quote = connection.ops.quote_name
+        columns = list(counters)
+        sql = (
+            f"UPDATE {quote(User._meta.db_table)} SET {', '.join(f'{quote(column)} = %s' for column in columns)} "
+            f"WHERE {quote('id')} = %s"
+        )
+        rows = (
+            tuple(counters[column][index] for column in columns) + (pk,)
+            for index, pk in enumerate(self.user_ids)
+            if any(counters[column][index] for column in columns)
+        )
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+
+    def timelines(self, count):
+        """
+        Rebuild the timelines of `count` generated users who follow someone, the ones
+        benchmark reads feeds as. Timelines for everyone: rebuild_timeline --all.
+        """
+        started = time.perf_counter()
+        readers = list(
+            User.objects.filter(pk__in=self.user_ids, following_count__gt=0)
+            .order_by('pk').only('id')[:count]
+        )
+        written = 0
+        for user in readers:
+            with transaction.atomic():
+                written += timeline.rebuild_timeline(user)
+        self.report('timeline entries', written, started)
+
+    def reset_sequences(self):
+        # Databases with sequences (e.g. PostgreSQL) would otherwise hand out the generated IDs again
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Follow, Post, Comment, Like, Notification])
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
@@ -0,0 +1,81 @@
+import io
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from notifications.models import Notification, NotificationActor
+from posts import threads
+from posts.models import Post, Comment, Like, TimelineEntry
+from .harness import parse_mix, percentile, summarize
+from .synthetic import Generator
+
+User = get_user_model()  # Custom user model
+Follow = User.followers.through  # from_customuser is the followed user, to_customuser the follower
+
+
+class GeneratorTests(TestCase):
+    def generate(self, seed=0):
+        generator = Generator(seed=seed, batch_size=17)
+        generator.users(30)
+        generator.follows(150)
+        generator.posts(60, comments=120, likes=200)
+        generator.notifications(100)
+        generator.reset_sequences()
+        return generator
+
+    def snapshot(self):
+        # The generated rows, without the timestamps and password hashes that differ from run to run
+        return {
+            'follows': list(Follow.objects.order_by('pk').values_list('from_customuser_id', 'to_customuser_id')),
+            'posts': list(Post.objects.order_by('pk').values_list('pk', 'author_id', 'like_count', 'comment_count')),
+            'comments': list(Comment.objects.order_by('pk').values_list('pk', 'post_id', 'author_id', 'parent_id', 'path', 'depth')),
+            'likes': list(Like.objects.order_by('pk').values_list('user_id', 'post_id')),
+            'notifications': list(Notification.objects.order_by('pk').values_list('recipient_id', 'actor_id', 'verb', 'is_read')),
+        }
+
+    def test_counters_match_the_rows(self):
+        generator = self.generate()
+        self.assertEqual(generator.counts['likes'], Like.objects.count())
+        self.assertEqual(generator.counts['comments'], Comment.objects.count())
+        self.assertEqual(NotificationActor.objects.count(), Notification.objects.count())
+
+        out = io.StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue().count(' 0 drifted.'), 3)
+
+        # Replies sit inside the thread of the comment they answer
+        paths = dict(Comment.objects.values_list('pk', 'path'))
+        for pk, parent_id, path, depth in Comment.objects.values_list('pk', 'parent_id', 'path', 'depth'):
+            self.assertEqual(path, (paths[parent_id] if parent_id else '') + threads.encode(pk))
+            self.assertEqual(len(path), (depth + 1) * threads.STEP)
+
+    def test_seed_reproduces_the_data(self):
+        self.generate(seed=7)
+        first = self.snapshot()
+        self.assertTrue(all(first.values()))
+        User.objects.all().delete()
+        self.generate(seed=7)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_command_rebuilds_sample_timelines(self):
+        call_command(
+            'generate_data', '--users', '20', '--follows', '80', '--posts', '40', '--comments', '0', '--likes', '0',
+            '--notifications', '0', '--timelines', '3', stdout=io.StringIO(),
+        )
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(TimelineEntry.objects.values('user').distinct().count(), 3)
+
+
+class HarnessTests(TestCase):
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('feed=3, like'), {'feed': 3.0, 'like': 1.0})
+        for value in ('feed=x', 'unknown=1', 'feed=0'):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_mix(value)
+
+    def test_summarize(self):
+        samples = [(index / 1000, index != 100, 3) for index in range(1, 101)]
+        summary = summarize(samples, 2)
+        self.assertEqual((summary['requests'], summary['errors'], summary['throughput']), (100, 1, 50))
+        self.assertEqual((summary['p50'], summary['p95'], summary['p99'], summary['max']), (50, 95, 99, 100))
+        self.assertEqual(summary['queries'], 3)
+        self.assertIsNone(percentile([], 50))
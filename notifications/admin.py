@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notification
+from .models import Notification, NotificationEvent
 
 # Register your models here.
 class NotificationAdmin(admin.ModelAdmin):
@@ -8,4 +8,11 @@ class NotificationAdmin(admin.ModelAdmin):
     search_fields = ('verb','timestamp')
 
 
-admin.site.register(Notification, NotificationAdmin)
\ No newline at end of file
+class NotificationEventAdmin(admin.ModelAdmin):
+    list_display = ('idempotency_key', 'recipient', 'actor', 'verb', 'status', 'attempts', 'created_at', 'processed_at')
+    list_filter = ('status', 'verb')
+    search_fields = ('idempotency_key', 'last_error')
+
+
+admin.site.register(Notification, NotificationAdmin)
+admin.site.register(NotificationEvent, NotificationEventAdmin)
\ No newline at end of file
@@ -0,0 +1,42 @@
+from collections import Counter
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from posts.counters import shifted
+from .models import Notification
+
+User = get_user_model()  # Custom user model
+
+
+def adjust_unread_count(user_id, delta):
+    """
+    Apply a delta to a user's unread_notification_count in a single UPDATE, which also moves
+    their notification_version: the notification list's ETag changes with any notification
+    read, unread, delivered or removed, even when the unread count ends up where it was.
+    """
+    if delta:
+        User.objects.filter(pk=user_id).update(
+            unread_notification_count=shifted('unread_notification_count', delta),
+            notification_version=F('notification_version') + 1,
+        )
+
+
+def count_new_notifications(recipient_ids):
+    # One UPDATE per distinct recipient of a delivered batch
+    for recipient_id, total in Counter(recipient_ids).items():
+        adjust_unread_count(recipient_id, total)
+
+
+def unread_count():
+    # Actual number of unread notifications per user, as a correlated subquery
+    counts = (
+        Notification.objects.filter(recipient=OuterRef('pk'), is_read=False)
+        .order_by().values('recipient').annotate(total=Count('*')).values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def touch_notifications(user_ids):
+    # Move the notification_version of users whose notifications changed without a change of their unread count
+    if user_ids:
+        User.objects.filter(pk__in=user_ids).update(notification_version=F('notification_version') + 1)
@@ -0,0 +1,271 @@
+import logging
+import uuid
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from .counters import adjust_unread_count, count_new_notifications, touch_notifications
+from .models import Notification, NotificationActor, NotificationEvent
+from .streams import publish
+
+logger = logging.getLogger(__name__)
+
+# Notification outbox.
+#
+# Views call notify(), which only appends one narrow row to the NotificationEvent table,
+# inside the caller's transaction. A worker (the process_notifications command) drains
+# the outbox in batches: each batch is claimed with a conditional UPDATE, turned into
+# Notification rows with a single bulk_create and marked done in the same transaction,
+# so a crash never creates a notification twice. Failed events are retried with
+# exponential backoff, and the idempotency key stops duplicate events being enqueued.
+#
+# With NOTIFICATIONS_AGGREGATE, events sharing (recipient, verb, target) within
+# NOTIFICATIONS_AGGREGATION_WINDOW seconds are coalesced into a single notification
+# ("alice and 41 others liked your post") that is updated in place. Its actors are recorded
+# in NotificationActor, so actor_count counts each of them once.
+
+
+def notify(recipient, actor, verb, target, key=None):
+    """
+    Queue a notification for delivery by the dispatch worker.
+    Events with a key that was already queued are ignored.
+    """
+    notify_many([(recipient.pk, actor.pk, verb, target, key)])
+
+
+def notify_many(events):
+    """
+    Queue several notifications with one insert.
+    events are (recipient_id, actor_id, verb, target, key) tuples, as for notify().
+    """
+    NotificationEvent.objects.bulk_create([
+        NotificationEvent(
+            idempotency_key=key or uuid.uuid4().hex,
+            recipient_id=recipient_id,
+            actor_id=actor_id,
+            verb=verb,
+            target_content_type=ContentType.objects.get_for_model(target),
+            target_object_id=target.pk,
+        )
+        for recipient_id, actor_id, verb, target, key in events
+    ], ignore_conflicts=True)
+
+
+def fail_abandoned(now):
+    # Events whose worker died during their last attempt are not claimed again: mark them failed
+    failed = NotificationEvent.objects.filter(
+        status=NotificationEvent.PROCESSING, available_at__lte=now, attempts__gte=settings.NOTIFICATIONS_MAX_ATTEMPTS,
+    ).update(status=NotificationEvent.FAILED, last_error='Lease expired during the last attempt')
+    if failed:
+        logger.error("%s notification events failed: their lease expired during the last attempt", failed)
+
+
+def claim(batch_size):
+    # Take ownership of due events, including those whose previous worker's lease expired,
+    # unless they already had all their attempts
+    now = timezone.now()
+    fail_abandoned(now)
+    due = (Q(status=NotificationEvent.PENDING) | Q(status=NotificationEvent.PROCESSING)) & Q(
+        available_at__lte=now, attempts__lt=settings.NOTIFICATIONS_MAX_ATTEMPTS,
+    )
+    ids = list(NotificationEvent.objects.filter(due).order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    NotificationEvent.objects.filter(due, id__in=ids).update(
+        status=NotificationEvent.PROCESSING,
+        claim_token=token,
+        attempts=F('attempts') + 1,
+        available_at=now + timedelta(seconds=settings.NOTIFICATIONS_LEASE),
+    )
+    return list(NotificationEvent.objects.filter(claim_token=token, status=NotificationEvent.PROCESSING).order_by('id'))
+
+
+def group_key(item):
+    # Events with the same key inside the aggregation window share one notification
+    return (item.recipient_id, item.verb, item.target_content_type_id, item.target_object_id)
+
+
+def merge_actors(notification, actor_ids, known=()):
+    # Count each actor once, however long ago they last acted (known: the actors already
+    # counted), and keep the most recent ones first. Returns the actors counted for the first time
+    new = []
+    for actor_id in actor_ids:
+        if actor_id not in known and actor_id not in new:
+            new.append(actor_id)
+        notification.recent_actors = [actor_id] + [pk for pk in notification.recent_actors if pk != actor_id]
+    notification.actor_count += len(new)
+    notification.recent_actors = notification.recent_actors[:settings.NOTIFICATIONS_RECENT_ACTORS]
+    notification.actor_id = actor_ids[-1]
+    return new
+
+
+def detach_actor(user, batch_size=None):
+    """
+    Take a user out of the notifications they acted on, before the user is deleted: a coalesced
+    notification passes to its next most recent actor and counts one actor less, and one left
+    without actors is deleted, off its recipient's unread counter. Handles at most batch_size
+    notifications and returns their number.
+    """
+    acted = NotificationActor.objects.filter(actor=user).values('notification_id')
+    notifications = (
+        Notification.objects.filter(Q(actor=user) | Q(pk__in=acted)).order_by('pk')
+        .only('pk', 'recipient_id', 'actor_id', 'actor_count', 'recent_actors', 'is_read')
+    )
+    notifications = list(notifications[:batch_size] if batch_size else notifications)
+    if not notifications:
+        return 0
+
+    # Actors beyond recent_actors, for notifications whose recent actors all leave: the last one counted
+    without_recent = [notification.pk for notification in notifications if not [pk for pk in notification.recent_actors if pk != user.pk]]
+    earlier = dict(
+        NotificationActor.objects.filter(notification_id__in=without_recent).exclude(actor=user)
+        .order_by('pk').values_list('notification_id', 'actor_id')
+    ) if without_recent else {}
+
+    kept, removed = [], []
+    for notification in notifications:
+        recent = [pk for pk in notification.recent_actors if pk != user.pk]
+        if notification.actor_id == user.pk:
+            notification.actor_id = recent[0] if recent else earlier.get(notification.pk)
+        if notification.actor_id is None:
+            removed.append(notification)
+            continue
+        notification.recent_actors = recent or [notification.actor_id]
+        notification.actor_count = max(notification.actor_count - 1, 1)
+        kept.append(notification)
+
+    Notification.objects.bulk_update(kept, ['actor', 'actor_count', 'recent_actors'])
+    NotificationActor.objects.filter(actor=user, notification_id__in=[notification.pk for notification in kept]).delete()
+    Notification.objects.filter(pk__in=[notification.pk for notification in removed]).delete()  # With their NotificationActor rows
+    unread = Counter(notification.recipient_id for notification in removed if not notification.is_read)
+    for recipient_id, total in unread.items():
+        adjust_unread_count(recipient_id, -total)
+    touch_notifications({notification.recipient_id for notification in notifications} - unread.keys())
+    return len(notifications)
+
+
+def known_actors(notifications, actor_ids):
+    # Actors already counted on coalesced notifications, {notification ID: {actor IDs}}, in one query
+    known = {}
+    rows = NotificationActor.objects.filter(
+        notification_id__in=[notification.pk for notification in notifications], actor_id__in=actor_ids,
+    ).values_list('notification_id', 'actor_id')
+    for notification_id, actor_id in rows:
+        known.setdefault(notification_id, set()).add(actor_id)
+    return known
+
+
+def open_notifications(groups):
+    # Latest notification of every group still inside the aggregation window, in one query
+    cutoff = timezone.now() - timedelta(seconds=settings.NOTIFICATIONS_AGGREGATION_WINDOW)
+    candidates = Notification.objects.filter(
+        recipient_id__in={key[0] for key in groups},
+        verb__in={key[1] for key in groups},
+        timestamp__gte=cutoff,
+    ).order_by('timestamp', 'id')
+    return {group_key(notification): notification for notification in candidates if group_key(notification) in groups}
+
+
+def deliver(events):
+    # Create or coalesce the notifications of a batch and mark its events done, all or nothing
+    with transaction.atomic():
+        groups = {}
+        for event in events:
+            # Without aggregation every event gets a group, and so a notification, of its own
+            key = group_key(event) if settings.NOTIFICATIONS_AGGREGATE else group_key(event) + (event.id,)
+            groups.setdefault(key, []).append(event.actor_id)
+
+        existing = open_notifications(groups) if settings.NOTIFICATIONS_AGGREGATE else {}
+        known = known_actors(existing.values(), {event.actor_id for event in events}) if existing else {}
+        now = timezone.now()
+        created, updated, newly_unread, new_actors = [], [], [], []
+        for key, actor_ids in groups.items():
+            notification = existing.get(key)
+            if notification is None:
+                recipient_id, verb, target_content_type_id, target_object_id = key[:4]
+                notification = Notification(
+                    recipient_id=recipient_id, verb=verb, actor_count=0, recent_actors=[],
+                    target_content_type_id=target_content_type_id, target_object_id=target_object_id,
+                )
+                new_actors.append((notification, merge_actors(notification, actor_ids)))
+                created.append(notification)
+                newly_unread.append(recipient_id)
+            else:
+                # Update in place and bring the notification back to the top of the list as unread
+                if notification.is_read:
+                    newly_unread.append(notification.recipient_id)
+                new_actors.append((notification, merge_actors(notification, actor_ids, known.get(notification.pk, ()))))
+                notification.is_read = False
+                notification.timestamp = now
+                updated.append(notification)
+
+        Notification.objects.bulk_create(created)
+        Notification.objects.bulk_update(updated, ['actor', 'actor_count', 'recent_actors', 'is_read', 'timestamp'])
+        NotificationActor.objects.bulk_create([
+            NotificationActor(notification_id=notification.pk, actor_id=actor_id)
+            for notification, actor_ids in new_actors for actor_id in actor_ids
+        ])
+        NotificationEvent.objects.filter(id__in=[event.id for event in events]).update(
+            status=NotificationEvent.DONE, processed_at=now, last_error='',
+        )
+        count_new_notifications(newly_unread)
+        # Wake the open notification streams of the recipients
+        recipient_ids = [key[0] for key in groups]
+        transaction.on_commit(lambda: publish(recipient_ids))
+
+
+def retry_later(event, error):
+    if event.attempts >= settings.NOTIFICATIONS_MAX_ATTEMPTS:
+        status, available_at = NotificationEvent.FAILED, timezone.now()
+        logger.error("Notification event %s failed after %s attempts: %s", event.idempotency_key, event.attempts, error)
+    else:
+        delay = settings.NOTIFICATIONS_RETRY_DELAY * 2 ** (event.attempts - 1)
+        status, available_at = NotificationEvent.PENDING, timezone.now() + timedelta(seconds=delay)
+        logger.warning("Notification event %s failed, retrying in %ss: %s", event.idempotency_key, delay, error)
+    NotificationEvent.objects.filter(pk=event.pk).update(status=status, available_at=available_at, last_error=str(error))
+
+
+def drain(batch_size=None):
+    """
+    Deliver one batch of due events. Returns the number of events processed.
+    """
+    events = claim(batch_size or settings.NOTIFICATIONS_BATCH_SIZE)
+    if not events:
+        return 0
+    try:
+        deliver(events)
+    except Exception:
+        # Deliver one by one, so a single bad event does not hold back the rest of the batch;
+        # whatever goes wrong, each failure counts as an attempt of its event
+        for event in events:
+            try:
+                deliver([event])
+            except Exception as error:
+                retry_later(event, error)
+    return len(events)
+
+
+def queue_stats():
+    """
+    Queue depth per status and the lag of the oldest undelivered event, in seconds.
+    """
+    counts = {NotificationEvent.PENDING: 0, NotificationEvent.PROCESSING: 0, NotificationEvent.FAILED: 0}
+    for row in NotificationEvent.objects.exclude(status=NotificationEvent.DONE).order_by().values('status').annotate(total=Count('*')):
+        counts[row['status']] = row['total']
+    oldest = NotificationEvent.objects.filter(
+        status__in=[NotificationEvent.PENDING, NotificationEvent.PROCESSING]
+    ).aggregate(oldest=Min('created_at'))['oldest']
+    lag = (timezone.now() - oldest).total_seconds() if oldest else 0.0
+    return {**counts, 'lag_seconds': round(lag, 3)}
+
+
+def purge(older_than):
+    """
+    Delete delivered events processed before the given time. Returns the number deleted.
+    """
+    deleted, _ = NotificationEvent.objects.filter(status=NotificationEvent.DONE, processed_at__lt=older_than).delete()
+    return deleted
@@ -0,0 +1,39 @@
+import json
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from notifications import dispatch
+
+
+class Command(BaseCommand):
+    help = "Deliver queued notification events in batches until interrupted (or once with --once)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--batch-size', type=int, default=None, help="Events delivered per batch.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--purge-days', type=int, default=7, help="Delete delivered events older than this many days.")
+        parser.add_argument('--stats', action='store_true', help="Print queue depth and lag as JSON and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(dispatch.queue_stats()))
+            return
+
+        delivered = 0
+        try:
+            while True:
+                processed = dispatch.drain(options['batch_size'])
+                delivered += processed
+                if processed:
+                    continue
+                purged = dispatch.purge(timezone.now() - timedelta(days=options['purge_days']))
+                if purged:
+                    self.stdout.write(f"Purged {purged} delivered events.")
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {delivered} notification events."))
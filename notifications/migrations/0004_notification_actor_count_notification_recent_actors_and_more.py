@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_recent_actors(apps, schema_editor):
+    Notification = apps.get_model('notifications', 'Notification')
+    batch = []
+    for notification in Notification.objects.only('id', 'actor_id').iterator(chunk_size=1000):
+        notification.recent_actors = [notification.actor_id]
+        batch.append(notification)
+        if len(batch) >= 1000:
+            Notification.objects.bulk_update(batch, ['recent_actors'])
+            batch = []
+    Notification.objects.bulk_update(batch, ['recent_actors'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('notifications', '0003_notificationevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='recent_actors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'timestamp'], name='notif_recipient_time'),
+        ),
+        migrations.RunPython(populate_recent_actors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_actors(apps, schema_editor):
+    # Earlier actors than the recent ones are unknown: they keep being counted in actor_count
+    Notification = apps.get_model('notifications', 'Notification')
+    NotificationActor = apps.get_model('notifications', 'NotificationActor')
+    batch = []
+    for notification_id, recent_actors in Notification.objects.values_list('id', 'recent_actors').iterator(chunk_size=1000):
+        batch.extend(NotificationActor(notification_id=notification_id, actor_id=actor_id) for actor_id in recent_actors)
+        if len(batch) >= 1000:
+            NotificationActor.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    NotificationActor.objects.bulk_create(batch, ignore_conflicts=True)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_notification_actor_count_notification_recent_actors_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='notifications.notification')),
+            ],
+            options={
+                'unique_together': {('notification', 'actor')},
+            },
+        ),
+        migrations.RunPython(populate_actors, migrations.RunPython.noop),
+    ]
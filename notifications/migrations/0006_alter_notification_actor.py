@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notificationactor'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='actor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='actions', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -3,13 +3,18 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
 User = get_user_model()  # Custom user model
 
 # Model for managing notifications
 class Notification(models.Model):
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
-    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='actions')
+    # The most recent actor when events are coalesced. A deleted actor is replaced by the next one, or
+    # the notification is deleted when none is left (see notifications.dispatch.detach_actor)
+    actor = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='actions')
+    actor_count = models.PositiveIntegerField(default=1)  # Number of distinct actors coalesced into this notification, see NotificationActor
+    recent_actors = models.JSONField(default=list, blank=True)  # IDs of the most recent actors, newest first
     verb = models.CharField(max_length=100)  # Describes the action (e.g., "liked", "followed", "commented on")
     
     # GenericForeignKey setup
@@ -17,7 +22,60 @@ class Notification(models.Model):
     target_object_id = models.PositiveIntegerField()
     target = GenericForeignKey('target_content_type', 'target_object_id')  # This allows notifications to point to any model
     is_read = models.BooleanField(default=False)
-    timestamp = models.DateTimeField(auto_now_add=True)  # When the notification was created
+    timestamp = models.DateTimeField(auto_now_add=True)  # When the notification was created, or last coalesced with a new event
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'is_read', '-timestamp'], name='notif_recipient_read_time'),  # Keyset pagination of a user's list
+            models.Index(fields=['recipient', 'timestamp'], name='notif_recipient_time'),  # Coalescing window lookups and stream catch-up
+        ]
 
     def __str__(self):
         return f'{self.actor} {self.verb} {self.target}'
+
+# Actors coalesced into a notification, one row each however often they act: counts actor_count
+# distinctly beyond the recent_actors kept on the notification (see notifications.dispatch)
+class NotificationActor(models.Model):
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='+')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = ['notification', 'actor']
+
+    def __str__(self):
+        return f'{self.actor_id} on {self.notification_id}'
+
+# Outbox of notifications waiting to be created by the dispatch worker (see notifications.dispatch)
+class NotificationEvent(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    idempotency_key = models.CharField(max_length=150, unique=True)  # Enqueuing the same key twice creates a single notification
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    verb = models.CharField(max_length=100)
+    target_content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    target_object_id = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Not picked up before this time (retry backoff or worker lease)
+    claim_token = models.CharField(max_length=32, blank=True)  # Identifies the worker batch currently processing the event
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='notif_event_status_available'),
+        ]
+
+    def __str__(self):
+        return f'{self.idempotency_key} ({self.status})'
@@ -1,17 +1,27 @@
 from rest_framework import serializers
 from notifications.models import Notification
+from social_media_api.instrumentation import TimedSerializerMixin
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     recipient = serializers.PrimaryKeyRelatedField(read_only=True)  # recipient is a foreign key
     actor = serializers.PrimaryKeyRelatedField(read_only=True)  # actor is a foreign key
     target = serializers.SerializerMethodField()  # Custom field to serialize 'target'
     timestamp = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S', read_only=True)  # Only read the timestamp
+    summary = serializers.SerializerMethodField()  # e.g. "alice and 41 others liked your post"
 
     class Meta:
         model = Notification
-        fields =  ['id', 'recipient', 'actor', 'verb', 'target', 'is_read', 'timestamp']
+        fields =  ['id', 'recipient', 'actor', 'actor_count', 'recent_actors', 'verb', 'summary', 'target', 'is_read', 'timestamp']
+
+    # Human readable text of a (possibly coalesced) notification; list views should select_related('actor')
+    def get_summary(self, obj):
+        others = obj.actor_count - 1
+        if others <= 0:
+            return f'{obj.actor} {obj.verb}'
+        return f'{obj.actor} and {others} {"other" if others == 1 else "others"} {obj.verb}'
     
-     # Custom method to serialize the 'target' field (which is a GenericForeignKey)
+     # Custom method to serialize the 'target' field (which is a GenericForeignKey).
+     # List views should prefetch_related('target') so targets are resolved in batches.
     def get_target(self, obj):
         target_obj = obj.target
 
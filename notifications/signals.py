@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from .dispatch import detach_actor
+
+User = get_user_model()  # Custom user model
+
+
+# Take a deleted user out of the notifications they acted on, which do not cascade: coalesced
+# notifications keep their other actors, and the unread counters stay right
+@receiver(pre_delete, sender=User, dispatch_uid='notifications_detach_actor')
+def user_pre_delete(sender, instance, **kwargs):
+    detach_actor(instance)
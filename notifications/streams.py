@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed, TokenError
+from .models import Notification
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+# Real-time notification stream over Server-Sent Events.
+#
+# Each connected client holds one idle coroutine waiting on an asyncio queue, so an
+# ASGI worker can keep thousands of connections open cheaply. When notifications are
+# delivered, the broker wakes the streams of their recipients; a stream then reads
+# everything newer than the last event it sent from the database, which is also how
+# clients resume with Last-Event-ID (coalesced notifications are sent again whenever
+# they are updated).
+#
+# Notifications are delivered by the process_notifications worker, in another process
+# than the streams. The default DatabaseBroker therefore has one thread per web process
+# look for notifications created or coalesced in the last few seconds for the users with
+# an open stream, every NOTIFICATIONS_BROKER_POLL seconds: one indexed query per process
+# rather than one per stream, and new notifications reach clients within about a second
+# of delivery. Streams still check the database every NOTIFICATIONS_STREAM_POLL seconds
+# in case a wake-up is missed. A broker class backed by a real pub/sub (e.g. Redis) can
+# replace it through NOTIFICATIONS_BROKER.
+
+
+# Pub/sub within a single process: one asyncio queue per open stream, keyed by user ID.
+# publish() is thread-safe and may be called from synchronous code.
+class InProcessBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=1)  # A pending wake-up already covers every later one
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            self._subscribers[user_id].discard(subscriber)
+            if not self._subscribers[user_id]:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._wake, queue)
+
+    @staticmethod
+    def _wake(queue):
+        if not queue.full():
+            queue.put_nowait(True)
+
+    async def listen(self, subscriber, timeout):
+        # Wait for a wake-up; returns False when the timeout expires first
+        try:
+            await asyncio.wait_for(subscriber[1].get(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+# Number of user IDs per query of DatabaseBroker
+POLL_CHUNK_SIZE = 500
+# How far back DatabaseBroker looks for notifications: covers the time between a
+# notification's timestamp and the commit of its batch, and clock differences between hosts
+POLL_LOOKBACK = timedelta(seconds=10)
+
+
+# Pub/sub across processes through the Notification table. Wakes are still published
+# within the process too, for notifications delivered by the process itself.
+class DatabaseBroker(InProcessBroker):
+    def __init__(self):
+        super().__init__()
+        self._seen = {}  # (notification ID, timestamp) -> timestamp, for the rows already announced
+        self._thread = None
+
+    def subscribe(self, user_id):
+        subscriber = super().subscribe(user_id)
+        self.start()
+        return subscriber
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='notification-broker', daemon=True)
+                self._thread.start()
+
+    def poll(self):
+        """
+        Wake the streams of the users with notifications created or coalesced since the
+        last poll. Returns the IDs of the users woken.
+        """
+        with self._lock:
+            user_ids = list(self._subscribers)
+        cutoff = timezone.now() - POLL_LOOKBACK
+        recent = {}
+        for start in range(0, len(user_ids), POLL_CHUNK_SIZE):
+            rows = Notification.objects.filter(recipient_id__in=user_ids[start:start + POLL_CHUNK_SIZE], timestamp__gte=cutoff)
+            for recipient_id, pk, timestamp in rows.values_list('recipient_id', 'id', 'timestamp'):
+                recent[(pk, timestamp)] = recipient_id
+        woken = {recipient_id for key, recipient_id in recent.items() if key not in self._seen}
+        # Forget the rows older than the lookback, which no later poll returns
+        self._seen = {key: timestamp for key, timestamp in self._seen.items() if timestamp >= cutoff}
+        self._seen.update((key, key[1]) for key in recent)
+        for user_id in woken:
+            self.publish(user_id)
+        return woken
+
+    def _run(self):
+        while True:
+            time.sleep(settings.NOTIFICATIONS_BROKER_POLL)
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Checking for new notifications failed, retrying on the next poll")
+            finally:
+                close_old_connections()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.NOTIFICATIONS_BROKER)()
+        return _broker
+
+
+def publish(user_ids):
+    # Tell the streams of these users that new notifications were delivered
+    broker = get_broker()
+    for user_id in set(user_ids):
+        broker.publish(user_id)
+
+
+def authenticate(request):
+    # JWT from the Authorization header, or from ?token= since browsers' EventSource cannot set headers
+    authenticator = JWTAuthentication()
+    try:
+        if 'token' in request.GET:
+            return authenticator.get_user(authenticator.get_validated_token(request.GET['token']))
+        result = authenticator.authenticate(request)
+    except (InvalidToken, AuthenticationFailed, TokenError):
+        return None
+    return result[0] if result else None
+
+
+# Stream positions are (timestamp, id) pairs, so notifications coalesced in place after
+# a client saw them are sent again. Event IDs encode them as "<microseconds>-<id>".
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_position(timestamp, pk):
+    return f"{(timestamp - EPOCH) // timedelta(microseconds=1)}-{pk}"
+
+
+def decode_position(value):
+    microseconds, pk = value.split('-')
+    return EPOCH + timedelta(microseconds=int(microseconds)), int(pk)
+
+
+def latest_position(user):
+    latest = Notification.objects.filter(recipient=user).order_by('-timestamp', '-id').values_list('timestamp', 'id').first()
+    return latest or (EPOCH, 0)
+
+
+def notifications_since(user, position):
+    timestamp, pk = position
+    notifications = list(
+        Notification.objects.filter(recipient=user)
+        .filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+        .select_related('actor')
+        .prefetch_related('target')
+        .order_by('timestamp', 'id')[:settings.NOTIFICATIONS_STREAM_BATCH]
+    )
+    data = NotificationSerializer(notifications, many=True).data
+    return [(encode_position(notification.timestamp, notification.id), item) for notification, item in zip(notifications, data)]
+
+
+def format_event(event_id, notification):
+    return f"id: {event_id}\nevent: notification\ndata: {json.dumps(notification)}\n\n"
+
+
+async def event_stream(user, position):
+    broker = get_broker()
+    subscriber = broker.subscribe(user.id)
+    try:
+        yield f"retry: {settings.NOTIFICATIONS_STREAM_RETRY_MS}\n\n"
+        if position is None:
+            # New clients only receive notifications from now on
+            position = await sync_to_async(latest_position)(user)
+        check_database = True
+        last_check = time.monotonic()
+        while True:
+            if check_database:
+                # Send everything newer than the last event, one batch at a time
+                while True:
+                    notifications = await sync_to_async(notifications_since)(user, position)
+                    for event_id, notification in notifications:
+                        yield format_event(event_id, notification)
+                        position = decode_position(event_id)
+                    if len(notifications) < settings.NOTIFICATIONS_STREAM_BATCH:
+                        break
+                last_check = time.monotonic()
+
+            woken = await broker.listen(subscriber, settings.NOTIFICATIONS_STREAM_HEARTBEAT)
+            if not woken:
+                yield ": keep-alive\n\n"
+            check_database = woken or time.monotonic() - last_check >= settings.NOTIFICATIONS_STREAM_POLL
+    finally:
+        broker.unsubscribe(user.id, subscriber)
+
+
+# Server-Sent Events stream of the authenticated user's new notifications.
+# Serve it from an ASGI server (see social_media_api/asgi.py).
+async def notification_stream(request):
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided or are invalid."}, status=401)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        position = decode_position(last_event_id) if last_event_id else None
+    except (ValueError, OverflowError):
+        return JsonResponse({"detail": "Last-Event-ID must be an event ID sent by this stream."}, status=400)
+
+    response = StreamingHttpResponse(event_stream(user, position), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering so events are flushed immediately
+    return response
@@ -1,3 +1,319 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from posts.models import Post
+from social_media_api.testing import QueryCountTestCase
+from . import dispatch
+from .counters import adjust_unread_count
+from .models import Notification, NotificationActor, NotificationEvent
+from .streams import DatabaseBroker
 
-# Create your tests here.
+User = get_user_model()  # Custom user model
+
+
+class NotificationListQueryTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipient = User.objects.create_user('recipient', 'recipient@example.com', 'password')
+        actors = [User.objects.create_user(f'actor{i}', f'actor{i}@example.com', 'password') for i in range(5)]
+        posts = [Post.objects.create(author=cls.recipient, title=f'Post {i}', content='content') for i in range(5)]
+        post_type = ContentType.objects.get_for_model(Post)
+        user_type = ContentType.objects.get_for_model(User)
+
+        # Likes and follows interleaved, so every page mixes both target types
+        notifications = []
+        for i in range(60):
+            actor = actors[i % len(actors)]
+            if i % 2:
+                notifications.append(Notification(recipient=cls.recipient, actor=actor, verb='followed you',
+                                                  target_content_type=user_type, target_object_id=cls.recipient.id,
+                                                  is_read=i % 3 == 0))
+            else:
+                notifications.append(Notification(recipient=cls.recipient, actor=actor, verb='liked your post',
+                                                  target_content_type=post_type, target_object_id=posts[i % len(posts)].id,
+                                                  is_read=i % 3 == 0))
+        Notification.objects.bulk_create(notifications)
+
+    def setUp(self):
+        self.client.force_authenticate(self.recipient)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        # The ETag summary, one query for the page, plus one per target type on it
+        for page_size in (1, 10, 50):
+            with self.subTest(page_size=page_size), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('notification-list'), {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            results = response.data['unread_notifications'] + response.data['read_notifications']
+            self.assertEqual(len(results), page_size)
+            self.assertLessEqual(len(queries), 4)
+
+    def test_targets_are_serialized(self):
+        response = self.client.get(reverse('notification-list'), {'page_size': 50})
+        results = response.data['unread_notifications'] + response.data['read_notifications']
+        models = {item['target']['model'] for item in results}
+        self.assertEqual(models, {'post', 'customuser'})
+        self.assertTrue(all(item['target']['data'] for item in results))
+
+
+class NotificationQueryCountTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipient = User.objects.create_user('recipient', 'recipient@example.com', None)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', None)
+        actors = [User.objects.create_user(f'actor{i}', f'actor{i}@example.com', None) for i in range(5)]
+        post_type = ContentType.objects.get_for_model(Post)
+        posts = [Post.objects.create(author=cls.recipient, title=f'Post {i}', content='content') for i in range(5)]
+        Notification.objects.bulk_create(
+            Notification(recipient=cls.recipient, actor=actors[i % len(actors)], verb='liked your post',
+                         target_content_type=post_type, target_object_id=posts[i % len(posts)].id, is_read=i >= 40)
+            for i in range(60)
+        )
+        adjust_unread_count(cls.recipient.id, 40)
+        cls.notifications = list(Notification.objects.filter(recipient=cls.recipient).order_by('id').values_list('id', flat=True))
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.recipient)
+
+    def test_list(self):
+        # User, ETag summary, page with the actors, one query per target type
+        self.assertConstantQueries(
+            4, reverse('notification-list'),
+            results=lambda data: data['unread_notifications'] + data['read_notifications'],
+        )
+
+    def test_conditional_list(self):
+        url = reverse('notification-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        # User, ETag summary: answered before the page is loaded
+        self.assertMaxQueries(2, 'get', url, status=304, HTTP_IF_NONE_MATCH=etag)
+        # Reading one notification and unreading another leaves the unread counter as it was
+        unread, read = self.notifications[0], self.notifications[-1]
+        self.client.post(reverse('mark-notification-read', args=[unread]))
+        self.client.delete(reverse('mark-notification-unread', args=[read]))
+        etag = self.assertMaxQueries(4, 'get', url, HTTP_IF_NONE_MATCH=etag)['ETag']
+        self.assertMaxQueries(2, 'get', url, status=304, HTTP_IF_NONE_MATCH=etag)
+        # Swapping which notifications are unread keeps the unread count, the total and the sum of the
+        # unread IDs: with 1 and 4 read instead of 2 and 3, the unread ones sum up to the same
+        first, second, third, fourth = self.notifications[1:5]
+        for pk in (second, third):
+            self.client.post(reverse('mark-notification-read', args=[pk]))
+        etag = self.client.get(url)['ETag']
+        for pk in (first, fourth):
+            self.client.post(reverse('mark-notification-read', args=[pk]))
+        for pk in (second, third):
+            self.client.delete(reverse('mark-notification-unread', args=[pk]))
+        self.assertMaxQueries(4, 'get', url, HTTP_IF_NONE_MATCH=etag)
+        etag = self.client.get(url)['ETag']
+        # Coalescing an event moves the notification's timestamp without adding a row
+        Notification.objects.filter(pk=unread).update(timestamp=timezone.now())
+        etag = self.assertMaxQueries(4, 'get', url, HTTP_IF_NONE_MATCH=etag)['ETag']
+        # The ETag depends on the URL: another page or filter is not answered with 304
+        self.assertEqual(self.client.get(url, {'is_read': 'true'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unread_count(self):
+        self.assertMaxQueries(1, 'get', reverse('notification-unread-count'))
+
+    def test_mark_read(self):
+        pk = self.notifications[0]
+        self.assertMaxQueries(5, 'post', reverse('mark-notification-read', args=[pk]))
+        self.assertMaxQueries(5, 'post', reverse('mark-notification-read', args=[pk]))
+        self.assertMaxQueries(5, 'delete', reverse('mark-notification-unread', args=[pk]))
+
+    def test_mark_many_read(self):
+        for ids in (self.notifications[:1], self.notifications[1:51]):
+            with self.subTest(ids=len(ids)):
+                self.assertMaxQueries(5, 'post', reverse('mark-notifications-read'), {'ids': ids}, format='json')
+        self.assertMaxQueries(4, 'post', reverse('mark-all-notifications-read'))
+
+    def unread_count(self):
+        return self.client.get(reverse('notification-unread-count')).data['unread_count']
+
+    def test_mark_many_read_changes_only_the_listed_notifications(self):
+        # Another user's unread notification, listed with three unread and two read notifications of the recipient
+        other = Notification.objects.create(recipient=self.admin, actor=self.recipient, verb='followed you',
+                                            target_content_type=ContentType.objects.get_for_model(User), target_object_id=self.admin.id)
+        adjust_unread_count(self.admin.id, 1)
+        unread, read = self.notifications[:3], self.notifications[45:47]
+        self.assertEqual(self.unread_count(), 40)
+
+        response = self.client.post(reverse('mark-notifications-read'), {'ids': unread + read + [other.id]}, format='json')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertFalse(Notification.objects.filter(pk__in=unread + read, is_read=False).exists())
+        self.assertEqual(Notification.objects.filter(recipient=self.recipient, is_read=False).count(), 37)
+        self.assertEqual(self.unread_count(), 37)
+        # The other user's notification and counter are left alone
+        other.refresh_from_db()
+        self.admin.refresh_from_db()
+        self.assertEqual((other.is_read, self.admin.unread_notification_count), (False, 1))
+
+        # Marking them again changes nothing
+        response = self.client.post(reverse('mark-notifications-read'), {'ids': unread}, format='json')
+        self.assertEqual((response.data['updated'], self.unread_count()), (0, 37))
+        response = self.client.post(reverse('mark-all-notifications-read'))
+        self.assertEqual((response.data['updated'], self.unread_count()), (37, 0))
+
+    def test_queue_stats(self):
+        self.authenticate(self.admin)
+        self.assertMaxQueries(3, 'get', reverse('notification-queue-stats'))
+
+
+class AggregationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipient = User.objects.create_user('recipient', 'recipient@example.com', None)
+        cls.actors = [User.objects.create_user(f'actor{i}', f'actor{i}@example.com', None) for i in range(5)]
+        cls.post = Post.objects.create(author=cls.recipient, title='Post', content='content')
+
+    def like(self, actor):
+        dispatch.notify(recipient=self.recipient, actor=actor, verb='liked your post', target=self.post)
+
+    def test_actors_are_counted_once(self):
+        # The first actor acts again once the three most recent actors no longer include them
+        for actor in self.actors + self.actors[:1]:
+            self.like(actor)
+            dispatch.drain()
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 5)
+        self.assertEqual(notification.recent_actors, [self.actors[0].id, self.actors[4].id, self.actors[3].id])
+        self.assertEqual(NotificationActor.objects.filter(notification=notification).count(), 5)
+
+        # Within a single batch as well
+        self.like(self.actors[1])
+        self.like(self.actors[2])
+        self.like(self.actors[1])
+        dispatch.drain()
+        notification.refresh_from_db()
+        self.assertEqual((notification.actor_count, notification.actor_id), (5, self.actors[1].id))
+
+    def test_deleted_actors_are_detached(self):
+        for actor in self.actors[:4]:
+            self.like(actor)
+        dispatch.notify(recipient=self.recipient, actor=self.actors[3], verb='followed you', target=self.recipient)
+        dispatch.drain()
+        notification = Notification.objects.get(verb='liked your post')
+
+        # The latest actor leaves: the next most recent one takes over, and their own notification goes
+        self.actors[3].delete()
+        notification.refresh_from_db()
+        self.assertEqual((notification.actor_id, notification.actor_count), (self.actors[2].id, 3))
+        self.assertEqual(notification.recent_actors, [self.actors[2].id, self.actors[1].id])
+        self.assertFalse(Notification.objects.filter(verb='followed you').exists())
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.unread_notification_count, 1)
+
+        # Actors beyond the recent ones take over once those are gone
+        self.actors[2].delete()
+        self.actors[1].delete()
+        notification.refresh_from_db()
+        self.assertEqual((notification.actor_id, notification.actor_count, notification.recent_actors), (self.actors[0].id, 1, [self.actors[0].id]))
+        self.assertEqual(list(NotificationActor.objects.values_list('actor', flat=True)), [self.actors[0].id])
+
+        # The notification goes with its last actor
+        self.actors[0].delete()
+        self.assertFalse(Notification.objects.exists())
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.recipient.unread_notification_count, 0)
+
+
+@override_settings(NOTIFICATIONS_MAX_ATTEMPTS=2)
+class OutboxTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipient = User.objects.create_user('recipient', 'recipient@example.com', None)
+        cls.actor = User.objects.create_user('actor', 'actor@example.com', None)
+        cls.post = Post.objects.create(author=cls.recipient, title='Post', content='content')
+
+    def setUp(self):
+        dispatch.notify(recipient=self.recipient, actor=self.actor, verb='liked your post', target=self.post, key='like')
+
+    def make_due(self):
+        NotificationEvent.objects.update(available_at=timezone.now())
+
+    def test_failures_are_retried(self):
+        # Any exception, not only database errors, counts as an attempt
+        with mock.patch.object(dispatch, 'open_notifications', side_effect=RuntimeError('broken')), self.assertLogs('notifications.dispatch'):
+            self.assertEqual(dispatch.drain(), 1)
+            event = NotificationEvent.objects.get()
+            self.assertEqual((event.status, event.attempts, event.last_error), (NotificationEvent.PENDING, 1, 'broken'))
+            self.assertGreater(event.available_at, timezone.now())
+            self.assertEqual(dispatch.drain(), 0)  # Backing off
+
+            self.make_due()
+            dispatch.drain()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (NotificationEvent.FAILED, 2))
+        self.make_due()
+        self.assertEqual(dispatch.drain(), 0)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_lease_takeover(self):
+        # A worker claims the event and dies: nobody else takes it before the lease expires
+        first = dispatch.claim(10)
+        self.assertEqual(dispatch.claim(10), [])
+        self.make_due()
+        second = dispatch.claim(10)
+        self.assertEqual([(event.pk, event.attempts) for event in second], [(first[0].pk, 2)])
+        self.assertNotEqual(second[0].claim_token, first[0].claim_token)
+
+        # The second worker dies too, during the last attempt: the event fails instead of being claimed again
+        self.make_due()
+        with self.assertLogs('notifications.dispatch', 'ERROR'):
+            self.assertEqual(dispatch.claim(10), [])
+        event = NotificationEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), (NotificationEvent.FAILED, 2))
+
+    def test_delivered_once_after_takeover(self):
+        dispatch.claim(10)
+        self.make_due()
+        self.assertEqual(dispatch.drain(), 1)
+        self.assertEqual(dispatch.drain(), 0)
+        self.assertEqual(Notification.objects.get().actor_id, self.actor.id)
+        self.assertEqual(NotificationEvent.objects.get().status, NotificationEvent.DONE)
+
+
+class DatabaseBrokerTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipient = User.objects.create_user('recipient', 'recipient@example.com', None)
+        cls.actor = User.objects.create_user('actor', 'actor@example.com', None)
+        cls.post = Post.objects.create(author=cls.recipient, title='Post', content='content')
+
+    def notify(self):
+        return Notification.objects.create(recipient=self.recipient, actor=self.actor, verb='liked your post', target=self.post)
+
+    @mock.patch.object(DatabaseBroker, 'start')  # Polled here rather than by the broker thread
+    def test_wakes_streams_of_notifications_delivered_elsewhere(self, start):
+        broker = DatabaseBroker()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe():
+            return broker.subscribe(self.recipient.id)
+
+        subscriber = loop.run_until_complete(subscribe())
+        self.assertEqual(broker.poll(), set())
+
+        # Created by the dispatch worker, which publishes nothing to this process
+        notification = self.notify()
+        self.assertEqual(broker.poll(), {self.recipient.id})
+        self.assertTrue(loop.run_until_complete(broker.listen(subscriber, 1)))
+        self.assertEqual(broker.poll(), set())  # Announced once
+        self.assertFalse(loop.run_until_complete(broker.listen(subscriber, 0.01)))
+
+        # Coalesced again: the notification moves to a new timestamp
+        Notification.objects.filter(pk=notification.pk).update(timestamp=notification.timestamp + timedelta(seconds=1))
+        self.assertEqual(broker.poll(), {self.recipient.id})
+
+        broker.unsubscribe(self.recipient.id, subscriber)
+        self.notify()
+        self.assertEqual(broker.poll(), set())
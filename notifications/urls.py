@@ -1,8 +1,14 @@
 from django.urls import path
-from .views import NotificationListView, MarkNotificationReadView
+from .views import NotificationListView, MarkNotificationReadView, MarkNotificationsReadBulkView, UnreadNotificationCountView, NotificationQueueStatsView
+from .streams import notification_stream
 
 urlpatterns = [
     path('list/', NotificationListView.as_view(), name='notification-list'),  # URL route for fetching the list of notifications
     path('<int:pk>/read/', MarkNotificationReadView.as_view(), name='mark-notification-read'),   # The 'pk' (primary key) is used to identify the specific notification
     path('<int:pk>/unread/', MarkNotificationReadView.as_view(), name='mark-notification-unread'),  # The 'pk' (primary key) is used to identify the notification to mark as unread
+    path('read/', MarkNotificationsReadBulkView.as_view(), name='mark-notifications-read'),  # Mark a list of notifications as read
+    path('read_all/', MarkNotificationsReadBulkView.as_view(mark_all=True), name='mark-all-notifications-read'),  # Mark every notification as read
+    path('unread_count/', UnreadNotificationCountView.as_view(), name='notification-unread-count'),  # Number of unread notifications
+    path('stream/', notification_stream, name='notification-stream'),  # Server-Sent Events stream of new notifications
+    path('queue/', NotificationQueueStatsView.as_view(), name='notification-queue-stats'),  # Depth and lag of the notification dispatch queue (admin only)
 ]
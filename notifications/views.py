@@ -1,43 +1,79 @@
 from django.shortcuts import render
 from rest_framework import views, generics, status, filters
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from .models import Notification
 from .serializers import NotificationSerializer
+from . import dispatch
+from .counters import adjust_unread_count
 from django_filters import rest_framework
-from rest_framework.pagination import PageNumberPagination
+from django.db import transaction
+from django.db.models import Count, Max
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from social_media_api.conditional import ConditionalGetMixin
+from social_media_api.pagination import KeysetPagination
+
+# Cursor pagination for notifications, keyed on (is_read, timestamp, id)
+class NotificationPagination(KeysetPagination):
+    page_size = 20  # Number of notifications per page
 
 # This view handles the listing of notifications for an authenticated user
-class NotificationListView(generics.ListAPIView):
+class NotificationListView(ConditionalGetMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = NotificationSerializer
     filter_backends = [rest_framework.DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['is_read', 'timestamp']
     search_fields = ['is_read', 'timestamp']
     ordering_fields = ['is_read', 'timestamp']
+    pagination_class = NotificationPagination
     #ordering = ['id']
 
+    def get_queryset(self):
+        # Unread notifications first, then read notifications, most recent first within each group.
+        # Targets are fetched with one IN query per target type instead of one query per notification.
+        return (
+            Notification.objects.filter(recipient=self.request.user)
+            .select_related('actor')
+            .prefetch_related('target')
+            .order_by('is_read', '-timestamp')
+        )
+
     def list(self, request, *args, **kwargs):
         """
         Overriding list to fetch and return unread notifications prominently at the top.
         """
-        user = request.user
-        
-        # Fetch unread notifications first, then read notifications
-        unread_notifications = Notification.objects.filter(recipient=user, is_read=False).order_by('-timestamp')
-        read_notifications = Notification.objects.filter(recipient=user, is_read=True).order_by('-timestamp')
+        # Read before the page, so a notification written meanwhile changes the next request's ETag
+        state = self.list_state()
 
-        # Serialize unread and read notifications
-        unread_serializer = NotificationSerializer(unread_notifications, many=True)
-        read_serializer = NotificationSerializer(read_notifications, many=True)
+        def respond():
+            # Fetch one page of notifications, unread first, then read notifications
+            page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+            serializer = self.get_serializer(page, many=True)
 
-        # Return the response, showcasing unread notifications first
-        return Response({
-            'unread_notifications': unread_serializer.data,  # Unread first
-            'read_notifications': read_serializer.data,      # Read after
-        }, status=status.HTTP_200_OK)
+            # Return the response, showcasing unread notifications first
+            return Response({
+                'next': self.paginator.get_next_link(),
+                'previous': self.paginator.get_previous_link(),
+                'unread_notifications': [item for item in serializer.data if not item['is_read']],  # Unread first
+                'read_notifications': [item for item in serializer.data if item['is_read']],        # Read after
+            }, status=status.HTTP_200_OK)
 
+        # Notifications have no versions: no Last-Modified, and a conditional request is answered before any page is loaded
+        return self.conditional_get(lambda: state, respond, lambda response: state, last_modified=False)
+
+    def list_state(self):
+        # The user's notifications summed up in one aggregate over the recipient's index: a new notification
+        # moves the latest ID, coalescing an event moves the latest timestamp, and deleting notifications moves
+        # the total. Every change of the unread notifications, such as reading one and unreading another,
+        # moves the user's notification_version (see notifications.counters), loaded with the user.
+        # Filters, ordering and the cursor are part of the URL the ETag is built from. Later edits of
+        # the actors' names and the targets' text are not covered: they show once the list changes.
+        summary = Notification.objects.filter(recipient=self.request.user).aggregate(
+            latest_id=Max('id'), latest=Max('timestamp'), total=Count('id'),
+        )
+        user = self.request.user
+        return [user.unread_notification_count, user.notification_version, sorted(summary.items())], []
 
     @swagger_auto_schema(
         operation_summary="Retrieve a list of notifications",
@@ -47,6 +83,15 @@ class NotificationListView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
         
 
+# Set the read state of the user's notifications in the given queryset with one UPDATE,
+# and move the unread counter by the number of rows that actually changed
+def mark_read(user, notifications, is_read):
+    with transaction.atomic():
+        updated = notifications.filter(recipient=user, is_read=not is_read).update(is_read=is_read)
+        adjust_unread_count(user.id, -updated if is_read else updated)
+    return updated
+
+
 # View to mark a specific notification as read or unread
 class MarkNotificationReadView(views.APIView):
     permission_classes = [IsAuthenticated]
@@ -56,27 +101,75 @@ class MarkNotificationReadView(views.APIView):
         operation_description="This marks notifications as read"
     )
     def post(self, request, pk):
-        try:
-            # Attempt to get the notification for the user
-            notification = Notification.objects.get(id=pk, recipient=request.user)
-            notification.is_read = True  # Mark as read
-            notification.save()
+        # Flip the notification with a single UPDATE; no row changes if it is already read
+        if mark_read(request.user, Notification.objects.filter(id=pk), True) or self.exists(request, pk):
             return Response({"message": "Notification marked as read"}, status=status.HTTP_200_OK)
-        except Notification.DoesNotExist:
-            # If notification is not found, return a 404 error
-            return Response({"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND)
+        # If notification is not found, return a 404 error
+        return Response({"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND)
 
     @swagger_auto_schema(
         operation_summary="Mark notifications as unread",
         operation_description="This marks notifications as unread"
     )
     def delete(self, request, pk):
-        try:
-            # Attempt to get the notification for the user
-            notification = Notification.objects.get(id=pk, recipient=request.user)
-            notification.is_read = False  # Mark as unread
-            notification.save()
+        # Flip the notification with a single UPDATE; no row changes if it is already unread
+        if mark_read(request.user, Notification.objects.filter(id=pk), False) or self.exists(request, pk):
             return Response({"message": "Notification marked as unread"}, status=status.HTTP_200_OK)
-        except Notification.DoesNotExist:
-            # If notification is not found, return a 404 error
-            return Response({"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND)
+        # If notification is not found, return a 404 error
+        return Response({"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    def exists(self, request, pk):
+        # Only queried when the UPDATE changed nothing, to tell "already in that state" from "not found"
+        return Notification.objects.filter(id=pk, recipient=request.user).exists()
+
+
+# View to mark a list of notifications, or every notification (mark_all), as read in a single UPDATE
+class MarkNotificationsReadBulkView(views.APIView):
+    permission_classes = [IsAuthenticated]
+    mark_all = False  # Set by the read_all/ route
+    max_ids = 500  # Most notification IDs accepted per request
+
+    @swagger_auto_schema(
+        operation_summary="Mark many notifications as read",
+        operation_description="read/ marks the notifications listed in 'ids' as read, read_all/ marks every notification as read. Returns the number of notifications that changed.",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={'ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER))},
+        ),
+    )
+    def post(self, request):
+        notifications = Notification.objects.all()
+        if not self.mark_all:
+            ids = request.data.get('ids') if hasattr(request.data, 'get') else None
+            if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+                return Response({"error": "'ids' must be a list of notification IDs."}, status=status.HTTP_400_BAD_REQUEST)
+            if len(ids) > self.max_ids:
+                return Response({"error": f"At most {self.max_ids} IDs can be marked at once."}, status=status.HTTP_400_BAD_REQUEST)
+            notifications = notifications.filter(id__in=ids)
+        updated = mark_read(request.user, notifications, True)
+        return Response({"message": "Notifications marked as read", "updated": updated}, status=status.HTTP_200_OK)
+
+
+# View returning the number of unread notifications, served from the user's counter
+class UnreadNotificationCountView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Unread notification count",
+        operation_description="Number of unread notifications of the authenticated user."
+    )
+    def get(self, request):
+        # The counter is a column of the already loaded user: no query on notifications
+        return Response({"unread_count": request.user.unread_notification_count}, status=status.HTTP_200_OK)
+
+
+# View reporting the depth and lag of the notification dispatch queue
+class NotificationQueueStatsView(views.APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Notification queue metrics",
+        operation_description="Number of pending, processing and failed notification events, and the age in seconds of the oldest undelivered one. Admin only."
+    )
+    def get(self, request):
+        return Response(dispatch.queue_stats(), status=status.HTTP_200_OK)
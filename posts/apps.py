@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posts'
+
+    def ready(self):
+        # Register the signal handlers that keep the denormalized counters and the search index in sync
+        from . import signals  # noqa: F401
@@ -0,0 +1,36 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from social_media_api import caching
+from .models import Post
+
+
+# Atomic "column = MAX(column + delta, 0)" expression, so concurrent writers never lose
+# an update and drift can never push a counter below zero
+def shifted(field, delta):
+    return Greatest(F(field) + delta, Value(0))
+
+
+def adjust_post_counts(post_id, **deltas):
+    """
+    Apply deltas to a post's like_count and comment_count in a single UPDATE,
+    e.g. adjust_post_counts(post.id, like_count=1).
+    """
+    Post.objects.filter(pk=post_id).update(version=caching.new_version(), **{field: shifted(field, delta) for field, delta in deltas.items()})
+    caching.bump(caching.POST, post_id, stored=True)
+
+
+def related_count(model, field='post'):
+    # Actual number of related rows per post (or per row of the model referenced by field), as a correlated subquery
+    counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def release_user_counts(user):
+    """
+    Take a user's likes off the counters of the posts they are on, before the user is
+    deleted and the rows are removed by the cascade. Comments are handled by
+    posts.threads.release_user_comments.
+    """
+    post_ids = list(Post.objects.filter(likes__user=user).exclude(author=user).values_list('pk', flat=True))
+    Post.objects.filter(pk__in=post_ids).update(like_count=shifted('like_count', -1), version=caching.new_version())
+    caching.bump(caching.POST, *post_ids, stored=True)
@@ -0,0 +1,224 @@
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils.module_loading import import_string
+from notifications.dispatch import notify_many
+from social_media_api import caching
+from .counters import related_count
+from .models import Post, Like
+
+logger = logging.getLogger(__name__)
+
+# Write-behind buffer for likes, enabled with LIKE_BUFFER_ENABLED.
+#
+# When a post goes viral, every like is a write transaction on the same Post row, and on
+# SQLite all of them queue for the single writer lock. With the buffer, like requests only
+# look up the post's author (cached per post), record the requested like state in memory
+# and return 202 Accepted. A flusher thread writes everything received every
+# LIKE_BUFFER_FLUSH_INTERVAL seconds in a few statements: one bulk_create and one DELETE
+# per post for the Like rows (still guarded by their unique_together), one counter
+# UPDATE per post and one insert into the notification outbox.
+#
+# Likes accepted but not yet flushed are lost if the process dies; the like counters are
+# repaired by reconcile_counters. Each process has its own buffer, and a buffer class
+# backed by a shared cache can replace it through LIKE_BUFFER.
+#
+# A flush failing with a transient error, such as a locked database, puts the like states
+# it did not write back into the buffer, for at most LIKE_BUFFER_MAX_ATTEMPTS flushes. Other
+# database errors are not retried: the chunk is written again one like state at a time,
+# and the states that still fail are logged and dropped.
+
+# Number of like states written per transaction
+FLUSH_CHUNK_SIZE = 1000
+# Errors after which a flush is retried
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+# Number of post authors remembered, so likes on a hot post are accepted without a query
+AUTHOR_CACHE_SIZE = 10000
+
+
+def apply_likes(changes):
+    """
+    Write a batch of like states, {(user_id, post_id): liked}.
+    Returns the number of likes created and removed.
+    """
+    posts = Post.objects.only('id', 'author_id').in_bulk({post_id for _, post_id in changes})
+    # Drop likes on posts deleted since they were accepted
+    changes = {(user_id, post_id): liked for (user_id, post_id), liked in changes.items() if post_id in posts}
+    if not changes:
+        return 0, 0
+
+    with transaction.atomic():
+        existing = set(
+            Like.objects.filter(user_id__in={user_id for user_id, _ in changes}, post_id__in={post_id for _, post_id in changes})
+            .values_list('user_id', 'post_id')
+        )
+        added = [key for key, liked in changes.items() if liked and key not in existing]
+        removed = defaultdict(list)
+        for (user_id, post_id), liked in changes.items():
+            if not liked and (user_id, post_id) in existing:
+                removed[post_id].append(user_id)
+
+        Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id) for user_id, post_id in added], ignore_conflicts=True)
+        for post_id, user_ids in removed.items():
+            Like.objects.filter(post_id=post_id, user_id__in=user_ids).delete()
+
+        # One counter update for all the posts, whatever the number of likes. The likes are
+        # recounted: a like written by another process since they were read above is ignored
+        # by bulk_create, and counting the likes requested here would count it twice.
+        changed = {post_id for _, post_id in added} | removed.keys()
+        if changed:
+            Post.objects.filter(pk__in=changed).update(like_count=related_count(Like), version=caching.new_version())
+            caching.bump(caching.POST, *changed, stored=True)
+
+        notify_many([
+            (posts[post_id].author_id, user_id, 'liked your post', posts[post_id], f'like:{user_id}:{post_id}')
+            for user_id, post_id in added
+        ])
+    return len(added), sum(len(user_ids) for user_ids in removed.values())
+
+
+# Buffer within a single process, flushed by a daemon thread started on first use
+class InProcessLikeBuffer:
+    def __init__(self):
+        self._pending = {}  # (user_id, post_id) -> liked; the latest request wins
+        self._flushing = {}  # Batch being written, still visible to pending()
+        self._attempts = {}  # (user_id, post_id) -> flushes that failed to write the pending state
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._authors = OrderedDict()  # post_id -> author_id, least recently used first
+
+    def post_author(self, post_id):
+        """
+        Author ID of a post, or None if it does not exist. Authors never change, so
+        they are cached; missing posts are not, as they may be created later.
+        """
+        with self._lock:
+            if post_id in self._authors:
+                self._authors.move_to_end(post_id)
+                return self._authors[post_id]
+        author_id = Post.objects.filter(pk=post_id).values_list('author_id', flat=True).first()
+        if author_id is not None:
+            with self._lock:
+                self._authors[post_id] = author_id
+                if len(self._authors) > AUTHOR_CACHE_SIZE:
+                    self._authors.popitem(last=False)
+        return author_id
+
+    def add(self, user_id, post_id, liked):
+        with self._lock:
+            self._pending[(user_id, post_id)] = liked
+            self._attempts.pop((user_id, post_id), None)
+            full = len(self._pending) >= settings.LIKE_BUFFER_MAX_PENDING
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='like-buffer-flusher', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()  # Flush now rather than at the end of the interval
+
+    def pending(self, user_id, post_ids):
+        """
+        Like states of the user not written to the database yet, {post_id: liked}.
+        """
+        with self._lock:
+            states = {}
+            for post_id in post_ids:
+                key = (user_id, post_id)
+                if key in self._pending:
+                    states[post_id] = self._pending[key]
+                elif key in self._flushing:
+                    states[post_id] = self._flushing[key]
+            return states
+
+    def flush(self):
+        """
+        Write everything received so far. Returns the number of likes created and removed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            added = removed = 0
+            items = list(batch.items())
+            try:
+                for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+                    chunk = dict(items[start:start + FLUSH_CHUNK_SIZE])
+                    try:
+                        chunk_added, chunk_removed = apply_likes(chunk)
+                    except TRANSIENT_ERRORS:
+                        self._retry(dict(items[start:]))
+                        raise
+                    except DatabaseError:
+                        chunk_added, chunk_removed = self._apply_each(chunk)
+                    self._succeeded(chunk)
+                    added += chunk_added
+                    removed += chunk_removed
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            return added, removed
+
+    def _apply_each(self, states):
+        # Write the like states of a chunk that failed one by one, dropping those that cannot be written
+        added = removed = 0
+        items = list(states.items())
+        for index, (key, liked) in enumerate(items):
+            try:
+                one_added, one_removed = apply_likes({key: liked})
+            except TRANSIENT_ERRORS:
+                self._retry(dict(items[index:]))
+                raise
+            except DatabaseError:
+                logger.exception("Dropping the buffered %s of user %s on post %s, which cannot be written", 'like' if liked else 'unlike', *key)
+                continue
+            added += one_added
+            removed += one_removed
+        return added, removed
+
+    def _retry(self, states):
+        # Put like states back behind anything the users requested since, unless they already failed too often
+        dropped = 0
+        with self._lock:
+            for key, liked in states.items():
+                if key in self._pending:
+                    continue  # Replaced by a newer request
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= settings.LIKE_BUFFER_MAX_ATTEMPTS:
+                    self._attempts.pop(key, None)
+                    dropped += 1
+                    continue
+                self._attempts[key] = attempts
+                self._pending[key] = liked
+        if dropped:
+            logger.error("Dropping %s buffered like states after %s failed flushes", dropped, settings.LIKE_BUFFER_MAX_ATTEMPTS)
+
+    def _succeeded(self, states):
+        with self._lock:
+            for key in states:
+                self._attempts.pop(key, None)
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.LIKE_BUFFER_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing buffered likes failed, retrying on the next flush")
+            finally:
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = import_string(settings.LIKE_BUFFER)()
+        return _buffer
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from notifications.dispatch import notify
+from .counters import adjust_post_counts
+from .like_buffer import get_buffer
+from .models import Post, Like
+
+# Like and unlike as single conditional writes.
+#
+# like() inserts the Like row only if the post exists, is not the user's own post and
+# is not liked yet, all in one INSERT ... SELECT that ignores unique conflicts; unlike()
+# is a single DELETE. Neither reads the post first: the row count says whether anything
+# changed, and the post is only read to explain why when nothing did.
+#
+# With LIKE_BUFFER_ENABLED, both only check the post and hand the new like state to the
+# write-behind buffer (see posts.like_buffer), returning QUEUED.
+
+# Outcomes of like() and unlike()
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'  # Already liked, or not liked
+NOT_FOUND = 'not_found'
+OWN_POST = 'own_post'
+QUEUED = 'queued'  # Accepted by the like buffer, written on its next flush
+
+
+def _insert_like(user_id, post_id):
+    # INSERT OR IGNORE / ON CONFLICT DO NOTHING, in the syntax of the database backend
+    like_table = connection.ops.quote_name(Like._meta.db_table)
+    post_table = connection.ops.quote_name(Post._meta.db_table)
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    suffix = connection.ops.on_conflict_suffix_sql([], OnConflict.IGNORE, [], [])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"{insert} {like_table} (user_id, post_id) "
+            f"SELECT %s, id FROM {post_table} WHERE id = %s AND author_id <> %s {suffix}",
+            [user_id, post_id, user_id],
+        )
+        return cursor.rowcount == 1
+
+
+def _post_error(user, author_id):
+    # NOT_FOUND or OWN_POST when the post cannot be liked by the user, else None
+    if author_id is None:
+        return NOT_FOUND
+    if author_id == user.id:
+        return OWN_POST
+    return None
+
+
+def _author_id(post_id):
+    return Post.objects.filter(pk=post_id).values_list('author_id', flat=True).first()
+
+
+def _buffer(user, post_id, liked):
+    buffer = get_buffer()
+    error = _post_error(user, buffer.post_author(post_id))
+    if error:
+        return error
+    buffer.add(user.id, post_id, liked)
+    return QUEUED
+
+
+def like(user, post_id):
+    """
+    Like a post, counting the like and notifying the author only the first time.
+    Returns CHANGED, UNCHANGED, NOT_FOUND, OWN_POST or QUEUED.
+    """
+    if settings.LIKE_BUFFER_ENABLED:
+        return _buffer(user, post_id, True)
+    with transaction.atomic():
+        if not _insert_like(user.id, post_id):
+            return _post_error(user, _author_id(post_id)) or UNCHANGED
+        adjust_post_counts(post_id, like_count=1)
+        post = Post.objects.select_related('author').get(pk=post_id)
+        notify(
+            recipient=post.author,  # The author of the post
+            actor=user,             # The user who liked the post
+            verb='liked your post', # Verb explaining the action
+            target=post,            # The specific post that was liked
+            key=f'like:{user.id}:{post_id}',  # Liking again after an unlike does not notify twice
+        )
+    return CHANGED
+
+
+def unlike(user, post_id):
+    """
+    Remove a like from a post. Returns CHANGED, UNCHANGED, NOT_FOUND, OWN_POST or QUEUED.
+    """
+    if settings.LIKE_BUFFER_ENABLED:
+        return _buffer(user, post_id, False)
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(user=user, post_id=post_id).delete()
+        if not deleted:
+            return _post_error(user, _author_id(post_id)) or UNCHANGED
+        adjust_post_counts(post_id, like_count=-1)
+    return CHANGED
+
+
+def liked_post_ids(user, post_ids):
+    """
+    The subset of post_ids the user has liked, in one IN query.
+    Includes likes still waiting in the like buffer.
+    """
+    if not user.is_authenticated or not post_ids:
+        return set()
+    liked = set(Like.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', flat=True))
+    if settings.LIKE_BUFFER_ENABLED:
+        for post_id, pending in get_buffer().pending(user.id, post_ids).items():
+            if pending:
+                liked.add(post_id)
+            else:
+                liked.discard(post_id)
+    return liked
@@ -0,0 +1,61 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+from django.test.utils import override_settings
+from posts import likes
+from posts.like_buffer import get_buffer
+from posts.models import Post, Like
+
+User = get_user_model()  # Custom user model
+
+
+class Command(BaseCommand):
+    help = "Measure like throughput on a single hot post, writing each like directly and through the like buffer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--likes', type=int, default=2000, help="Number of users liking the post.")
+        parser.add_argument('--threads', type=int, default=16, help="Number of concurrent clients.")
+
+    def handle(self, *args, **options):
+        for buffered in (False, True):
+            self.run(buffered, options['likes'], options['threads'])
+
+    def run(self, buffered, count, threads):
+        # A throwaway author, post and likers, deleted afterwards
+        prefix = f'benchlike-{uuid.uuid4().hex[:8]}'
+        author = User.objects.create_user(f'{prefix}-author', f'{prefix}-author@example.com', None)
+        users = User.objects.bulk_create([User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com') for i in range(count)])
+        post = Post.objects.create(author=author, title='Benchmark post', content='Benchmark post')
+
+        def like(user):
+            try:
+                likes.like(user, post.id)
+                return True
+            except DatabaseError:
+                return False  # e.g. "database is locked" when writers queue for too long
+
+        try:
+            with override_settings(LIKE_BUFFER_ENABLED=buffered):
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    accepted = sum(executor.map(like, users))
+                acknowledged = time.perf_counter() - started
+                if buffered:
+                    get_buffer().flush()
+                written = time.perf_counter() - started
+
+            post.refresh_from_db()
+            stored = Like.objects.filter(post=post).count()
+            mode = "buffered" if buffered else "direct"
+            self.stdout.write(
+                f"{mode}: {accepted}/{count} likes accepted in {acknowledged:.2f}s ({accepted / acknowledged:.0f}/s), "
+                f"written in {written:.2f}s ({stored / written:.0f}/s); {stored} rows stored, like_count {post.like_count}"
+            )
+            if stored != post.like_count:
+                self.stdout.write(self.style.WARNING(f"{mode}: like_count does not match the stored likes."))
+        finally:
+            post.delete()
+            User.objects.filter(username__startswith=prefix).delete()
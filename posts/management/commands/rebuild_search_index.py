@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Reindex every post and comment in the full-text search index, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Number of rows indexed per transaction.")
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError("The full-text search index requires SQLite with FTS5.")
+
+        for model in search.SEARCH_INDEXES:
+            indexed = 0
+            for indexed in search.rebuild(model, chunk_size=options['chunk_size']):
+                self.stdout.write(f"{model._meta.verbose_name_plural}: {indexed} indexed")
+            self.stdout.write(self.style.SUCCESS(f"{model._meta.verbose_name_plural}: reindexed {indexed} rows."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from posts.timeline import rebuild_timeline
+
+User = get_user_model()  # Custom user model
+
+
+class Command(BaseCommand):
+    help = "Regenerate the materialized feed timeline of the given users (or of every user with --all)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Usernames whose timelines should be rebuilt.")
+        parser.add_argument('--all', action='store_true', help="Rebuild the timeline of every user.")
+
+    def handle(self, *args, **options):
+        if options['all']:
+            users = User.objects.order_by('id')
+        elif options['usernames']:
+            users = User.objects.filter(username__in=options['usernames']).order_by('id')
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        else:
+            raise CommandError("Pass one or more usernames, or --all.")
+
+        for user in users.iterator():
+            written = rebuild_timeline(user)
+            self.stdout.write(f"{user.username}: {written} timeline entries")
+        self.stdout.write(self.style.SUCCESS("Timelines rebuilt."))
@@ -0,0 +1,60 @@
+from functools import reduce
+from operator import or_
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from posts.counters import related_count
+from posts.models import Post, Comment, Like
+from social_media_api import caching
+from users.counters import edge_count
+from notifications.counters import unread_count
+
+User = get_user_model()  # Custom user model
+
+
+class Command(BaseCommand):
+    help = "Detect and repair drift in the denormalized like, comment, reply, follower, following and unread notification counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of rows checked per batch.")
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without repairing it.")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+
+        # from_customuser is the followed user, to_customuser the follower
+        self.reconcile(Post, {'like_count': related_count(Like), 'comment_count': related_count(Comment)})
+        self.reconcile(Comment, {'reply_count': related_count(Comment, 'parent')})
+        self.reconcile(User, {
+            'follower_count': edge_count('from_customuser'),
+            'following_count': edge_count('to_customuser'),
+            'unread_notification_count': unread_count(),
+        })
+
+    def reconcile(self, model, actual_counts):
+        # Walk the table in primary key order, one batch per transaction. Drifted counters are
+        # found and set to their actual counts by a single UPDATE with the counts as subqueries,
+        # so a like or follow counted by another request meanwhile is never overwritten.
+        drifted = reduce(or_, [~Q(**{field: expression}) for field, expression in actual_counts.items()])
+        versioned = any(field.name == 'version' for field in model._meta.concrete_fields)
+        last_id, checked, repaired = 0, 0, 0
+        while True:
+            with transaction.atomic():
+                ids = list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+                if not ids:
+                    break
+                batch = model.objects.filter(pk__in=ids).filter(drifted)
+                if self.dry_run:
+                    count = batch.count()
+                else:
+                    count = batch.update(**actual_counts, **({'version': caching.new_version()} if versioned else {}))
+                    if count:
+                        caching.bump_all()  # UPDATE sends no signals
+            checked += len(ids)
+            repaired += count
+            last_id = ids[-1]
+
+        action = "drifted" if self.dry_run else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"{model._meta.verbose_name_plural}: {checked} checked, {repaired} {action}."))
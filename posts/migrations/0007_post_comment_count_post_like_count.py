@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:38
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Like = apps.get_model('posts', 'Like')
+    Comment = apps.get_model('posts', 'Comment')
+
+    def count(model):
+        rows = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(total=Count('*')).values('total')
+        return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+    Post.objects.update(like_count=count(Like), comment_count=count(Comment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_posts_post_created_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
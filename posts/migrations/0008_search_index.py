@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:40
+
+from django.db import migrations
+
+
+# SQLite FTS5 indexes for posts and comments, as they were when this migration was written
+# (see posts.search). The statements are frozen here, so later changes to posts.search do
+# not change what this migration does; posts.search reinstalls missing triggers after migrate.
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts USING fts5(title, content, content='posts_post', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_ai AFTER INSERT ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_ad AFTER DELETE ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_au AFTER UPDATE OF title, content ON posts_post BEGIN "
+    "INSERT INTO posts_post_fts(posts_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO posts_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_comment_fts USING fts5(content, content='posts_comment', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS posts_comment_fts_ai AFTER INSERT ON posts_comment BEGIN "
+    "INSERT INTO posts_comment_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_comment_fts_ad AFTER DELETE ON posts_comment BEGIN "
+    "INSERT INTO posts_comment_fts(posts_comment_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_comment_fts_au AFTER UPDATE OF content ON posts_comment BEGIN "
+    "INSERT INTO posts_comment_fts(posts_comment_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO posts_comment_fts(rowid, content) VALUES (new.id, new.content); END",
+    "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')",
+    "INSERT INTO posts_comment_fts(posts_comment_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS posts_post_fts_ai",
+    "DROP TRIGGER IF EXISTS posts_post_fts_ad",
+    "DROP TRIGGER IF EXISTS posts_post_fts_au",
+    "DROP TABLE IF EXISTS posts_post_fts",
+    "DROP TRIGGER IF EXISTS posts_comment_fts_ai",
+    "DROP TRIGGER IF EXISTS posts_comment_fts_ad",
+    "DROP TRIGGER IF EXISTS posts_comment_fts_au",
+    "DROP TABLE IF EXISTS posts_comment_fts",
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite only; other databases search with LIKE
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        with schema_editor.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_comment_count_post_like_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(CREATE_SQL), run_sqlite(DROP_SQL)),
+    ]
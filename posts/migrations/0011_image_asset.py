@@ -0,0 +1,20 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_comment_indexes'),
+        ('uploads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='uploads.imageasset'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:31
+
+import social_media_api.caching
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_timelineentry_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='version',
+            field=models.CharField(default=social_media_api.caching.new_version, editable=False, max_length=24),
+        ),
+    ]
@@ -1,28 +1,56 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from users.models import CounterFieldsMixin, VersionedMixin
 
 # Create your models here.
 User = get_user_model()
 
     # Post model represents a post content
-class Post(models.Model):
+class Post(VersionedMixin, CounterFieldsMixin, models.Model):
     title = models.CharField(max_length=100, null=False, blank=False)
     content = models.TextField(null=False, blank=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
     media = models.ImageField(upload_to="post_images/", blank=True, null=True)
+    image = models.ForeignKey('uploads.ImageAsset', on_delete=models.SET_NULL, blank=True, null=True, related_name='+', editable=False)  # Processed variants of media
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    like_count = models.PositiveIntegerField(default=0, editable=False)  # Denormalized number of likes, see posts.counters
+    comment_count = models.PositiveIntegerField(default=0, editable=False)  # Denormalized number of comments, see posts.counters
+
+    counter_fields = ('like_count', 'comment_count')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='posts_post_created_id'),  # Keyset pagination by creation date
+        ]
 
     def __str__(self):
         return self.title
 
     # Comment model represents a comment made on a Post
-class Comment(models.Model):
+class Comment(CounterFieldsMixin, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name="replies", blank=True, null=True)  # Comment this one replies to, if any
     content = models.TextField(null=False, blank=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    path = models.CharField(max_length=400, default='', editable=False)  # Materialized path of the thread, see posts.threads
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)  # 0 for comments on the post, 1 for replies to them, ...
+    reply_count = models.PositiveIntegerField(default=0, editable=False)  # Denormalized number of direct replies
+
+    counter_fields = ('reply_count',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='posts_comment_post_path'),  # Whole threads in one range scan
+            models.Index(fields=['post', 'created_at', 'id'], name='posts_comment_post_created'),  # A post's comments, oldest first
+            models.Index(
+                fields=['post', 'created_at', 'id'], name='posts_comment_top_level',
+                condition=models.Q(parent__isnull=True),
+            ),  # A post's top-level comments, oldest first
+            models.Index(fields=['parent', 'created_at', 'id'], name='posts_comment_replies'),  # First replies of each comment
+        ]
 
     def __str__(self):
         return f'Comment on {self.post} by { self.author}'
@@ -38,4 +66,19 @@ class Like(models.Model):
     def __str__(self):
         return f'{self.user} likes {self.post.title}'
 
+    # TimelineEntry materializes a post into the feed of one of its author's followers
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline_entries")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")  # Copied from the post so unfollows can clean up without a join
+    created_at = models.DateTimeField()  # Copied from the post so the timeline can be read in order from the index
 
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='posts_timeline_user_created'),  # Feed pages, see posts.timeline
+            models.Index(fields=['user', 'author'], name='posts_timeline_user_author'),
+        ]
+
+    def __str__(self):
+        return f'{self.post} in the timeline of {self.user}'
@@ -0,0 +1,130 @@
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.settings import api_settings
+from .models import Post, Comment
+
+# Full-text indexes, one SQLite FTS5 table per searchable model.
+# The FTS tables are "external content" tables: they only store the index and read
+# the text back from the model table, and triggers keep them in sync on every write.
+SEARCH_INDEXES = {
+    Post: {'table': 'posts_post_fts', 'columns': ['title', 'content']},
+    Comment: {'table': 'posts_comment_fts', 'columns': ['content']},
+}
+
+# Markers wrapped around matched terms in search snippets
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+SNIPPET_TOKENS = 12
+
+
+def is_supported():
+    return connection.vendor == 'sqlite'
+
+
+def index_sql(model):
+    # Statements creating the FTS table of a model and the triggers that keep it in sync
+    index = SEARCH_INDEXES[model]
+    fts, source = index['table'], model._meta.db_table
+    columns = ', '.join(index['columns'])
+    new_values = ', '.join(f'new.{column}' for column in index['columns'])
+    old_values = ', '.join(f'old.{column}' for column in index['columns'])
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, content='{source}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN "
+        f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def install(cursor):
+    """
+    Create the FTS tables and sync triggers that are missing. SQLite drops a table's
+    triggers when a migration rebuilds the table, so this also runs after every migrate.
+    """
+    for model in SEARCH_INDEXES:
+        for statement in index_sql(model):
+            cursor.execute(statement)
+
+
+def uninstall(cursor):
+    for index in SEARCH_INDEXES.values():
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {index['table']}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {index['table']}")
+
+
+def rebuild(model, chunk_size=1000):
+    """
+    Reindex every row of a model, one chunk of primary keys per transaction.
+    Yields the number of rows indexed so far after each chunk.
+    """
+    index = SEARCH_INDEXES[model]
+    fts, source = index['table'], model._meta.db_table
+    columns = ', '.join(index['columns'])
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('delete-all')")
+    last_id, indexed = 0, 0
+    while True:
+        ids = list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {fts}(rowid, {columns}) SELECT id, {columns} FROM {source} WHERE id BETWEEN %s AND %s",
+                [ids[0], ids[-1]],
+            )
+        last_id = ids[-1]
+        indexed += len(ids)
+        yield indexed
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+
+
+def match_query(terms):
+    # Quote every term so user input can never be read as FTS5 syntax; a trailing * makes it a prefix query
+    phrases = []
+    for term in terms:
+        prefix = term.endswith('*')
+        term = term.rstrip('*').replace('"', '')
+        if term:
+            phrases.append(f'"{term}"*' if prefix else f'"{term}"')
+    return ' '.join(phrases)
+
+
+# Drop-in replacement for SearchFilter backed by the FTS5 indexes.
+# Matches are ranked by relevance (BM25) unless the client asks for another ordering,
+# and each result carries a highlighted search_snippet. List it after OrderingFilter
+# in filter_backends so the relevance ordering is not overridden. Falls back to
+# SearchFilter on databases without FTS5 or for models without an index.
+class FullTextSearchFilter(filters.SearchFilter):
+    def filter_queryset(self, request, queryset, view):
+        index = SEARCH_INDEXES.get(queryset.model)
+        if index is None or not is_supported():
+            return super().filter_queryset(request, queryset, view)
+
+        match = match_query(self.get_search_terms(request))
+        if not match:
+            return queryset
+
+        fts, source = index['table'], queryset.model._meta.db_table
+        matched = f"FROM {fts} WHERE {fts} MATCH %s AND {fts}.rowid = {source}.id"
+        queryset = queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [match])
+        ).annotate(
+            search_rank=RawSQL(f"SELECT bm25({fts}) {matched}", [match], output_field=FloatField()),
+            search_snippet=RawSQL(
+                f"SELECT snippet({fts}, -1, %s, %s, '…', %s) {matched}",
+                [SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS, match],
+            ),
+        )
+        if api_settings.ORDERING_PARAM not in request.query_params:
+            # Best matches first (BM25 scores are negative, lower is better)
+            queryset = queryset.order_by('search_rank')
+        return queryset
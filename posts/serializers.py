@@ -1,11 +1,33 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from uploads.serializers import ImageAssetSerializer, ImageUploadMixin
+from social_media_api.instrumentation import TimedSerializerMixin
 from .models import Post, Comment, Like
 
 User = get_user_model() # Using the custom User model
 
+# Adds the highlighted search_snippet of full-text search results (see posts.search) to the output
+class SearchSnippetMixin:
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        snippet = getattr(instance, 'search_snippet', None)
+        if snippet is not None:
+            data['search_snippet'] = snippet
+        return data
+
+# Adds viewer_has_liked from the liked_post_ids set that the post views put in the
+# serializer context (see PostSummaryMixin.get_serializer), one query per page
+class ViewerLikeMixin:
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        liked = self.context.get('liked_post_ids')
+        if liked is not None:
+            data['viewer_has_liked'] = instance.pk in liked
+        return data
+
 # Serializer for Comment model
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, SearchSnippetMixin, serializers.ModelSerializer):
     author = serializers.PrimaryKeyRelatedField(read_only=True)
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
     
@@ -17,8 +39,30 @@ class CommentSerializer(serializers.ModelSerializer):
          model = Comment
          fields = "__all__"
 
+    def validate(self, attrs):
+        parent = attrs.get('parent')
+        if self.instance is not None:
+            # Moving a comment would leave its replies behind in the old thread
+            moved_post = 'post' in attrs and attrs['post'].pk != self.instance.post_id
+            moved_parent = 'parent' in attrs and (parent.pk if parent else None) != self.instance.parent_id
+            if moved_post or moved_parent:
+                raise serializers.ValidationError("A comment cannot be moved to another post or thread.")
+            return attrs
+
+        if parent is not None:
+            if parent.post_id != attrs['post'].pk:
+                raise serializers.ValidationError("A reply must be on the same post as the comment it replies to.")
+            if parent.depth + 1 > settings.COMMENT_MAX_DEPTH:
+                raise serializers.ValidationError(f"Replies cannot be nested more than {settings.COMMENT_MAX_DEPTH} levels deep.")
+        return attrs
+
+# Top-level comment with its first replies, as listed under a post.
+# Expects the first_replies prefetch from posts.threads.
+class CommentPreviewSerializer(CommentSerializer):
+    first_replies = CommentSerializer(many=True, read_only=True)
+
 # Serializer for Like model
-class LikeSerializer(serializers.ModelSerializer):
+class LikeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     post = serializers.PrimaryKeyRelatedField(read_only=True)
     author = serializers.PrimaryKeyRelatedField(read_only=True)
 
@@ -27,22 +71,46 @@ class LikeSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 # Serializer for Post model
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(TimedSerializerMixin, ViewerLikeMixin, SearchSnippetMixin, ImageUploadMixin, serializers.ModelSerializer):
     # Serializing 'author' as the user's ID
     author = serializers.PrimaryKeyRelatedField(read_only=True)
     media = serializers.ImageField(required=False)
+    image = ImageAssetSerializer(read_only=True)  # Resized variants of media
+    image_fields = {'media': 'image'}
     
     # Serializing 'created_at' and 'updated_at' as ISO format date-time strings
     created_at = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S', read_only=True)
     updated_at = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S', read_only=True)
     comments = CommentSerializer(many=True, read_only=True)
     likes = LikeSerializer(many=True, read_only=True)
+    like_count = serializers.IntegerField(read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Post
-        fields = ['id', 'author', 'title', 'content', 'media', 'created_at', 'updated_at', "comments", 'likes']
+        fields = ['id', 'author', 'title', 'content', 'media', 'image', 'created_at', 'updated_at', 'like_count', 'comment_count', "comments", 'likes']
 
     def validate_title(self, value):
         if len(value) < 3:
             raise serializers.ValidationError("Title must be at least 3 characters long.")
         return value
+
+
+# Compact serializer for Post: counts, the latest few comments and the viewer's like state
+# instead of every comment and like. Expects the prefetch and context added by PostSummaryMixin.
+class PostSummarySerializer(TimedSerializerMixin, ViewerLikeMixin, SearchSnippetMixin, serializers.ModelSerializer):
+    author = serializers.PrimaryKeyRelatedField(read_only=True)
+    media = serializers.ImageField(required=False)
+    image = ImageAssetSerializer(read_only=True)
+
+    # Serializing 'created_at' and 'updated_at' as ISO format date-time strings
+    created_at = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S', read_only=True)
+    updated_at = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S', read_only=True)
+    like_count = serializers.IntegerField(read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    latest_comments = CommentSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Post
+        fields = ['id', 'author', 'title', 'content', 'media', 'image', 'created_at', 'updated_at',
+                  'like_count', 'comment_count', 'latest_comments']
@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from social_media_api import caching
+from . import search, threads
+from .counters import release_user_counts
+from .models import Post, Comment, Like
+
+User = get_user_model()  # Custom user model
+
+
+# Keep post counters right when a user's likes and comments are removed by a cascade delete
+@receiver(pre_delete, sender=User, dispatch_uid='posts_release_user_counts')
+def user_pre_delete(sender, instance, **kwargs):
+    release_user_counts(instance)
+    threads.release_user_comments(instance)
+
+
+# Invalidate the cached representations of a saved or deleted post, and the cached post list pages
+@receiver(post_save, sender=Post, dispatch_uid='posts_invalidate_post')
+@receiver(post_delete, sender=Post, dispatch_uid='posts_invalidate_deleted_post')
+def post_changed(sender, instance, **kwargs):
+    caching.bump(caching.POST, instance.pk, stored=True)  # Saved with a new version, or gone
+    caching.bump(caching.POST_LIST, caching.ALL)
+
+
+# Invalidate the cached representations of the post a comment or like was saved on. Deleted
+# comments and likes are invalidated with the counters (see posts.counters): delete signal
+# handlers would keep cascades from deleting them in bulk. New comments and likes are counted
+# on the post by an UPDATE that writes its new version, so only the cached copies are dropped.
+@receiver(post_save, sender=Comment, dispatch_uid='posts_invalidate_comment_post')
+@receiver(post_save, sender=Like, dispatch_uid='posts_invalidate_like_post')
+def post_child_saved(sender, instance, created, **kwargs):
+    caching.bump(caching.POST, instance.post_id, stored=created)
+
+
+# Recreate the search sync triggers after migrations: SQLite drops them whenever a
+# migration rebuilds the posts_post or posts_comment table
+@receiver(post_migrate, dispatch_uid='posts_ensure_search_index')
+def ensure_search_index(sender, using, **kwargs):
+    connection = connections[using]
+    if sender.label != 'posts' or connection.vendor != 'sqlite':
+        return
+    tables = connection.introspection.table_names()
+    if all(index['table'] in tables for index in search.SEARCH_INDEXES.values()):
+        with connection.cursor() as cursor:
+            search.install(cursor)
@@ -1,3 +1,857 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import re
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from notifications.models import NotificationEvent
+from social_media_api import caching
+from social_media_api.testing import QueryCountTestCase
+from uploads.models import ImageAsset
+from users import graph
+from . import like_buffer, likes, threads, timeline
+from .counters import adjust_post_counts
+from .models import Post, Comment, Like, TimelineEntry
+from .serializers import CommentSerializer, PostSerializer
 
-# Create your tests here.
+User = get_user_model()  # Custom user model
+
+
+def add_comment(post, author, parent=None):
+    # Counted on the post like comments created through the API
+    comment = Comment.objects.create(post=post, author=author, parent=parent, content=f'Comment by {author.username}')
+    threads.attach(comment)
+    adjust_post_counts(post.id, comment_count=1)
+    return comment
+
+
+class PostQueryCountTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        authors = [User.objects.create_user(f'author{i}', f'author{i}@example.com', None) for i in range(3)]
+        for author in authors:
+            graph.follow(cls.viewer, author)
+        image = ImageAsset.objects.create(
+            sha256='0' * 64, original='images/00/0.jpg', width=640, height=480, status=ImageAsset.READY,
+            variants={'thumbnail': {'name': 'images/00/0_thumbnail.webp', 'width': 320, 'height': 240, 'size': 100}},
+        )
+
+        # 60 posts in the viewer's feed, half with an image, each with likes and a comment with a reply
+        cls.posts = []
+        for i in range(60):
+            author = authors[i % len(authors)]
+            post = Post.objects.create(author=author, title=f'Gardening post {i}', content='Tomatoes and basil',
+                                       image=image if i % 2 else None)
+            timeline.fan_out_post(post)
+            for liker in authors:
+                if liker != author:
+                    likes.like(liker, post.id)
+            if i % 3 == 0:
+                likes.like(cls.viewer, post.id)
+            comment = add_comment(post, authors[(i + 1) % len(authors)])
+            add_comment(post, author, parent=comment)
+            cls.posts.append(post)
+
+        # A post with 60 top-level comments, and a comment with 60 replies
+        cls.discussed = Post.objects.create(author=authors[0], title='Discussed post', content='content')
+        for i in range(60):
+            comment = add_comment(cls.discussed, authors[i % len(authors)])
+            add_comment(cls.discussed, authors[(i + 1) % len(authors)], parent=comment)
+        cls.thread = add_comment(cls.posts[0], authors[1])
+        for i in range(60):
+            add_comment(cls.posts[0], authors[i % len(authors)], parent=cls.thread)
+
+        cls.own_post = Post.objects.create(author=cls.viewer, title='My post', content='content')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.viewer)
+
+    def test_post_list(self):
+        url = reverse('post-viewset-list-list')
+        # User, page, comments, likes, the viewer's likes
+        self.assertConstantQueries(5, url)
+        self.assertConstantQueries(5, url, {'search': 'gardening'})
+        self.assertConstantQueries(5, url, {'ordering': '-created_at'})
+        # User, page, latest comments, the viewer's likes
+        self.assertConstantQueries(4, url, {'mode': 'summary'})
+
+    def test_feed(self):
+        url = reverse('post_feed')
+        # Two more than the post list, for the followed celebrity authors and the timeline entries of the page
+        self.assertConstantQueries(7, url)
+        self.assertConstantQueries(6, url, {'mode': 'summary'})
+        # Filtered feeds read the posts with the timeline as a subquery
+        self.assertConstantQueries(6, url, {'ordering': 'title'})
+
+    def test_serializer_timing(self):
+        # Lists and single posts count as serializer time, through the serializers' TimedSerializerMixin
+        for url in (reverse('post-viewset-list-list'), reverse('post-viewset-list-detail', args=[self.posts[1].id])):
+            with self.subTest(url=url):
+                timing = self.client.get(url)['Server-Timing']
+                self.assertGreater(float(re.search(r'serialize;dur=([\d.]+)', timing).group(1)), 0)
+        # DRF's own serializers are left as they are
+        self.assertEqual(vars(serializers.BaseSerializer)['data'].fget.__module__, 'rest_framework.serializers')
+
+    def test_post_detail(self):
+        url = reverse('post-viewset-list-detail', args=[self.posts[1].id])
+        self.assertMaxQueries(5, 'get', url)
+        self.assertMaxQueries(4, 'get', url, {'mode': 'summary'})
+
+    def test_summary_fields(self):
+        post = self.posts[1]
+        data = self.client.get(reverse('post-viewset-list-detail', args=[post.id]), {'mode': 'summary'}).data
+        # Counts and the latest comments instead of every comment and like
+        self.assertEqual(set(data), {
+            'id', 'author', 'title', 'content', 'media', 'image', 'created_at', 'updated_at',
+            'like_count', 'comment_count', 'latest_comments', 'viewer_has_liked',
+        })
+        self.assertEqual((data['like_count'], data['comment_count']), (post.likes.count(), post.comments.count()))
+        self.assertEqual((data['like_count'], data['comment_count']), (2, 2))
+        latest = list(post.comments.order_by('-created_at', '-id').values_list('id', flat=True)[:settings.POST_SUMMARY_COMMENTS])
+        self.assertEqual([comment['id'] for comment in data['latest_comments']], latest)
+
+        # Every post of a summary page, against the full representation
+        full = self.client.get(reverse('post-viewset-list-list')).data['results']
+        summary = self.client.get(reverse('post-viewset-list-list'), {'mode': 'summary'}).data['results']
+        self.assertEqual([item['id'] for item in summary], [item['id'] for item in full])
+        for short, long in zip(summary, full):
+            self.assertTrue({'comments', 'likes'} <= set(long) and not {'comments', 'likes'} & set(short))
+            self.assertEqual((short['like_count'], short['comment_count']), (len(long['likes']), len(long['comments'])))
+
+    def test_post_writes(self):
+        # The author's follower count is read afresh to decide on the fan-out
+        response = self.assertMaxQueries(6, 'post', reverse('post-viewset-list-list'),
+                                         {'title': 'New post', 'content': 'content'}, status=201)
+        url = reverse('post-viewset-list-detail', args=[response.data['id']])
+        self.assertMaxQueries(8, 'patch', url, {'title': 'Renamed post'})
+        self.assertMaxQueries(8, 'delete', url, status=204)
+
+    def test_comment_list(self):
+        self.assertConstantQueries(2, reverse('comment-viewset-list-list'))
+        self.assertConstantQueries(3, reverse('comment-viewset-list-list'), {'post': self.discussed.id})
+
+    def test_post_comments(self):
+        self.assertConstantQueries(4, reverse('post_comments', args=[self.discussed.id]))
+
+    def test_comment_thread(self):
+        self.assertConstantQueries(3, reverse('comment-viewset-list-thread', args=[self.thread.id]))
+
+    def test_comment_detail_and_writes(self):
+        self.assertMaxQueries(2, 'get', reverse('comment-viewset-list-detail', args=[self.thread.id]))
+        # A reply notifies both the post author and the author of the comment replied to
+        response = self.assertMaxQueries(15, 'post', reverse('post_comments', args=[self.posts[1].id]),
+                                         {'content': 'A comment', 'parent': self.posts[1].comments.first().id}, status=201)
+        url = reverse('comment-viewset-list-detail', args=[response.data['id']])
+        # The edit writes the post's new version: its representation shows the latest comments
+        self.assertMaxQueries(4, 'patch', url, {'content': 'Edited'})
+        self.assertMaxQueries(10, 'delete', url, status=204)
+        self.assertMaxQueries(8, 'post', reverse('comment-viewset-list-list'),
+                              {'post': self.own_post.id, 'content': 'On my own post'}, status=201)
+
+    def test_likes(self):
+        post_id = self.posts[1].id
+        self.assertMaxQueries(7, 'post', reverse('like_post', args=[post_id]), status=201)
+        self.assertMaxQueries(5, 'post', reverse('like_post', args=[post_id]), status=400)
+        self.assertMaxQueries(5, 'put', reverse('like_post', args=[post_id]))
+        self.assertMaxQueries(5, 'delete', reverse('unlike_post', args=[post_id]))
+        self.assertMaxQueries(5, 'delete', reverse('like_post', args=[post_id]))
+
+    def test_my_likes(self):
+        for ids in ([self.posts[0].id], [post.id for post in self.posts[:50]]):
+            with self.subTest(ids=len(ids)):
+                response = self.assertMaxQueries(2, 'get', reverse('my_likes'), {'ids': ','.join(map(str, ids))})
+                self.assertEqual(len(response.data), len(ids))
+
+
+class KeysetPaginationTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        cls.posts = [Post.objects.create(author=cls.viewer, title=f'Paged post {i}', content='content') for i in range(7)]
+        # Five posts created in the same instant, between an older and a newer one
+        now = timezone.now()
+        Post.objects.filter(pk=cls.posts[0].pk).update(created_at=now - timedelta(hours=1))
+        Post.objects.filter(pk__in=[post.pk for post in cls.posts[1:6]]).update(created_at=now)
+        Post.objects.filter(pk=cls.posts[6].pk).update(created_at=now + timedelta(hours=1))
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.viewer)
+        self.url = reverse('post-viewset-list-list')
+
+    def pages(self, link, direction):
+        # Pages from link on, following the direction link: ([IDs of each page], last response)
+        pages = []
+        while link:
+            response = self.client.get(link)
+            self.assertEqual(response.status_code, 200)
+            pages.append([post['id'] for post in response.data['results']])
+            link = response.data[direction]
+        return pages, response
+
+    def cursor(self, values, reverse=False, ordering=('created_at', 'pk')):
+        data = {'v': values, 'r': reverse, 'o': list(ordering)}
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def test_ties_on_created_at(self):
+        ids = [post.pk for post in self.posts]
+        # The primary key breaks the ties, in the direction of the last ordering field
+        for ordering, expected in (('created_at', ids), ('-created_at', ids[::-1])):
+            with self.subTest(ordering=ordering):
+                forward, last = self.pages(f'{self.url}?ordering={ordering}&page_size=2', 'next')
+                self.assertEqual(sum(forward, []), expected)
+                # Back from the last page through the previous links
+                backward, first = self.pages(last.data['previous'], 'previous')
+                self.assertEqual(sum(backward[::-1], []), expected[:-len(forward[-1])])
+                self.assertIsNone(first.data['previous'])
+
+    def test_search_results(self):
+        # Ranked by an annotation without a model field
+        pages, _ = self.pages(f'{self.url}?search=paged&page_size=3', 'next')
+        self.assertEqual(sorted(sum(pages, [])), [post.pk for post in self.posts])
+        cursor = self.cursor(['best', 1], ordering=['search_rank', 'pk'])
+        self.assertEqual(self.client.get(self.url, {'search': 'paged', 'cursor': cursor}).status_code, 404)
+
+    def test_invalid_cursors(self):
+        created_at = self.posts[3].created_at.isoformat()
+        valid = self.cursor([created_at, self.posts[3].pk])
+        self.assertEqual(self.client.get(self.url, {'ordering': 'created_at', 'cursor': valid}).status_code, 200)
+        for name, cursor, ordering in [
+            ('not base64', '%%%', 'created_at'),
+            ('not json', base64.urlsafe_b64encode(b'{"v": [').decode(), 'created_at'),
+            ('not an object', base64.urlsafe_b64encode(b'[1, 2]').decode(), 'created_at'),
+            ('string for a datetime', self.cursor(['yesterday', 1]), 'created_at'),
+            ('string for an ID', self.cursor([created_at, 'one']), 'created_at'),
+            ('ID out of range', self.cursor([created_at, 10 ** 30]), 'created_at'),
+            ('null value', self.cursor([None, 1]), 'created_at'),
+            ('nested value', self.cursor([{'a': 1}, 1]), 'created_at'),
+            ('missing value', self.cursor([created_at]), 'created_at'),
+            ('direction not a boolean', self.cursor([created_at, 1], reverse='yes'), 'created_at'),
+            ('other ordering', valid, '-created_at'),
+            ('values not a list', base64.urlsafe_b64encode(json.dumps({'v': 'ab', 'r': False, 'o': ['created_at', 'pk']}).encode()).decode(), 'created_at'),
+        ]:
+            with self.subTest(name):
+                response = self.client.get(self.url, {'ordering': ordering, 'cursor': cursor})
+                self.assertEqual((response.status_code, response.data), (404, {'detail': 'Invalid cursor'}))
+
+
+@override_settings(TIMELINE_FANOUT_THRESHOLD=2)
+class FeedTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        cls.fan = User.objects.create_user('fan', 'fan@example.com', 'password')
+        cls.author = User.objects.create_user('author', 'author@example.com', 'password')
+        cls.celebrity = User.objects.create_user('celebrity', 'celebrity@example.com', 'password')
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('post_feed')
+
+    def publish(self, author, count):
+        # Posts created through the API, so they are fanned out like any other
+        self.authenticate(author)
+        ids = [self.client.post(reverse('post-viewset-list-list'), {'title': 'Post', 'content': 'content'}).data['id']
+               for _ in range(count)]
+        self.authenticate(self.viewer)
+        return ids
+
+    def follow(self, user, followee):
+        self.authenticate(user)
+        self.assertEqual(self.client.post(reverse('follow_user', args=[followee.id])).status_code, 200)
+
+    def feed(self, **params):
+        # Post IDs of the whole feed, following the next links, then back through the previous links
+        forward, link = [], f'{self.url}?page_size=2'
+        for name, value in params.items():
+            link += f'&{name}={value}'
+        while link:
+            response = self.client.get(link)
+            forward.extend(post['id'] for post in response.data['results'])
+            link, previous = response.data['next'], response.data['previous']
+        backward = []
+        while previous:
+            response = self.client.get(previous)
+            backward[:0] = [post['id'] for post in response.data['results']]
+            previous = response.data['previous']
+        if len(forward) > 2:
+            self.assertEqual(backward, forward[:len(backward)])
+        return forward
+
+    def test_follow_and_unfollow(self):
+        older = self.publish(self.author, 3)
+        self.follow(self.viewer, self.author)
+        newer = self.publish(self.author, 2)
+        self.assertEqual(self.feed(), (older + newer)[::-1])
+
+        self.client.post(reverse('unfollow_user', args=[self.author.id]))
+        self.assertEqual(self.feed(), [])
+
+    def test_celebrity_posts_are_merged(self):
+        self.follow(self.viewer, self.author)
+        self.follow(self.viewer, self.celebrity)
+        fanned_out = self.publish(self.celebrity, 1)
+        self.follow(self.fan, self.celebrity)
+        # Two followers: the celebrity's new posts are pulled at read time
+        pulled = self.publish(self.celebrity, 2)
+        self.assertFalse(TimelineEntry.objects.filter(post_id__in=pulled).exists())
+        regular = self.publish(self.author, 2)
+
+        # All created in the same instant, the posts are ordered by ID; the fanned out post is
+        # both in the timeline and pulled, and is listed once
+        now = timezone.now()
+        Post.objects.update(created_at=now)
+        TimelineEntry.objects.update(created_at=now)
+        expected = sorted(fanned_out + pulled + regular)
+        self.assertEqual(self.feed(), expected[::-1])
+        # Filtered feeds read the same posts
+        self.assertEqual(self.feed(ordering='title'), expected)
+
+    def test_celebrity_with_stale_follower_count(self):
+        # self.celebrity was loaded with no followers: the count is read from the database
+        self.follow(self.viewer, self.celebrity)
+        self.follow(self.fan, self.celebrity)
+        post = Post.objects.create(author=self.celebrity, title='Post', content='content')
+        timeline.fan_out_post(post)
+        timeline.backfill_author(self.author, self.celebrity)
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_celebrity_drops_below_threshold(self):
+        self.follow(self.viewer, self.celebrity)
+        self.follow(self.fan, self.celebrity)
+        pulled = self.publish(self.celebrity, 3)
+        self.assertEqual(self.feed(), pulled[::-1])
+
+        # The fan leaves: the celebrity's posts are copied into the viewer's timeline once it commits
+        self.authenticate(self.fan)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('unfollow_user', args=[self.celebrity.id]))
+        self.assertEqual(set(TimelineEntry.objects.filter(user=self.viewer).values_list('post_id', flat=True)), set(pulled))
+        self.authenticate(self.viewer)
+        self.assertEqual(self.feed(), pulled[::-1])
+
+
+class SearchTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        cls.focused = Post.objects.create(author=cls.viewer, title='Gardening tips', content='Gardening in spring: gardening every day')
+        cls.mention = Post.objects.create(author=cls.viewer, title='Cooking', content='A short note about gardening')
+        cls.accented = Post.objects.create(author=cls.viewer, title='Café crème', content='Breakfast')
+        cls.comment = add_comment(cls.mention, cls.viewer)
+        Comment.objects.filter(pk=cls.comment.pk).update(content='Try composting first')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.viewer)
+        self.url = reverse('post-viewset-list-list')
+
+    def search(self, terms, url=None):
+        response = self.client.get(url or self.url, {'search': terms})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_ranked_matches(self):
+        results = self.search('gardening')
+        self.assertEqual([post['id'] for post in results], [self.focused.id, self.mention.id])
+        self.assertIn('<mark>gardening</mark>', results[1]['search_snippet'])
+
+    def test_prefixes_and_diacritics(self):
+        self.assertEqual({post['id'] for post in self.search('garden*')}, {self.focused.id, self.mention.id})
+        self.assertEqual([post['id'] for post in self.search('cafe')], [self.accented.id])
+        self.assertEqual(self.search('garden'), [])
+
+    def test_index_follows_writes(self):
+        # The triggers reindex updated rows and drop deleted ones
+        Post.objects.filter(pk=self.accented.pk).update(title='Tea time')
+        self.assertEqual(self.search('cafe'), [])
+        self.assertEqual([post['id'] for post in self.search('tea')], [self.accented.id])
+        Post.objects.filter(pk=self.focused.pk).delete()
+        self.assertEqual([post['id'] for post in self.search('gardening')], [self.mention.id])
+
+    def test_comment_search(self):
+        results = self.search('composting', reverse('comment-viewset-list-list'))
+        self.assertEqual([comment['id'] for comment in results], [self.comment.id])
+
+
+class CounterTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'password')
+        cls.fans = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', None) for i in range(2)]
+        cls.post = Post.objects.create(author=cls.author, title='Counted post', content='content')
+        cls.comment = add_comment(cls.post, cls.author)
+
+    def test_edits_keep_counters(self):
+        # Instances loaded before the likes and the reply, as by a concurrent edit
+        post, comment = Post.objects.get(pk=self.post.pk), Comment.objects.get(pk=self.comment.pk)
+        for fan in self.fans:
+            likes.like(fan, post.id)
+        self.authenticate(self.fans[0])
+        self.client.post(reverse('post_comments', args=[post.id]), {'content': 'A reply', 'parent': comment.id})
+
+        serializer = PostSerializer(post, data={'title': 'Edited post'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        serializer = CommentSerializer(comment, data={'content': 'Edited comment'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.authenticate(self.author)
+        self.client.patch(reverse('post-viewset-list-detail', args=[post.id]), {'content': 'Edited content'})
+        post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((post.title, post.content, post.like_count, post.comment_count), ('Edited post', 'Edited content', 2, 2))
+        self.assertEqual((comment.content, comment.reply_count), ('Edited comment', 1))
+
+    def test_nested_comment_is_attached_to_the_post(self):
+        other = Post.objects.create(author=self.author, title='Other post', content='content')
+        self.authenticate(self.fans[0])
+        # The post of the URL wins over one given in the body
+        response = self.client.post(reverse('post_comments', args=[self.post.id]), {'content': 'Nested', 'post': other.id})
+        self.assertEqual(response.status_code, 201)
+        comment = Comment.objects.get(pk=response.data['id'])
+        self.assertEqual((comment.post_id, comment.author_id, comment.content), (self.post.id, self.fans[0].id, 'Nested'))
+        self.assertEqual(comment.path, threads.encode(comment.pk))
+        self.post.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.post.comment_count, other.comment_count), (2, 0))
+        listed = self.client.get(reverse('post_comments', args=[self.post.id])).data['results']
+        self.assertIn(comment.id, [item['id'] for item in listed])
+
+    def test_reconcile_repairs_drift(self):
+        likes.like(self.fans[0], self.post.id)
+        add_comment(self.post, self.fans[1], parent=self.comment)
+        other = Post.objects.create(author=self.author, title='Other post', content='content')
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, comment_count=0)
+        Comment.objects.filter(pk=self.comment.pk).update(reply_count=3)
+        User.objects.filter(pk=self.author.pk).update(unread_notification_count=5)
+        self.post.refresh_from_db()
+        versions = dict(Post.objects.values_list('pk', 'version'))
+
+        out = io.StringIO()
+        call_command('reconcile_counters', '--batch-size', '1', stdout=out)
+        self.assertIn('posts: 2 checked, 1 repaired.', out.getvalue())
+        self.assertIn('comments: 2 checked, 1 repaired.', out.getvalue())
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count, self.comment.reply_count), (1, 2, 1))
+        self.assertEqual(self.author.unread_notification_count, 0)
+        # Repaired rows get a new version, the others keep theirs
+        self.assertNotEqual(self.post.version, versions[self.post.pk])
+        self.assertEqual(Post.objects.get(pk=other.pk).version, versions[other.pk])
+
+
+class LikeViewTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'password')
+        cls.fan = User.objects.create_user('fan', 'fan@example.com', None)
+        cls.post = Post.objects.create(author=cls.author, title='Liked post', content='content')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.fan)
+        self.like_url = reverse('like_post', args=[self.post.id])
+        self.unlike_url = reverse('unlike_post', args=[self.post.id])
+
+    def like_count(self):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, Like.objects.filter(post=self.post).count())
+        return self.post.like_count
+
+    def test_idempotent_like_and_unlike(self):
+        for _ in range(2):
+            self.assertEqual(self.client.put(self.like_url).data, {'detail': 'You liked this post.', 'liked': True})
+        self.assertEqual(self.like_count(), 1)
+        for _ in range(2):
+            self.assertEqual(self.client.delete(self.like_url).data, {'detail': 'You unliked this post.', 'liked': False})
+        self.assertEqual(self.like_count(), 0)
+
+    def test_repeated_like_and_unlike_are_refused(self):
+        self.assertEqual(self.client.post(self.like_url).status_code, 201)
+        self.assertEqual(self.client.post(self.like_url).status_code, 400)
+        self.assertEqual(self.like_count(), 1)
+        self.assertEqual(self.client.delete(self.unlike_url).status_code, 200)
+        self.assertEqual(self.client.delete(self.unlike_url).status_code, 400)
+        self.assertEqual(self.like_count(), 0)
+
+    def test_anonymous_requests_are_refused(self):
+        self.client.credentials()
+        for method, url in [('post', self.like_url), ('put', self.like_url), ('delete', self.like_url), ('delete', self.unlike_url)]:
+            with self.subTest(method=method, url=url):
+                self.assertEqual(getattr(self.client, method)(url).status_code, 401)
+        self.assertEqual(self.like_count(), 0)
+
+
+@override_settings(COMMENT_MAX_DEPTH=2, COMMENT_PREVIEW_REPLIES=1)
+class CommentThreadTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'password')
+        cls.post = Post.objects.create(author=cls.author, title='Threaded post', content='content')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.author)
+        # Replies written after the next thread was started, so ID order is not thread order
+        self.first = self.comment('first')
+        self.second = self.comment('second')
+        self.reply = self.comment('reply', self.first)
+        self.second_reply = self.comment('second reply', self.second)
+        self.later_reply = self.comment('later reply', self.first)
+        self.nested = self.comment('nested', self.reply)
+
+    def comment(self, content, parent=None):
+        data = {'content': content} if parent is None else {'content': content, 'parent': parent}
+        response = self.client.post(reverse('post_comments', args=[self.post.id]), data)
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def thread(self, pk):
+        response = self.client.get(reverse('comment-viewset-list-thread', args=[pk]), {'page_size': 2})
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [comment['id'] for comment in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def counts(self):
+        self.post.refresh_from_db()
+        replies = dict(Comment.objects.filter(post=self.post).values_list('id', 'reply_count'))
+        return self.post.comment_count, replies
+
+    def test_threads_are_depth_first(self):
+        self.assertEqual(self.thread(self.first), [self.first, self.reply, self.nested, self.later_reply])
+        self.assertEqual(self.thread(self.second), [self.second, self.second_reply])
+        self.assertEqual(self.thread(self.nested), [self.nested])
+
+        # Top-level comments with their first reply
+        results = self.client.get(reverse('post_comments', args=[self.post.id])).data['results']
+        self.assertEqual([(c['id'], [r['id'] for r in c['first_replies']]) for c in results],
+                         [(self.first, [self.reply]), (self.second, [self.second_reply])])
+
+    def test_depth_limit(self):
+        response = self.client.post(reverse('post_comments', args=[self.post.id]), {'content': 'too deep', 'parent': self.nested})
+        self.assertEqual(response.status_code, 400)
+
+    def test_removing_a_reply_removes_its_subtree(self):
+        self.assertEqual(self.counts(), (6, {self.first: 2, self.second: 1, self.reply: 1, self.second_reply: 0,
+                                             self.later_reply: 0, self.nested: 0}))
+        self.assertEqual(self.client.delete(reverse('comment-viewset-list-detail', args=[self.reply])).status_code, 204)
+        self.assertEqual(self.counts(), (4, {self.first: 1, self.second: 1, self.second_reply: 0, self.later_reply: 0}))
+        self.assertEqual(self.thread(self.first), [self.first, self.later_reply])
+
+    def test_batched_removal_keeps_counters(self):
+        comment = Comment.objects.get(pk=self.first)
+        # Deepest paths first: the replies go before the comment they answer
+        self.assertEqual(threads.remove_batch(comment, 3), 3)
+        self.assertEqual(self.counts(), (3, {self.first: 0, self.second: 1, self.second_reply: 0}))
+        self.assertEqual(threads.remove_batch(comment, 3), 1)
+        self.assertEqual(threads.remove_batch(comment, 3), 0)
+        self.assertEqual(self.counts(), (2, {self.second: 1, self.second_reply: 0}))
+
+@override_settings(LIKE_BUFFER_ENABLED=True)
+class LikeBufferTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author', 'author@example.com', 'password')
+        cls.fans = [User.objects.create_user(f'fan{i}', f'fan{i}@example.com', None) for i in range(4)]
+        cls.post = Post.objects.create(author=cls.author, title='Buffered post', content='content')
+
+    def setUp(self):
+        super().setUp()
+        # A buffer of the test's own, flushed by the test rather than by its thread
+        self.buffer = like_buffer.InProcessLikeBuffer()
+        self.enterContext(mock.patch.object(like_buffer.InProcessLikeBuffer, '_run'))
+        self.enterContext(mock.patch.object(likes, 'get_buffer', return_value=self.buffer))
+
+    def like(self, user, method='put'):
+        self.authenticate(user)
+        return getattr(self.client, method)(reverse('like_post', args=[self.post.id]))
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.buffer.flush()
+
+    def assertCounted(self):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, Like.objects.filter(post=self.post).count())
+
+    def test_flush_writes_counters_and_notifications(self):
+        for fan in self.fans:
+            self.assertEqual(self.like(fan).status_code, 202)
+        self.assertEqual(self.like(self.fans[3], 'delete').status_code, 202)  # The latest state wins
+        self.assertEqual(self.like(self.author).status_code, 400)  # Own posts are refused before buffering
+
+        # Pending likes show as liked before they are written
+        self.authenticate(self.fans[0])
+        self.assertTrue(self.client.get(reverse('my_likes'), {'ids': str(self.post.id)}).data[self.post.id])
+        self.assertFalse(Like.objects.exists())
+
+        self.assertEqual(self.flush(), (3, 0))
+        self.assertCounted()
+        self.assertEqual(self.post.like_count, 3)
+        self.assertEqual(NotificationEvent.objects.filter(recipient=self.author, verb='liked your post').count(), 3)
+
+        self.like(self.fans[0], 'delete')
+        self.like(self.fans[1])  # Already liked: nothing to write
+        self.assertEqual(self.flush(), (0, 1))
+        self.assertCounted()
+        self.assertEqual(self.post.like_count, 2)
+
+    def test_failed_flush_keeps_the_batch(self):
+        self.like(self.fans[0])
+        with mock.patch.object(like_buffer, 'apply_likes', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.pending(self.fans[0].id, [self.post.id]), {self.post.id: True})
+        self.assertEqual(self.flush(), (1, 0))
+        self.assertCounted()
+
+    def test_transient_failures_are_retried_a_few_times(self):
+        self.like(self.fans[0])
+        with override_settings(LIKE_BUFFER_MAX_ATTEMPTS=2), \
+                mock.patch.object(like_buffer, 'apply_likes', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+            self.assertEqual(self.buffer.pending(self.fans[0].id, [self.post.id]), {self.post.id: True})
+            with self.assertRaises(OperationalError), self.assertLogs('posts.like_buffer', 'ERROR'):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.pending(self.fans[0].id, [self.post.id]), {})
+        self.assertEqual(self.flush(), (0, 0))
+
+    def test_rows_that_cannot_be_written_are_dropped(self):
+        for fan in self.fans[:3]:
+            self.like(fan)
+        apply_likes = like_buffer.apply_likes
+
+        def fail_on_second_fan(changes):
+            if (self.fans[1].id, self.post.id) in changes:
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return apply_likes(changes)
+
+        with mock.patch.object(like_buffer, 'apply_likes', side_effect=fail_on_second_fan), \
+                self.assertLogs('posts.like_buffer', 'ERROR'):
+            self.assertEqual(self.flush(), (2, 0))
+        # Not retried
+        self.assertEqual(self.buffer.pending(self.fans[1].id, [self.post.id]), {})
+        self.assertEqual(self.flush(), (0, 0))
+        self.assertCounted()
+        self.assertEqual(self.post.like_count, 2)
+
+    def test_concurrent_likes_are_counted_once(self):
+        self.like(self.fans[0])
+        bulk_create = Like.objects.bulk_create
+
+        def after_concurrent_like(*args, **kwargs):
+            # Another process likes the post for the same user after the buffer read the existing likes
+            likes._insert_like(self.fans[0].id, self.post.id)
+            adjust_post_counts(self.post.id, like_count=1)
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(Like.objects, 'bulk_create', side_effect=after_concurrent_like):
+            self.flush()
+        self.assertCounted()
+        self.assertEqual(self.post.like_count, 1)
+
+    def test_likes_on_deleted_posts_are_dropped(self):
+        self.like(self.fans[0])
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertEqual(self.flush(), (0, 0))
+        self.assertFalse(Like.objects.exists())
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        cls.posts = [Post.objects.create(author=cls.author, title=f'Cached post {i}', content='content') for i in range(3)]
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.viewer)
+
+    def test_post_detail(self):
+        url = reverse('post-viewset-list-detail', args=[self.posts[0].id])
+        for mode in ('full', 'summary'):
+            with self.subTest(mode=mode):
+                first = self.assertMaxQueries(5, 'get', url, {'mode': mode})
+                # User, viewer's like
+                self.assertEqual(self.assertMaxQueries(2, 'get', url, {'mode': mode}).data, first.data)
+        self.assertMaxQueries(2, 'get', reverse('post-viewset-list-detail', args=[0]), status=404)
+
+    def test_post_detail_invalidation(self):
+        url = reverse('post-viewset-list-detail', args=[self.posts[0].id])
+        self.client.get(url)
+        self.client.put(reverse('like_post', args=[self.posts[0].id]))
+        response = self.client.get(url)
+        self.assertEqual((response.data['like_count'], response.data['viewer_has_liked']), (1, True))
+
+        response = self.client.post(reverse('post_comments', args=[self.posts[0].id]), {'content': 'A comment'})
+        comment_url = reverse('comment-viewset-list-detail', args=[response.data['id']])
+        self.assertEqual(self.client.get(url).data['comment_count'], 1)
+        self.client.patch(comment_url, {'content': 'Edited'})
+        self.assertEqual(self.client.get(url).data['comments'][0]['content'], 'Edited')
+        self.client.delete(comment_url)
+        self.assertEqual(self.client.get(url).data['comments'], [])
+
+        self.authenticate(self.author)
+        self.assertFalse(self.client.get(url).data['viewer_has_liked'])
+        self.client.patch(url, {'title': 'Edited post'})
+        self.assertEqual(self.client.get(url).data['title'], 'Edited post')
+        self.client.delete(url)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_post_list(self):
+        url = reverse('post-viewset-list-list')
+        first = self.assertMaxQueries(5, 'get', url, {'page_size': 2})
+        # User, viewer's likes
+        second = self.assertMaxQueries(2, 'get', url, {'page_size': 2})
+        self.assertEqual(second.data, first.data)
+        self.assertIn('cache;desc="hit 3"', second['Server-Timing'])
+
+        # Only the liked post is loaded again: the page of IDs and the other post are still cached
+        self.client.put(reverse('like_post', args=[self.posts[1].id]))
+        response = self.client.get(url, {'page_size': 2})
+        self.assertIn('cache;desc="hit 2, miss 1"', response['Server-Timing'])
+        self.assertEqual([post['like_count'] for post in response.data['results']], [0, 1])
+
+        self.authenticate(self.author)
+        self.client.post(url, {'title': 'New post', 'content': 'content'})
+        response = self.client.get(url, {'ordering': '-id'})
+        self.assertEqual(response.data['results'][0]['title'], 'New post')
+
+    def test_single_flight(self):
+        calls, started = [], threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return {'value': 1}
+
+        results = []
+        threads_ = [threading.Thread(target=lambda: results.append(caching.fetch(caching.POST, 0, 'test', compute))) for _ in range(5)]
+        threads_[0].start()
+        started.wait()
+        for thread in threads_[1:]:
+            thread.start()
+        for thread in threads_:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, [{'value': 1}] * 5))
+
+    def test_single_flight_keeps_other_locks(self):
+        # A request giving up on a slow computation must not release the lock of the one still running
+        cache = caches['default']
+        with override_settings(RESPONSE_CACHE_LOCK_TIMEOUT=0.05):
+            key = caching._entry_key(caching.POST, 0, 'test', '0')
+            cache.set(f'{key}:lock', 'owner')
+            self.assertEqual(caching._single_flight(key, lambda: 1), (1, caching.MISS))
+        self.assertEqual(cache.get(f'{key}:lock'), 'owner')
+
+    def test_shared_cache_check(self):
+        self.assertEqual([error.id for error in caching.check_shared_cache(None)], ['social_media_api.E001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(caching.check_shared_cache(None), [])
+        with override_settings(RESPONSE_CACHE_ENABLED=False):
+            self.assertEqual(caching.check_shared_cache(None), [])
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ConditionalGetTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'password')
+        cls.author = User.objects.create_user('author', 'author@example.com', None)
+        graph.follow(cls.viewer, cls.author)
+        cls.posts = []
+        for i in range(3):
+            post = Post.objects.create(author=cls.author, title=f'Validated post {i}', content='content')
+            timeline.fan_out_post(post)
+            cls.posts.append(post)
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.viewer)
+
+    def etag(self, url, params=None):
+        # Versions created by a request are newer than it: validators come with the next one
+        self.client.get(url, params)
+        return self.client.get(url, params)['ETag']
+
+    def test_post_detail(self):
+        url = reverse('post-viewset-list-detail', args=[self.posts[0].id])
+        etag = self.etag(url)
+        # User, viewer's like
+        response = self.assertMaxQueries(2, 'get', url, HTTP_IF_NONE_MATCH=etag, status=304)
+        self.assertEqual((response['ETag'], response.content), (etag, b''))
+        self.assertNotEqual(self.etag(url, {'mode': 'summary'}), etag)
+
+        self.client.put(reverse('like_post', args=[self.posts[0].id]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['viewer_has_liked'])
+
+        # The like is the viewer's own: other users still get their own validators
+        self.authenticate(self.author)
+        self.assertNotEqual(self.etag(url), self.etag(url, {'mode': 'summary'}))
+
+    def test_post_lists(self):
+        for url, params, limit, changed_limit in [
+            (reverse('post-viewset-list-list'), {'page_size': 2}, 3, 7),  # User, post rows, viewer's likes
+            (reverse('post_feed'), {'mode': 'summary'}, 5, 10),  # User, followed authors, timeline entries, posts, viewer's likes
+        ]:
+            with self.subTest(url=url):
+                etag = self.etag(url, params)
+                self.assertMaxQueries(limit, 'get', url, params, status=304, HTTP_IF_NONE_MATCH=etag)
+                self.client.post(reverse('post_comments', args=[self.posts[1].id]), {'content': 'A comment'})
+                self.assertNotEqual(self.assertMaxQueries(changed_limit, 'get', url, params, HTTP_IF_NONE_MATCH=etag)['ETag'], etag)
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_stored_versions(self):
+        # Without the cache, validators come from the versions stored in the post and user rows
+        detail = reverse('post-viewset-list-detail', args=[self.posts[1].id])
+        for url in (detail, reverse('post-viewset-list-list'), reverse('post_feed'), reverse('profile')):
+            with self.subTest(url=url):
+                etag = self.etag(url)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                self.client.post(reverse('post_comments', args=[self.posts[1].id]), {'content': 'A comment'})
+                self.client.put(reverse('profile_update'), {'bio': f'Changed for {url}'})
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_last_modified(self):
+        url = reverse('post-viewset-list-detail', args=[self.posts[0].id])
+        self.client.get(url)
+        self.assertFalse(self.client.get(url).has_header('Last-Modified'))  # Less than a second old
+
+        # Two seconds later
+        clock, clock_ns = time.time, time.time_ns
+        with mock.patch('time.time', lambda: clock() + 2), mock.patch('time.time_ns', lambda: clock_ns() + 2 * 10 ** 9):
+            last_modified = self.client.get(url)['Last-Modified']
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            self.client.put(reverse('like_post', args=[self.posts[0].id]))
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+        # The feed's versions do not cover its timeline: no Last-Modified
+        self.assertFalse(self.client.get(reverse('post_feed')).has_header('Last-Modified'))
@@ -0,0 +1,119 @@
+from collections import Counter
+from django.conf import settings
+from django.db.models import Count, F, Prefetch, Q
+from django.db.models.expressions import Window
+from django.db.models.functions import RowNumber
+from .counters import adjust_post_counts, shifted
+from .models import Comment
+
+# Comment threads as materialized paths.
+#
+# The path of a comment is the path of its parent followed by its own ID, zero-padded to
+# STEP digits, so a comment's path is a prefix of the paths of all its replies, and sorting
+# a post's comments by path lists every thread depth first. A whole subtree is then one
+# range scan on the (post, path) index, [path, successor(path)), whatever its depth. Only
+# digits are used, so the range means the same under any database collation.
+
+STEP = 10  # Digits per level
+
+
+def encode(pk):
+    return f'{pk:0{STEP}d}'
+
+
+def successor(path):
+    # Smallest path greater than every path starting with the given one
+    return path[:-STEP] + encode(int(path[-STEP:]) + 1)
+
+
+def subtree(comment):
+    """
+    The comment and all its replies, at any depth.
+    """
+    return Comment.objects.filter(post_id=comment.post_id, path__gte=comment.path, path__lt=successor(comment.path))
+
+
+def attach(comment):
+    """
+    Set the path and depth of a newly saved comment and count it on its parent.
+    """
+    if comment.parent_id is None:
+        comment.path, comment.depth = encode(comment.pk), 0
+    else:
+        parent = Comment.objects.only('path', 'depth').get(pk=comment.parent_id)
+        comment.path, comment.depth = parent.path + encode(comment.pk), parent.depth + 1
+        Comment.objects.filter(pk=comment.parent_id).update(reply_count=shifted('reply_count', 1))
+    Comment.objects.filter(pk=comment.pk).update(path=comment.path, depth=comment.depth)
+
+
+def remove(comment):
+    """
+    Delete a comment with all its replies and take them off the post's and the parent's counters.
+    Returns the number of comments deleted.
+    """
+    comments = subtree(comment)
+    removed = comments.count()
+    comments.delete()
+    adjust_post_counts(comment.post_id, comment_count=-removed)
+    if comment.parent_id is not None:
+        Comment.objects.filter(pk=comment.parent_id).update(reply_count=shifted('reply_count', -1))
+    return removed
+
+
+def remove_batch(comment, batch_size):
+    """
+    Delete at most batch_size comments of a comment's subtree and take them off the
+    counters. Returns the number deleted; the comment itself goes with the last batch.
+    """
+    # A reply's path sorts after the path of the comment it answers: in descending path
+    # order every batch takes replies before their parents, and never cascades
+    rows = list(subtree(comment).order_by('-path').values_list('pk', 'parent_id')[:batch_size])
+    deleted = {pk for pk, _ in rows}
+    Comment.objects.filter(pk__in=deleted).delete()
+    adjust_post_counts(comment.post_id, comment_count=-len(rows))
+    # Replies removed from comments that stay, at least until a later batch
+    removed_replies = Counter(parent_id for _, parent_id in rows if parent_id is not None and parent_id not in deleted)
+    for parent_id, total in removed_replies.items():
+        Comment.objects.filter(pk=parent_id).update(reply_count=shifted('reply_count', -total))
+    return len(rows)
+
+
+def outermost(paths):
+    # Drop the paths that lie inside another path of the list
+    roots = []
+    for path in sorted(paths):
+        if not roots or not path.startswith(roots[-1]):
+            roots.append(path)
+    return roots
+
+
+def release_user_comments(user):
+    """
+    Take the comments removed with a user off the counters of the posts and comments
+    they are on, before the user is deleted: the user's own comments and every reply
+    under them, whoever wrote it. Comments on the user's own posts go with the posts.
+    """
+    own = Comment.objects.filter(author=user).exclude(post__author=user).values_list('path', 'post_id', 'parent_id')
+    threads = {path: (post_id, parent_id) for path, post_id, parent_id in own}
+    roots = outermost(threads)
+
+    # Comments removed per post, counting each subtree once
+    for start in range(0, len(roots), 500):
+        condition = Q()
+        for path in roots[start:start + 500]:
+            condition |= Q(post_id=threads[path][0], path__gte=path, path__lt=successor(path))
+        for row in Comment.objects.filter(condition).order_by().values('post').annotate(total=Count('*')):
+            adjust_post_counts(row['post'], comment_count=-row['total'])
+
+    # Replies removed from comments that stay
+    removed_replies = Counter(threads[path][1] for path in roots if threads[path][1] is not None)
+    for parent_id, total in removed_replies.items():
+        Comment.objects.filter(pk=parent_id).update(reply_count=shifted('reply_count', -total))
+
+
+def first_replies():
+    # Prefetch of the first COMMENT_PREVIEW_REPLIES replies of every comment on a page, in one windowed query
+    replies = Comment.objects.annotate(
+        row=Window(RowNumber(), partition_by=[F('parent_id')], order_by=[F('created_at').asc(), F('id').asc()])
+    ).filter(row__lte=settings.COMMENT_PREVIEW_REPLIES).order_by('created_at', 'id')
+    return Prefetch('replies', queryset=replies, to_attr='first_replies')
@@ -0,0 +1,169 @@
+from functools import partial
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from .models import Post, TimelineEntry
+
+User = get_user_model()  # Custom user model
+Follow = User.followers.through  # Follow edges: from_customuser is followed by to_customuser
+
+# Feed timelines, materialized on write.
+#
+# A new post is copied into a TimelineEntry row for each follower of its author, with the
+# post's created_at, so a feed page is a range scan of the (user, created_at, post) index.
+# Authors with at least TIMELINE_FANOUT_THRESHOLD followers are not fanned out: their
+# posts are pulled at read time and merged into the page. An author who drops back below
+# the threshold has the posts they made above it fanned out then.
+
+# Number of timeline rows written per INSERT statement
+BATCH_SIZE = 1000
+
+
+def is_celebrity(author_id):
+    # Celebrity authors use the pull path instead of writing one row per follower. The count
+    # is read from the database: follows update it with F() expressions, so the author loaded
+    # by the request (e.g. request.user) may hold a stale follower_count.
+    return User.objects.filter(pk=author_id, follower_count__gte=settings.TIMELINE_FANOUT_THRESHOLD).exists()
+
+
+def celebrity_followees(user):
+    # IDs of followed authors whose posts are pulled into the feed at read time
+    return user.following.filter(follower_count__gte=settings.TIMELINE_FANOUT_THRESHOLD).values_list('id', flat=True)
+
+
+def _entries_for(user_id, posts):
+    return [
+        TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, created_at=post.created_at)
+        for post in posts
+    ]
+
+
+def _fan_out(author_id, posts):
+    # Copy posts of an author into the timeline of every follower, BATCH_SIZE rows per INSERT
+    follower_ids = Follow.objects.filter(from_customuser_id=author_id).values_list('to_customuser_id', flat=True).order_by()
+    batch, written = [], 0
+    for follower_id in follower_ids.iterator(chunk_size=BATCH_SIZE):
+        batch.extend(_entries_for(follower_id, posts))
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            written += len(batch)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        written += len(batch)
+    return written
+
+
+def fan_out_post(post):
+    """
+    Copy a new post into the timeline of every follower of its author.
+    """
+    if is_celebrity(post.author_id):
+        return
+    _fan_out(post.author_id, [post])
+
+
+def fan_out_missed_posts(author_id):
+    """
+    Copy the latest posts of an author that were never fanned out, made while the author
+    was above the fan-out threshold, into the timelines of their followers.
+    Returns the number of entries written.
+    """
+    posts = list(
+        Post.objects.filter(author_id=author_id)
+        .exclude(Exists(TimelineEntry.objects.filter(post=OuterRef('pk'))))
+        .only('id', 'author_id', 'created_at').order_by('-created_at')[:settings.TIMELINE_BACKFILL_LIMIT]
+    )
+    return _fan_out(author_id, posts) if posts else 0
+
+
+def followers_removed(author_ids):
+    """
+    Call inside the transaction that took one follower off each of these authors: the
+    posts of those who just dropped below the fan-out threshold, which feeds stop
+    pulling, are fanned out once it commits.
+    """
+    dropped = User.objects.filter(pk__in=author_ids, follower_count=settings.TIMELINE_FANOUT_THRESHOLD - 1)
+    for author_id in dropped.values_list('pk', flat=True):
+        transaction.on_commit(partial(fan_out_missed_posts, author_id))
+
+
+def backfill_author(user, author):
+    """
+    Copy the latest posts of a newly followed author into the user's timeline.
+    """
+    if is_celebrity(author.id):
+        return
+    posts = Post.objects.filter(author=author).only('id', 'author_id', 'created_at').order_by('-created_at')[:settings.TIMELINE_BACKFILL_LIMIT]
+    TimelineEntry.objects.bulk_create(_entries_for(user.id, posts), batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def remove_author(user, author):
+    """
+    Drop every post of an unfollowed author from the user's timeline.
+    """
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+def rebuild_timeline(user):
+    """
+    Regenerate a user's timeline from scratch from the authors they follow.
+    Returns the number of entries written.
+    """
+    TimelineEntry.objects.filter(user=user).delete()
+    celebrity_ids = list(celebrity_followees(user))
+    authors = user.following.exclude(id__in=celebrity_ids).values_list('id', flat=True)
+    written = 0
+    for author_id in authors.iterator(chunk_size=BATCH_SIZE):
+        posts = Post.objects.filter(author_id=author_id).only('id', 'author_id', 'created_at').order_by('-created_at')[:settings.TIMELINE_BACKFILL_LIMIT]
+        entries = _entries_for(user.id, posts)
+        TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        written += len(entries)
+    return written
+
+
+def feed_queryset(user):
+    """
+    Posts in the user's feed: the materialized timeline plus the posts of
+    followed celebrity authors, which are never fanned out. For filtered and
+    searched feeds; feed_page() reads the plain feed from the timeline index.
+    """
+    timeline = TimelineEntry.objects.filter(user=user).values('post_id')
+    celebrity_ids = list(celebrity_followees(user))
+    if celebrity_ids:
+        return Post.objects.filter(Q(pk__in=timeline) | Q(author_id__in=celebrity_ids))
+    return Post.objects.filter(pk__in=timeline)
+
+
+def _after(position, reverse, id_field):
+    # Rows past a (created_at, post ID) position: newer ones with reverse, else older ones.
+    # Written as a range on created_at so the index serves it.
+    if position is None:
+        return Q()
+    created_at, post_id = position
+    if reverse:
+        return Q(created_at__gte=created_at) & ~Q(created_at=created_at, **{f'{id_field}__lte': post_id})
+    return Q(created_at__lte=created_at) & ~Q(created_at=created_at, **{f'{id_field}__gte': post_id})
+
+
+def feed_page(user, position=None, reverse=False, limit=10):
+    """
+    IDs of up to limit posts of the user's feed after position, the (created_at, post ID)
+    of the last post seen, newest first; with reverse, the posts before it, oldest first.
+    Reads the user's timeline entries in index order and merges in the posts of the
+    followed celebrity authors.
+    """
+    sign = '' if reverse else '-'
+    rows = set(
+        TimelineEntry.objects.filter(_after(position, reverse, 'post_id'), user=user)
+        .order_by(f'{sign}created_at', f'{sign}post_id').values_list('created_at', 'post_id')[:limit]
+    )
+    celebrity_ids = list(celebrity_followees(user))
+    if celebrity_ids:
+        # Posts fanned out before their author became a celebrity come from both sides: the set keeps one
+        rows.update(
+            Post.objects.filter(_after(position, reverse, 'id'), author_id__in=celebrity_ids)
+            .order_by(f'{sign}created_at', f'{sign}id').values_list('created_at', 'id')[:limit]
+        )
+    return [post_id for _, post_id in sorted(rows, reverse=not reverse)[:limit]]
@@ -1,16 +1,30 @@
+from collections import OrderedDict
+from functools import partial
 from django.shortcuts import render, get_object_or_404
 from rest_framework import filters, views, viewsets, status, generics
+from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied, NotFound
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
-from .serializers import PostSerializer, CommentSerializer
+from .serializers import PostSerializer, PostSummarySerializer, CommentSerializer, CommentPreviewSerializer
 from .models import Post, Comment, Like
 from django.contrib.auth import authenticate, get_user_model
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.db.models.functions import RowNumber
+from django.db.models.expressions import Window
 from rest_framework.pagination import PageNumberPagination
 from django_filters import rest_framework
 from rest_framework.response import Response
-from notifications.models import Notification
-from django.contrib.contenttypes.models import ContentType
+from notifications.dispatch import notify
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from social_media_api import caching
+from social_media_api.conditional import ConditionalGetMixin
+from social_media_api.pagination import KeysetPagination
+from . import likes, threads, timeline
+from .counters import adjust_post_counts
+from .search import FullTextSearchFilter
 
 User = get_user_model()  # Custom user model
 
@@ -18,43 +32,187 @@ User = get_user_model()  # Custom user model
 class PostPagination(PageNumberPagination):
     page_size = 10  # Number of posts per page
 
+# Cursor pagination for posts and comments: no total count, and flat latency however deep the client scrolls
+class PostCursorPagination(KeysetPagination):
+    page_size = 10  # Number of posts per page
+
+# Cursor pagination for the feed. The plain feed (see PostFeed.reads_timeline) is read from
+# the user's timeline index by posts.timeline.feed_page, with the same cursors
+class FeedPagination(PostCursorPagination):
+    def paginate_queryset(self, queryset, request, view=None):
+        self.timeline_user = request.user if view is not None and view.reads_timeline() else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def fetch(self, queryset, values, reverse, limit):
+        if self.timeline_user is None:
+            return super().fetch(queryset, values, reverse, limit)
+        ids = timeline.feed_page(self.timeline_user, values, reverse, limit)
+        posts = queryset.filter(pk__in=ids).in_bulk()
+        return [posts[pk] for pk in ids if pk in posts]
+
+# Switches post endpoints between the full representation and the compact ?mode=summary one.
+# Either way a page of posts is loaded with a fixed number of queries, whatever the page size.
+class PostSummaryMixin:
+    def is_summary(self):
+        return self.request.query_params.get('mode') == 'summary'
+
+    def get_serializer_class(self):
+        if self.is_summary():
+            return PostSummarySerializer
+        return super().get_serializer_class()
+
+    def filter_queryset(self, queryset):
+        return self.with_related(super().filter_queryset(queryset))
+
+    def with_related(self, queryset):
+        # Load the image, comments and likes serialized with the posts of a queryset
+        queryset = queryset.select_related('image')
+        if not self.is_summary():
+            # Full mode embeds every comment and like: load them in one query each
+            return queryset.prefetch_related('comments', 'likes')
+
+        # Latest comments of every post on the page, fetched in a single windowed query
+        latest_comments = Comment.objects.annotate(
+            row=Window(RowNumber(), partition_by=[F('post_id')], order_by=[F('created_at').desc(), F('id').desc()])
+        ).filter(row__lte=settings.POST_SUMMARY_COMMENTS).order_by('-created_at', '-id')
+
+        # like_count and comment_count are plain columns, see posts.counters
+        return queryset.prefetch_related(Prefetch('comments', queryset=latest_comments, to_attr='latest_comments'))
+
+    def get_serializer(self, *args, **kwargs):
+        # Resolve viewer_has_liked for every post being serialized with one IN query
+        if args:
+            posts = args[0] if kwargs.get('many') else [args[0]]
+            context = kwargs.setdefault('context', self.get_serializer_context())
+            context['liked_post_ids'] = likes.liked_post_ids(self.request.user, [post.pk for post in posts])
+        return super().get_serializer(*args, **kwargs)
+
+    def listed_state(self, ids, liked, next_link, previous_link, loaded=None):
+        # State of a page for conditional GET (see social_media_api.conditional): the posts
+        # and the viewer's like states, the page links, and the post versions
+        versions = caching.versions(caching.POST, ids, loaded)
+        return [[(pk, pk in liked) for pk in ids], next_link, previous_link], [versions[pk] for pk in ids]
+
+    def page_state(self):
+        # The state of the requested page from the post rows alone, without their comments and likes
+        posts = self.paginate_queryset(super().filter_queryset(self.get_queryset()))
+        ids = [post.pk for post in posts]
+        liked = likes.liked_post_ids(self.request.user, ids)
+        return self.listed_state(ids, liked, self.paginator.get_next_link(), self.paginator.get_previous_link(), {post.pk: post for post in posts})
+
+    def response_page_state(self, response):
+        results = response.data['results']
+        liked = {post['id'] for post in results if post['viewer_has_liked']}
+        # Posts serialized from the page read by the paginator carry their versions, read with their rows
+        loaded = {post.pk: post for post in getattr(self.paginator, 'page', None) or []}
+        return self.listed_state([post['id'] for post in results], liked, response.data['next'], response.data['previous'], loaded)
+
 # Viewset for managing posts
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(ConditionalGetMixin, PostSummaryMixin, viewsets.ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = PostPagination
-    filter_backends = [rest_framework.DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = PostCursorPagination
+    filter_backends = [rest_framework.DjangoFilterBackend, filters.OrderingFilter, FullTextSearchFilter]
     filterset_fields = ['title', 'created_at']
     search_fields = ['title', 'content']
     ordering_fields = ['id', 'title', 'created_at']
     ordering = ['id']
     
+    def cache_variant(self, allowed_params):
+        # Variant of the cached post representations, or None when the request cannot use them:
+        # they depend on the mode and on the host in media URLs, and only lists take more parameters
+        if not settings.RESPONSE_CACHE_ENABLED or set(self.request.query_params) - allowed_params - {'mode'}:
+            return None
+        return caching.variant(self.request, 'summary' if self.is_summary() else 'full')
+
+    def representations(self, posts):
+        # Cacheable representations of posts, {pk: data}, without the viewer's like state
+        serializer = self.get_serializer_class()(posts, many=True, context=self.get_serializer_context())
+        return {post.pk: data for post, data in zip(posts, serializer.data)}
+
+    def with_viewer_likes(self, representations):
+        # Add viewer_has_liked to cached representations, with one IN query for all of them
+        liked = likes.liked_post_ids(self.request.user, [data['id'] for data in representations])
+        return [{**data, 'viewer_has_liked': data['id'] in liked} for data in representations]
+
+    def cached_list(self, variant):
+        # A page from the cache: the post IDs of the page (invalidated by any post being saved or
+        # deleted) and the representation of each post (invalidated by writes to that post)
+        loaded = {}
+
+        def page():
+            posts = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+            loaded.update((post.pk, post) for post in posts)
+            return {'ids': list(loaded), 'next': self.paginator.get_next_link(), 'previous': self.paginator.get_previous_link()}
+
+        def compute(ids):
+            posts = [loaded[pk] for pk in ids if pk in loaded]
+            if len(posts) < len(ids):
+                posts = list(self.with_related(Post.objects.filter(pk__in=ids)))
+            return self.representations(posts)
+
+        listing = caching.fetch(caching.POST_LIST, caching.ALL, self.request.build_absolute_uri(), page)
+        representations = caching.fetch_many(caching.POST, listing['ids'], variant, compute)
+        results = [representations[pk] for pk in listing['ids'] if pk in representations]
+        return Response(OrderedDict([
+            ('next', listing['next']),
+            ('previous', listing['previous']),
+            ('results', self.with_viewer_likes(results)),
+        ]))
+
+    def cached_retrieve(self, pk, variant):
+        def compute():
+            return self.representations([self.get_object()])[pk]
+        return Response(self.with_viewer_likes([caching.fetch(caching.POST, pk, variant, compute)])[0])
+
+    def listed_state(self, ids, liked, next_link, previous_link, loaded=None):
+        # Cached pages list the post IDs read when they were cached: which posts are listed only
+        # changes with writes to posts, which bump the list version. Otherwise the IDs are current.
+        parts, versions = super().listed_state(ids, liked, next_link, previous_link, loaded)
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return parts, versions
+        return parts, versions + [caching.versions(caching.POST_LIST, [caching.ALL])[caching.ALL]]
+
+    def detail_state(self, pk, liked, post=None):
+        # State of a post for conditional GET: its ID, the viewer's like state and its version
+        return [pk, liked], [caching.versions(caching.POST, [pk], {pk: post} if post is not None else None)[pk]]
+
+    def get_object(self):
+        # Kept for the validators of the response, which take the version read with the post
+        self.object = super().get_object()
+        return self.object
+
     def perform_create(self, serializer):
          # Automatically set the author of the post to the current logged-in user
-        serializer.save(author=self.request.user)
+        post = serializer.save(author=self.request.user)
+        # Copy the new post into the timelines of the author's followers
+        timeline.fan_out_post(post)
 
     def perform_update(self, serializer):
         # Check if the user is the author before updating
-        if self.get_object().author != self.request.user:
+        if serializer.instance.author_id != self.request.user.id:
             raise PermissionDenied("You can only update your own posts!")
         serializer.save()
 
     def perform_destroy(self, instance):
         # Check if the user is the author before deleting
-        if instance.author != self.request.user:
+        if instance.author_id != self.request.user.id:
             raise PermissionDenied("You can only delete your own posts!")
         instance.delete()
 
     @swagger_auto_schema(
         operation_summary="Retrieve a list of posts",
-        operation_description="Get a paginated list of posts with optional filtering, searching, and ordering."
+        operation_description="Get a paginated list of posts with optional filtering, full-text searching, and ordering. Search results are ranked by relevance unless an ordering is given, terms ending in * match as prefixes, and each result carries a highlighted search_snippet. Pass mode=summary for comment and like counts, the latest comments and the viewer's like state instead of every comment and like."
     )
     def list(self, request, *args, **kwargs):
         """
         Get a paginated list of posts with optional filtering, searching, and ordering.
         """
-        return super().list(request, *args, **kwargs)
+        # Search results carry snippets and depend on the query: they are not cached
+        variant = self.cache_variant({'page_size', 'cursor', 'ordering', *self.filterset_fields})
+        respond = partial(self.cached_list, variant) if variant is not None else partial(super().list, request, *args, **kwargs)
+        return self.conditional_get(self.page_state, respond, self.response_page_state)
 
     @swagger_auto_schema(
         operation_summary="Create a new post",
@@ -75,7 +233,17 @@ class PostViewSet(viewsets.ModelViewSet):
         """
         Get details of a single post by its ID.
         """
-        return super().retrieve(request, *args, **kwargs)
+        if not str(kwargs['pk']).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        pk = int(kwargs['pk'])
+        variant = self.cache_variant(set())
+        respond = partial(self.cached_retrieve, pk, variant) if variant is not None else partial(super().retrieve, request, *args, **kwargs)
+        return self.conditional_get(
+            # Validated without loading the post: its version and the viewer's like state
+            lambda: self.detail_state(pk, pk in likes.liked_post_ids(request.user, [pk])),
+            respond,
+            lambda response: self.detail_state(response.data['id'], response.data['viewer_has_liked'], getattr(self, 'object', None)),
+        )
 
     @swagger_auto_schema(
         operation_summary="Update an existing post",
@@ -98,75 +266,160 @@ class PostViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 # View for displaying a user's feed (posts from followed users)
-class PostFeed(generics.ListAPIView):
+class PostFeed(ConditionalGetMixin, PostSummaryMixin, generics.ListAPIView):
     #queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = PostPagination
-    filter_backends = [rest_framework.DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = FeedPagination
+    filter_backends = [rest_framework.DjangoFilterBackend, filters.OrderingFilter, FullTextSearchFilter]
     filterset_fields = ['title', 'created_at']
     search_fields = ['title', 'content']
     ordering_fields = ['id', 'title', 'created_at']
     ordering = ["-created_at"]
 
+    def reads_timeline(self):
+        # The feed newest first, neither filtered nor searched, is paged on the timeline index
+        params = self.request.query_params
+        filtered = any(params.get(name) for name in [*self.filterset_fields, 'search'])
+        return not filtered and params.get('ordering', '-created_at') == '-created_at'
+
     def get_queryset(self):
-        # Get posts from users that the current user is following
-        following_users = self.request.user.following.all()
-        feed = Post.objects.filter(author__in=following_users).order_by('-created_at')
+        # Get posts from users that the current user is following, read from the materialized timeline
+        if self.reads_timeline():
+            # FeedPagination picks the posts of the page
+            return Post.objects.order_by('-created_at')
+        feed = timeline.feed_queryset(self.request.user).order_by('-created_at')
         return feed
 
      # Adding Swagger documentation
     @swagger_auto_schema(
         operation_summary="Retrieve posts from followed users",
-        operation_description="This endpoint returns a list of posts from users that the authenticated user is following, ordered by creation date. You can filter by post title, content, and creation date. You can also search posts by title or content."
+        operation_description="This endpoint returns a list of posts from users that the authenticated user is following, ordered by creation date. You can filter by post title, content, and creation date. You can also search posts by title or content. Pass mode=summary for the compact representation."
     )
     def get(self, request, *args, **kwargs):
         """
         Get the posts from followed users for the current authenticated user.
         """
+        # The post versions do not cover the timeline entries: no Last-Modified, the ETag lists the posts
+        return self.conditional_get(self.page_state, partial(super().get, request, *args, **kwargs), self.response_page_state, last_modified=False)
+
+# Creates comments for the comment endpoints: the logged-in user is the author, the comment is
+# placed in its thread and counted on its post, and the post and parent authors are notified
+class CommentCreateMixin:
+    def perform_create(self, serializer):
+        # Save the comment with the logged-in user as the author, place it in its thread, and count it on the post
+        with transaction.atomic():
+            comment = serializer.save(author=self.request.user)
+            threads.attach(comment)
+            adjust_post_counts(comment.post_id, comment_count=1)
+
+            # Queue a notification for the post author (notify them about the new comment)
+            post = comment.post  # comment is linked to a post
+            if post.author != self.request.user:
+                # Notify the post author about the new comment
+                notify(
+                    recipient=post.author,  # The user who owns the post
+                    actor=self.request.user,  # The user who made the comment
+                    verb='commented on your post',  # Action description
+                    target=post,  # The post that was commented on
+                    key=f'comment:{comment.id}',  # One notification per comment
+                )
+
+            # Queue a notification for the author of the comment being replied to
+            parent = comment.parent
+            if parent is not None and parent.author_id != self.request.user.id and parent.author_id != post.author_id:
+                notify(
+                    recipient=parent.author,  # The user who wrote the comment
+                    actor=self.request.user,  # The user who replied
+                    verb='replied to your comment',  # Action description
+                    target=post,  # The post the thread is on
+                    key=f'reply:{comment.id}',  # One notification per reply
+                )
+
+# View for listing and adding the comments of a single post
+class PostCommentList(CommentCreateMixin, generics.ListCreateAPIView):
+    serializer_class = CommentPreviewSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = PostCursorPagination
+
+    def check_post(self):
+        # Return 404 for unknown posts rather than an empty list or a validation error
+        if not Post.objects.filter(pk=self.kwargs['post_id']).exists():
+            raise NotFound("Post not found.")
+
+    def get_queryset(self):
+        self.check_post()
+        # Top-level comments, each with its first replies fetched for the whole page in one query
+        return (
+            Comment.objects.filter(post_id=self.kwargs['post_id'], parent__isnull=True)
+            .prefetch_related(threads.first_replies())
+            .order_by('created_at')
+        )
+
+    def get_serializer_class(self):
+        # New comments are returned without the reply preview
+        if self.request.method == 'POST':
+            return CommentSerializer
+        return super().get_serializer_class()
+
+    @swagger_auto_schema(
+        operation_summary="Retrieve the comments of a post",
+        operation_description="Get a paginated list of the top-level comments on a post, oldest first, each with its reply_count and its first replies. Use comments_all/{id}/thread/ for a whole thread."
+    )
+    def get(self, request, *args, **kwargs):
+        """
+        Get the top-level comments of a post with their first replies, oldest first.
+        """
         return super().get(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        operation_summary="Comment on a post",
+        operation_description="Create a comment on this post, or a reply when parent is given. The author is automatically set to the logged-in user, and the post author is notified.",
+        request_body=CommentSerializer,
+    )
+    def post(self, request, *args, **kwargs):
+        """
+        Create a comment on the post given in the URL.
+        """
+        return super().post(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        # The post comes from the URL
+        self.check_post()
+        data = request.data.copy()
+        data['post'] = self.kwargs['post_id']
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 # Viewset for managing comments on posts
-class CommentViewset(viewsets.ModelViewSet):
+class CommentViewset(CommentCreateMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = PostPagination
+    pagination_class = PostCursorPagination
      # Enable Filtering, Searching, and Ordering
-    filter_backends = [rest_framework.DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [rest_framework.DjangoFilterBackend, filters.OrderingFilter, FullTextSearchFilter]
     # Define the filter fields
-    filterset_fields = ['content', 'created_at']
+    filterset_fields = ['post', 'parent', 'content', 'created_at']
     search_fields = ['content']
     ordering_fields = ['id', 'content', 'created_at']
     ordering = ['id']  # Default ordering by id
 
-    def perform_create(self, serializer):
-        # Save the comment with the logged-in user as the author
-        comment = serializer.save(author=self.request.user)
-
-        # Create a notification for the post author (notify them about the new comment)
-        post = comment.post  # comment is linked to a post
-        if post.author != self.request.user:
-            # Notify the post author about the new comment
-            Notification.objects.create(
-                recipient=post.author,  # The user who owns the post
-                actor=self.request.user,  # The user who made the comment
-                verb='commented on your post',  # Action description
-                target_content_type=ContentType.objects.get_for_model(Post),  # Content type of the post
-                target_object_id=post.id  # The ID of the post
-            )
-
     def perform_update(self, serializer):
         # Check if the user is the author before updating
-        if self.get_object().author != self.request.user:
+        if serializer.instance.author_id != self.request.user.id:
             raise PermissionDenied("You can only update your own posts.")
         serializer.save()
 
     def perform_destroy(self, instance):
         # Check if the user is the author before deleting
-        if instance.author != self.request.user:
+        if instance.author_id != self.request.user.id:
             raise PermissionDenied("You can only delete your own posts.")
-        instance.delete()
+        # Delete the comment with its replies and uncount them
+        with transaction.atomic():
+            threads.remove(instance)
     
     @swagger_auto_schema(
         operation_summary="Retrieve a list of comments",
@@ -199,6 +452,20 @@ class CommentViewset(viewsets.ModelViewSet):
         """
         return super().retrieve(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        operation_summary="Retrieve a comment thread",
+        operation_description="Get a comment and all its replies at any depth, depth first (each reply follows the comment it replies to), paginated."
+    )
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        """
+        Get a comment and every reply under it, read with one range query on the thread path.
+        """
+        comment = self.get_object()
+        page = self.paginate_queryset(threads.subtree(comment).order_by('path'))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @swagger_auto_schema(
         operation_summary="Update an existing comment",
         operation_description="Update an existing comment. Only the comment's author can update it."
@@ -219,57 +486,106 @@ class CommentViewset(viewsets.ModelViewSet):
         """
         return super().destroy(request, *args, **kwargs)
 
-# View for liking a post
+# Messages for the outcomes of likes.like() and likes.unlike()
+LIKE_ERRORS = {
+    likes.NOT_FOUND: ({'detail': 'Post not found.'}, status.HTTP_404_NOT_FOUND),
+    likes.OWN_POST: ({'detail': 'You cannot like your own post.'}, status.HTTP_400_BAD_REQUEST),
+}
+UNLIKE_ERRORS = {
+    likes.NOT_FOUND: ({'detail': 'Post not found.'}, status.HTTP_404_NOT_FOUND),
+    likes.OWN_POST: ({'detail': 'You cannot unlike your own post.'}, status.HTTP_400_BAD_REQUEST),
+}
+
+def like_error(errors, outcome):
+    message, code = errors[outcome]
+    return Response(message, status=code)
+
+# View for liking a post.
+# POST likes the post once and rejects repeats; PUT and DELETE set the like state
+# idempotently and succeed whether or not anything changed. With the like buffer
+# enabled, every like and unlike is answered with 202 Accepted and written shortly after.
 class LikePostView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
     @swagger_auto_schema(
         operation_summary="Like a post",
         operation_description="View for liking a post"
     )
     def post(self, request, post_id):
-        user = request.user
-        post = get_object_or_404(Post, pk=post_id)
-
-        # Check if the user is trying to like their own post
-        if post.author == user:
-            return Response({'detail': 'You cannot like your own post.'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Get or create a Like object
-        like, created = Like.objects.get_or_create(user=user, post=post)
-        
-        if not created:
+        outcome = likes.like(request.user, post_id)
+        if outcome in LIKE_ERRORS:
+            return like_error(LIKE_ERRORS, outcome)
+        if outcome == likes.UNCHANGED:
             return Response({'detail': 'You already liked this post.'}, status=status.HTTP_400_BAD_REQUEST)
-         
-         # Create a notification for the post's author when a post is liked
-        notification = Notification(
-            recipient=post.author,  # The author of the post
-            actor=user,             # The user who liked the post
-            verb='liked your post', # Verb explaining the action
-            # ContentType to link the notification to the Post model
-            target_content_type=ContentType.objects.get_for_model(Post),  # The content type of the Post model
-            target_object_id=post.id,  # The specific post that was liked
-        )
-        notification.save()
-        
+        if outcome == likes.QUEUED:
+            return Response({'detail': 'You liked this post.'}, status=status.HTTP_202_ACCEPTED)
         return Response({'detail': 'You liked this post.'}, status=status.HTTP_201_CREATED)
 
+    @swagger_auto_schema(
+        operation_summary="Like a post (idempotent)",
+        operation_description="Like a post. Liking a post that is already liked succeeds without changing anything."
+    )
+    def put(self, request, post_id):
+        outcome = likes.like(request.user, post_id)
+        if outcome in LIKE_ERRORS:
+            return like_error(LIKE_ERRORS, outcome)
+        code = status.HTTP_202_ACCEPTED if outcome == likes.QUEUED else status.HTTP_200_OK
+        return Response({'detail': 'You liked this post.', 'liked': True}, status=code)
+
+    @swagger_auto_schema(
+        operation_summary="Unlike a post (idempotent)",
+        operation_description="Remove your like from a post. Unliking a post that is not liked succeeds without changing anything."
+    )
+    def delete(self, request, post_id):
+        outcome = likes.unlike(request.user, post_id)
+        if outcome in UNLIKE_ERRORS:
+            return like_error(UNLIKE_ERRORS, outcome)
+        code = status.HTTP_202_ACCEPTED if outcome == likes.QUEUED else status.HTTP_200_OK
+        return Response({'detail': 'You unliked this post.', 'liked': False}, status=code)
+
 # View for unliking a post
 class UnlikePostView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
     @swagger_auto_schema(
         operation_summary="Unlike a post",
         operation_description="View for unliking a post"
     )
     def delete(self, request, post_id):
-        user = request.user
-        post = get_object_or_404(Post, pk=post_id)
+        outcome = likes.unlike(request.user, post_id)
+        if outcome in UNLIKE_ERRORS:
+            return like_error(UNLIKE_ERRORS, outcome)
+        if outcome == likes.UNCHANGED:
+            return Response({'detail': 'You have not liked this post yet.'}, status=status.HTTP_400_BAD_REQUEST)
+        if outcome == likes.QUEUED:
+            return Response({'detail': 'You unliked this post.'}, status=status.HTTP_202_ACCEPTED)
+        return Response({'detail': 'You unliked this post.'}, status=status.HTTP_200_OK)
 
-        # Check if the user is trying to unlike their own post
-        if post.author == user:
-            return Response({'detail': 'You cannot unlike your own post.'}, status=status.HTTP_400_BAD_REQUEST)
+# Which of a batch of posts the authenticated user has liked
+class MyLikesView(views.APIView):
+    permission_classes = [IsAuthenticated]
+    max_ids = 200  # Largest number of post IDs accepted per request
 
-        # Try to get the Like object, or return a 404 error if it doesn't exist
+    @swagger_auto_schema(
+        operation_summary="Liked posts among a batch",
+        operation_description="This returns, for each post ID, whether you have liked the post",
+        manual_parameters=[
+            openapi.Parameter('ids', openapi.IN_QUERY, description="Comma-separated post IDs", type=openapi.TYPE_STRING, required=True),
+        ],
+    )
+    def get(self, request):
+        # Parse the comma-separated list of post IDs
         try:
-            like = Like.objects.get(user=user, post=post)  # This will raise Like.DoesNotExist if no like exists
-            like.delete()  # If found, delete the like
-            return Response({'detail': 'You unliked this post.'}, status=status.HTTP_200_OK)
-        except Like.DoesNotExist:
-            return Response({'detail': 'You have not liked this post yet.'}, status=status.HTTP_400_BAD_REQUEST)
+            post_ids = list(dict.fromkeys(int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()))
+        except ValueError:
+            return Response({'detail': 'ids must be a comma-separated list of post IDs.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not post_ids:
+            return Response({'detail': 'ids must be a comma-separated list of post IDs.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(post_ids) > self.max_ids:
+            return Response({'detail': f'At most {self.max_ids} post IDs can be checked at once.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One IN query answers every post ID
+        liked = likes.liked_post_ids(request.user, post_ids)
+        return Response({post_id: post_id in liked for post_id in post_ids}, status=status.HTTP_200_OK)
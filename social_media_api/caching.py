@@ -0,0 +1,256 @@
+import hashlib
+import os
+import time
+from django.apps import apps
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import transaction
+from . import instrumentation
+
+# Version-keyed response cache, enabled with RESPONSE_CACHE_ENABLED.
+#
+# Cached representations (a post in full or summary mode, a profile, the post IDs of a
+# list page) are stored under keys that carry the current version of what they were
+# built from, e.g. "post 42 at version 1f3a...". Writes bump the versions (the signal
+# handlers in posts.signals and users.signals, and the code that updates rows without
+# signals: posts.counters, users.counters, ...), so the next read misses and rebuilds:
+# invalidation is exact and never scans keys, and the old entries simply expire.
+#
+# Versions are unique tokens rather than incrementing integers: a version evicted from
+# the cache comes back as a new token, never as an older value whose entries are still
+# cached. Tokens start with the time they were set, see changed_at(). A bump inside a
+# transaction is repeated once the transaction commits, since another request may have
+# cached the data it read before the commit under the new version. bump_all() moves
+# every key to a new generation, for bulk writes. The versions also serve as HTTP
+# validators (see social_media_api.conditional).
+#
+# A missing entry is rebuilt by a single request (single flight): it takes a short lock
+# in the cache and the concurrent requests for the same key wait for its result instead
+# of all querying the database at once. Hits, misses and coalesced waits are counted in
+# the metrics (see social_media_api.instrumentation) and the Server-Timing header.
+#
+# The cache must be shared by all the server processes (e.g. Redis or Memcached): with
+# LocMemCache a process never sees the versions bumped by the others and serves stale
+# entries. The cache is off by default, and the system check below refuses to enable it
+# on a process-local backend.
+#
+# Posts and users also keep their version in a column of their row (VERSIONED_MODELS),
+# written by the same bump() in the transaction of the write. Without the cache, versions()
+# reads them from there, so conditional GET works on any deployment.
+
+# Kinds of cached objects, each with its own versions
+POST = 'post'  # A post, by primary key
+USER = 'user'  # A user profile, by primary key
+POST_LIST = 'post_list'  # Pages of the post list, under the single ALL version
+ALL = 'all'
+
+# Kinds whose versions are also stored in the rows, in a "version" column
+VERSIONED_MODELS = {POST: 'posts.Post', USER: settings.AUTH_USER_MODEL}
+MISSING_VERSION = '0' * 16  # Stored version of a row that does not exist
+
+# Lookup results
+HIT = 'hit'
+MISS = 'miss'  # Computed by this request
+COALESCED = 'coalesced'  # Computed by a concurrent request and waited for
+
+KEY_PREFIX = 'response'
+_missing = object()
+
+# Backends that keep their data in the process, or nowhere
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return []
+    backend = settings.CACHES.get(settings.RESPONSE_CACHE_ALIAS, {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_BACKENDS:
+        return [checks.Error(
+            f"RESPONSE_CACHE_ENABLED needs a cache shared by all server processes, but the "
+            f"'{settings.RESPONSE_CACHE_ALIAS}' cache uses {backend}.",
+            hint="Point RESPONSE_CACHE_ALIAS at a Redis or Memcached cache, or set RESPONSE_CACHE_ENABLED = False.",
+            id='social_media_api.E001',
+        )]
+    return []
+
+
+def _version_key(kind, pk):
+    return f'{KEY_PREFIX}:version:{kind}:{pk}'
+
+
+GENERATION_KEY = _version_key('generation', ALL)
+
+
+def new_version():
+    """
+    A new version token: the nanosecond time in 16 hexadecimal digits, then random digits for uniqueness.
+    """
+    return f'{time.time_ns():016x}{os.urandom(4).hex()}'
+
+
+def changed_at(version):
+    """
+    Time (seconds since the epoch) a version returned by versions() was set: the time of
+    the last write, or a later time when the version had to be created again.
+    """
+    return max(int(token[:16], 16) for token in version.split('.')) / 1e9
+
+
+def _set_versions(keys):
+    cache = _cache()
+    cache.set_many({key: new_version() for key in keys}, timeout=None)
+
+
+def _bump_keys(keys):
+    if not keys:
+        return
+    _set_versions(keys)
+    if transaction.get_connection().in_atomic_block:
+        # Requests reading before the commit may cache the old rows under the new versions
+        transaction.on_commit(lambda: _set_versions(keys))
+    instrumentation.metrics.increment('response_cache_bumps_total', len(keys))
+
+
+def _stored_model(kind):
+    return apps.get_model(VERSIONED_MODELS[kind]) if kind in VERSIONED_MODELS else None
+
+
+def bump(kind, *pks, stored=False):
+    """
+    Invalidate the cached representations of objects of a kind, e.g. bump(POST, post.id),
+    and give their rows a new stored version, unless the caller's own UPDATE or save
+    already did (stored=True).
+    """
+    pks = list(dict.fromkeys(pks))
+    model = _stored_model(kind)
+    if model is not None and pks and not stored:
+        model.objects.filter(pk__in=pks).update(version=new_version())
+    _bump_keys([_version_key(kind, pk) for pk in pks])
+
+
+def bump_all():
+    """
+    Invalidate every cached representation, after writes too broad to track row by row.
+    Stored versions are left as they are: rows inserted in bulk get new ones by default.
+    """
+    _bump_keys([GENERATION_KEY])
+
+
+def versions(kind, pks, loaded=None):
+    """
+    Current version of every object, {pk: "generation.version"}; missing versions are created.
+    Without the cache, the versions stored in the rows of posts and users, taken from the
+    instances in loaded ({pk: instance}) when the response was built from them.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED and kind in VERSIONED_MODELS:
+        loaded = loaded or {}
+        stored = {pk: loaded[pk].version for pk in pks if pk in loaded}
+        missing = [pk for pk in pks if pk not in stored]
+        if missing:
+            stored.update(_stored_model(kind).objects.filter(pk__in=missing).values_list('pk', 'version'))
+        return {pk: stored.get(pk, MISSING_VERSION) for pk in pks}
+    cache = _cache()
+    keys = {pk: _version_key(kind, pk) for pk in pks}
+    found = cache.get_many([GENERATION_KEY, *keys.values()])
+    for key in [GENERATION_KEY, *keys.values()]:
+        if key not in found:
+            # add() keeps a version set concurrently by another request or a bump
+            cache.add(key, new_version(), timeout=None)
+            found[key] = cache.get(key)
+    return {pk: f'{found[GENERATION_KEY]}.{found[key]}' for pk, key in keys.items()}
+
+
+def _entry_key(kind, pk, variant, version):
+    # Variants may be full URLs: hash them to keep keys short and free of special characters
+    digest = hashlib.md5(str(variant).encode(), usedforsecurity=False).hexdigest()
+    return f'{KEY_PREFIX}:{kind}:{pk}:{digest}:{version}'
+
+
+def _record(kind, result, count=1):
+    instrumentation.metrics.increment('response_cache_lookups_total', count, kind=kind, result=result)
+    instrumentation.record_cache_lookup(result, count)
+
+
+def _single_flight(key, compute):
+    # Compute a missing entry, or wait for the concurrent request computing it. Returns (value, result).
+    cache = _cache()
+    lock_key = f'{key}:lock'
+    lock_timeout = settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    token = os.urandom(8).hex()  # Identifies this request's lock
+    owned = cache.add(lock_key, token, timeout=lock_timeout)
+    if not owned:
+        deadline = time.monotonic() + lock_timeout
+        delay = 0.005
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+            value = cache.get(key, _missing)
+            if value is not _missing:
+                return value, COALESCED
+            if not cache.has_key(lock_key):
+                break  # The computing request failed: compute it here
+        # Take the lock if it is free; otherwise compute without it, and leave it to its owner
+        owned = cache.add(lock_key, token, timeout=lock_timeout)
+    try:
+        value = compute()
+        cache.set(key, value, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    finally:
+        # The lock may have expired and been taken by another request since
+        if owned and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    return value, MISS
+
+
+def fetch(kind, pk, variant, compute):
+    """
+    The cached value of an object for a variant (e.g. the representation mode), or the
+    result of compute(), cached until the object's version is bumped. Exceptions raised
+    by compute() propagate and nothing is cached.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return compute()
+    key = _entry_key(kind, pk, variant, versions(kind, [pk])[pk])
+    value = _cache().get(key, _missing)
+    if value is not _missing:
+        _record(kind, HIT)
+        return value
+    value, result = _single_flight(key, compute)
+    _record(kind, result)
+    return value
+
+
+def fetch_many(kind, pks, variant, compute_many):
+    """
+    The cached values of several objects, {pk: value}. The missing ones are computed
+    together by compute_many(pks), which returns {pk: value} and may leave out objects
+    that no longer exist.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return compute_many(list(pks))
+    cache = _cache()
+    keys = {pk: _entry_key(kind, pk, variant, version) for pk, version in versions(kind, pks).items()}
+    found = cache.get_many(list(keys.values()))
+    values = {pk: found[key] for pk, key in keys.items() if key in found}
+    missing = [pk for pk in keys if pk not in values]
+    if values:
+        _record(kind, HIT, len(values))
+    if missing:
+        computed = compute_many(missing)
+        cache.set_many({keys[pk]: value for pk, value in computed.items()}, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+        values.update(computed)
+        _record(kind, MISS, len(missing))
+    return values
+
+
+def variant(request, *parts):
+    # Variant of a representation that contains absolute URLs, which depend on the host
+    return ':'.join([request.scheme, request.get_host(), *map(str, parts)])
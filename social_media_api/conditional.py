@@ -0,0 +1,68 @@
+import hashlib
+import time
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from . import caching
+
+# Conditional GET for API views: ETag and Last-Modified validators, and 304 Not Modified.
+#
+# The validators of a response are derived from its state: what it shows that differs
+# from one request to the next (the IDs on a page, the viewer's like states, the page
+# links) and the versions of the objects it was built from (see social_media_api.caching).
+# A request with If-None-Match or If-Modified-Since gets its state computed cheaply, e.g.
+# the post IDs of a page and their versions without their comments and likes, and is
+# answered with 304 when nothing changed, before anything is loaded in full or serialized.
+#
+# Full responses take their state from their own data. Since versions are read once the
+# data is loaded, a response whose objects were written while it was being built gets no
+# validators: its ETag could otherwise vouch for the data from before the write.
+#
+# Last-Modified is the time of the latest version, sent only where the versions cover
+# every change to the response and once it is at least a second old: HTTP dates have a
+# one second resolution, and a later write in the same second would go unnoticed.
+#
+# Versions come from the shared cache with RESPONSE_CACHE_ENABLED, and otherwise from the
+# version column of the post and user rows: validators work with or without the cache.
+
+
+class ConditionalGetMixin:
+    def initial(self, request, *args, **kwargs):
+        self.started_at = time.time()
+        super().initial(request, *args, **kwargs)
+
+    def is_conditional(self):
+        return 'HTTP_IF_NONE_MATCH' in self.request.META or 'HTTP_IF_MODIFIED_SINCE' in self.request.META
+
+    def validators(self, parts, versions, last_modified):
+        # (ETag, Last-Modified timestamp or None) of a response showing parts, built from versions
+        state = [self.request.build_absolute_uri(), self.request.accepted_renderer.media_type, parts, versions]
+        etag = '"%s"' % hashlib.md5(repr(state).encode(), usedforsecurity=False).hexdigest()
+        changed = max(map(caching.changed_at, versions), default=None) if last_modified else None
+        if changed is not None and int(changed) >= int(time.time()):
+            changed = None
+        return etag, None if changed is None else int(changed)
+
+    def conditional_get(self, current_state, respond, response_state, last_modified=True):
+        """
+        Answer a GET with 304 when the request's If-None-Match or If-Modified-Since matches
+        current_state(), else with respond(), adding the validators of response_state(response).
+        Both state functions return (parts, versions).
+        """
+        if self.is_conditional():
+            etag, modified = self.validators(*current_state(), last_modified)
+            response = get_conditional_response(self.request, etag=etag, last_modified=modified)
+            if response is not None:
+                return self.with_validators(response, etag, modified)
+
+        response = respond()
+        if response.status_code == 200:
+            parts, versions = response_state(response)
+            if all(caching.changed_at(version) <= self.started_at for version in versions):
+                self.with_validators(response, *self.validators(parts, versions, last_modified))
+        return response
+
+    def with_validators(self, response, etag, modified):
+        response['ETag'] = etag
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
+        return response
@@ -0,0 +1,315 @@
+import contextvars
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Request instrumentation, enabled with INSTRUMENTATION_ENABLED.
+#
+# InstrumentationMiddleware measures every request: the number of SQL queries and the time
+# spent in the database (through a database execute wrapper), in serializers (the outermost
+# .data of a serializer with TimedSerializerMixin), in the view and rendering the response. The figures are
+# sent back in a Server-Timing header, which browser developer tools display, and added
+# to per-route histograms served in the Prometheus text format by metrics_view. Requests
+# running more queries than their route's budget (QUERY_BUDGET, QUERY_BUDGETS) are logged.
+# Other modules add to the counters listed in Metrics.COUNTERS, e.g. the response cache.
+#
+# The cost is a few clock readings per query and one lock per request. Metrics are kept
+# per process: scrape every worker, or run a single one per metrics port.
+
+# Histogram bucket upper bounds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)  # Queries per request
+
+
+# Measurements of the request being handled
+class RequestStats:
+    __slots__ = ('queries', 'db', 'serialize', 'serializing', 'render', 'view_started', 'view_finished', 'cache')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False  # Inside an outer Serializer.data, whose time already counts nested ones
+        self.render = 0.0
+        self.view_started = None
+        self.view_finished = None
+        self.cache = {}  # Response cache lookups per result, see social_media_api.caching
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    # Database execute wrapper: times the queries of instrumented requests
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db += time.perf_counter() - started
+
+
+def record_cache_lookup(result, count=1):
+    # Count response cache lookups of the request being handled, for the Server-Timing header
+    stats = _current.get()
+    if stats is not None:
+        stats.cache[result] = stats.cache.get(result, 0) + count
+
+
+def install_query_recorder(connection, **kwargs):
+    # Connections live per thread; wrap each once, when it is opened or first seen
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _timed_serialization(serialize):
+    # Run serialize() and count its time as the request's serializer time, once for nested calls
+    stats = _current.get()
+    if stats is None or stats.serializing:
+        return serialize()
+    stats.serializing = True
+    started = time.perf_counter()
+    try:
+        return serialize()
+    finally:
+        stats.serialize += time.perf_counter() - started
+        stats.serializing = False
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        return _timed_serialization(lambda: super(TimedListSerializer, self).data)
+
+
+# Serializers whose output counts as serializer time: declared on the serializers of the API's
+# responses, and used for lists of them unless their Meta names a list_serializer_class
+class TimedSerializerMixin:
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, 'Meta', None)
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        return _timed_serialization(lambda: super(TimedSerializerMixin, self).data)
+
+
+# Cumulative histogram in the Prometheus sense: observations counted per upper bound
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+# Per-route metrics of this process
+class Metrics:
+    HISTOGRAMS = [
+        ('http_request_duration_seconds', "Time spent handling requests.", DURATION_BUCKETS),
+        ('http_request_db_seconds', "Time spent in SQL queries per request.", DURATION_BUCKETS),
+        ('http_request_serialize_seconds', "Time spent in serializers per request.", DURATION_BUCKETS),
+        ('http_request_queries', "SQL queries per request.", QUERY_BUCKETS),
+    ]
+    COUNTERS = {
+        'response_cache_lookups_total': "Response cache lookups, per kind of object and result (hit, miss or coalesced).",
+        'response_cache_bumps_total': "Response cache versions bumped by writes.",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (route, method) -> {metric name: Histogram}
+        self._responses = {}  # (route, method, status) -> count
+        self._over_budget = {}  # (route, method) -> count
+        self._counters = {}  # (counter name, labels) -> count, see COUNTERS
+
+    def observe(self, route, method, status, duration, stats, over_budget):
+        key = (route, method)
+        values = (duration, stats.db, stats.serialize, stats.queries)
+        with self._lock:
+            histograms = self._histograms.get(key)
+            if histograms is None:
+                histograms = self._histograms[key] = {name: Histogram(buckets) for name, _, buckets in self.HISTOGRAMS}
+            for (name, _, _), value in zip(self.HISTOGRAMS, values):
+                histograms[name].observe(value)
+            self._responses[key + (status,)] = self._responses.get(key + (status,), 0) + 1
+            if over_budget:
+                self._over_budget[key] = self._over_budget.get(key, 0) + 1
+
+    def increment(self, name, amount=1, **labels):
+        # Add to one of the COUNTERS
+        key = (name, _labels(**labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, description, _ in self.HISTOGRAMS:
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+                for (route, method), histograms in sorted(self._histograms.items()):
+                    lines.extend(histograms[name].samples(name, _labels(route=route, method=method)))
+            lines += ['# HELP http_responses_total Responses sent, per status code.', '# TYPE http_responses_total counter']
+            for (route, method, status), count in sorted(self._responses.items()):
+                lines.append(f'http_responses_total{{{_labels(route=route, method=method, status=status)}}} {count}')
+            lines += ['# HELP http_query_budget_exceeded_total Requests over their query budget.', '# TYPE http_query_budget_exceeded_total counter']
+            for (route, method), count in sorted(self._over_budget.items()):
+                lines.append(f'http_query_budget_exceeded_total{{{_labels(route=route, method=method)}}} {count}')
+            for name, description in self.COUNTERS.items():
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+                for (counter, labels), count in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'{name}{{{labels}}} {count}' if labels else f'{name} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+metrics = Metrics()
+
+
+def route_name(request):
+    # URL name of the matched pattern (or the pattern itself), never the raw path, to keep label values few
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+def query_budget(route):
+    return settings.QUERY_BUDGETS.get(route, settings.QUERY_BUDGET)
+
+
+def server_timing(stats, duration):
+    entries = [
+        f'db;dur={stats.db * 1000:.2f};desc="{stats.queries} queries"',
+        f'serialize;dur={stats.serialize * 1000:.2f}',
+    ]
+    if stats.view_started is not None:
+        entries.append(f'view;dur={(stats.view_finished - stats.view_started) * 1000:.2f}')
+    entries += [f'render;dur={stats.render * 1000:.2f}', f'total;dur={duration * 1000:.2f}']
+    if stats.cache:
+        lookups = ', '.join(f'{result} {count}' for result, count in sorted(stats.cache.items()))
+        entries.append(f'cache;desc="{lookups}"')
+    return ', '.join(entries)
+
+
+# Records the queries and timings of every request, see the module comment
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(install_query_recorder, dispatch_uid='instrumentation_query_recorder')
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        stats, started = RequestStats(), time.perf_counter()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        # Queries run in sync_to_async threads, whose connections are wrapped when opened
+        stats, started = RequestStats(), time.perf_counter()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = _current.get()
+        if stats is not None:
+            stats.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook: the view is done, time the rendering
+        stats = _current.get()
+        if stats is not None:
+            stats.view_finished = time.perf_counter()
+
+            def rendered(response):
+                stats.render = time.perf_counter() - stats.view_finished
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, stats, started):
+        duration = time.perf_counter() - started
+        if stats.view_started is not None and stats.view_finished is None:
+            stats.view_finished = time.perf_counter()
+
+        route = route_name(request)
+        budget = query_budget(route)
+        over_budget = budget is not None and stats.queries > budget
+        if over_budget:
+            logger.warning(
+                "%s %s (%s) ran %d queries, over its budget of %d (%.1f ms in the database)",
+                request.method, request.path, route, stats.queries, budget, stats.db * 1000,
+            )
+        metrics.observe(route, request.method, response.status_code, duration, stats, over_budget)
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(stats, duration)
+        return response
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics of this process. Requires "Authorization: Bearer <METRICS_TOKEN>",
+    or is only served with DEBUG on when no token is set.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
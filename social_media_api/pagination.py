@@ -0,0 +1,192 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Model, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# Keyset (cursor) pagination shared by the list endpoints.
+#
+# The page position is the ordering values of the last row a client has seen, so
+# fetching any page is a single indexed range query: no COUNT(*) and no OFFSET,
+# and the cost stays flat however deep a client scrolls. The ordering is read
+# from the queryset after the filter backends ran, so OrderingFilter and each
+# view's ordering_fields keep working; the primary key is always appended as a
+# tie-breaker. Ordering fields must be non-nullable. Cursors come from clients: their
+# values are parsed with the ordering fields before they reach the query, and a cursor
+# that does not parse is answered with 404 like any other invalid cursor.
+class KeysetPagination(BasePagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.fields = [self.get_field(queryset, name) for name, _ in self.ordering]
+
+        cursor = self.decode_cursor(request)
+        values, reverse = cursor if cursor is not None else (None, False)
+        results = self.fetch(queryset, values, reverse, self.page_size + 1)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        return results
+
+    def fetch(self, queryset, values, reverse, limit):
+        # Up to limit rows after the cursor values (from the start without a cursor), in the order they are read
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values, reverse))
+        return list(queryset.order_by(*self.order_by(reverse))[:limit])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        # Ordering as a list of (field, descending) pairs, ending with the primary key
+        ordering = []
+        for field in queryset.query.order_by or queryset.model._meta.ordering:
+            if not isinstance(field, str):
+                raise TypeError("KeysetPagination only supports ordering by field names.")
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            ordering.append(('pk' if name == 'id' else name, descending))
+        if not any(name == 'pk' for name, _ in ordering):
+            ordering.append(('pk', ordering[-1][1] if ordering else False))
+        return ordering
+
+    def get_field(self, queryset, name):
+        # Field holding the values of an ordering name, or None for an annotation without an output field
+        if name in queryset.query.annotations:
+            return getattr(queryset.query.annotations[name], '_output_field_or_none', None)
+        model, field = queryset.model, None
+        for part in name.split('__'):
+            if model is None:
+                raise TypeError(f"KeysetPagination cannot order by {name}.")
+            try:
+                field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+            except FieldDoesNotExist:
+                raise TypeError(f"KeysetPagination cannot order by {name}.")
+            model = field.related_model
+        # Relations are ordered by the value of the key they point to
+        return field.target_field if field.is_relation else field
+
+    def parse_value(self, field, value):
+        # Cursor value as the field's Python value; raises ValidationError when it does not parse
+        if value is None or isinstance(value, (dict, list)):
+            raise ValidationError("Cursor values must be scalars.")
+        if field is None:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValidationError("Expected a number.")
+            return value
+        value = field.to_python(value)
+        field.run_validators(value)
+        return value
+
+    def order_by(self, reverse):
+        return [('-' if descending != reverse else '') + name for name, descending in self.ordering]
+
+    def keyset_filter(self, values, reverse):
+        # Rows strictly after the cursor: (a > x) OR (a = x AND b > y) OR ...
+        condition = Q()
+        for index, (name, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            branch = Q(**{f'{name}__{lookup}': values[index]})
+            for previous, (previous_name, _) in enumerate(self.ordering[:index]):
+                branch &= Q(**{previous_name: values[previous]})
+            condition |= branch
+        return condition
+
+    def get_values(self, obj):
+        values = []
+        for name, _ in self.ordering:
+            value = obj
+            for attr in name.split('__'):
+                value = getattr(value, attr)
+            values.append(value.pk if isinstance(value, Model) else value)
+        return values
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values, reverse, ordering = data['v'], data['r'], data['o']
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor is only valid for the ordering it was issued with
+        if (ordering != self.order_by(False) or not isinstance(reverse, bool)
+                or not isinstance(values, list) or len(values) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            values = [self.parse_value(field, value) for field, value in zip(self.fields, values)]
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_value(self, value):
+        # Full precision, so rows created within the same millisecond are never skipped
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        return str(value)
+
+    def encode_cursor(self, obj, reverse):
+        data = {'v': self.get_values(obj), 'r': reverse, 'o': self.order_by(False)}
+        encoded = base64.urlsafe_b64encode(json.dumps(data, default=self.encode_value).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
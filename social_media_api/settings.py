@@ -43,12 +43,16 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'posts.apps.PostsConfig',
     'notifications.apps.NotificationsConfig',
+    'uploads.apps.UploadsConfig',
+    'transfer.apps.TransferConfig',
+    'benchmarks.apps.BenchmarksConfig',
     'django_filters',
     'rest_framework_simplejwt',
     'drf_yasg',
 ]
 
 MIDDLEWARE = [
+    'social_media_api.instrumentation.InstrumentationMiddleware',  # First, so it times the whole request
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +95,20 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/ref/settings/#caches
+# Local memory is per process. The response cache (RESPONSE_CACHE_ENABLED) needs a cache
+# shared by all server processes, such as 'django.core.cache.backends.redis.RedisCache'
+# or 'django.core.cache.backends.memcached.PyMemcacheCache' with a LOCATION.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -163,4 +181,80 @@ SWAGGER_SETTINGS = {
             'in': 'header'
       }
    }
-}
\ No newline at end of file
+}
+# Feed timelines
+# Authors with at least this many followers are not fanned out on write; their posts are pulled into feeds at read time
+TIMELINE_FANOUT_THRESHOLD = 5000
+# Number of an author's latest posts copied into a follower's timeline on follow or rebuild
+TIMELINE_BACKFILL_LIMIT = 200
+# Number of latest comments embedded in each post when posts are listed with ?mode=summary
+POST_SUMMARY_COMMENTS = 3
+
+# Write-behind like buffer (see posts.like_buffer)
+LIKE_BUFFER_ENABLED = False  # Accept likes into the buffer and write them in batches
+LIKE_BUFFER = 'posts.like_buffer.InProcessLikeBuffer'  # Buffer class
+LIKE_BUFFER_FLUSH_INTERVAL = 0.25  # Seconds between flushes
+LIKE_BUFFER_MAX_PENDING = 5000  # Buffered like states that trigger an early flush
+LIKE_BUFFER_MAX_ATTEMPTS = 5  # Flushes failing with a transient error after which a like state is dropped
+
+# Notification dispatch (see notifications.dispatch)
+NOTIFICATIONS_BATCH_SIZE = 500  # Outbox events turned into notifications per batch
+NOTIFICATIONS_MAX_ATTEMPTS = 5  # Attempts before an event is marked as failed
+NOTIFICATIONS_RETRY_DELAY = 5  # Seconds before the first retry, doubled on every further attempt
+NOTIFICATIONS_LEASE = 60  # Seconds a worker owns a claimed batch before another worker may reclaim it
+
+# Notification stream (see notifications.streams)
+NOTIFICATIONS_BROKER = 'notifications.streams.DatabaseBroker'  # Pub/sub that wakes streams when notifications are delivered
+NOTIFICATIONS_BROKER_POLL = 1.0  # Seconds between the DatabaseBroker's checks for notifications delivered by the worker
+NOTIFICATIONS_STREAM_HEARTBEAT = 15  # Seconds between keep-alive comments on an idle stream
+NOTIFICATIONS_STREAM_POLL = 30  # Seconds between a stream's own database checks, in case a wake-up is missed
+NOTIFICATIONS_STREAM_BATCH = 100  # Notifications read from the database per query when catching up
+NOTIFICATIONS_STREAM_RETRY_MS = 3000  # Reconnection delay suggested to clients
+NOTIFICATIONS_AGGREGATE = True  # Coalesce events with the same recipient, verb and target into one notification
+NOTIFICATIONS_AGGREGATION_WINDOW = 24 * 60 * 60  # Seconds during which new events join an existing notification
+NOTIFICATIONS_RECENT_ACTORS = 3  # Most recent actors kept on a coalesced notification
+
+# Follow suggestions (see users.suggestions)
+SUGGESTIONS_PER_USER = 50  # Suggestions stored per user
+SUGGESTIONS_ACTIVITY_DAYS = 14  # Window in which a suggested user's posts count as recent activity
+SUGGESTIONS_ACTIVITY_WEIGHT = 0.5  # Score boost per log-scaled recent post
+
+# Comment threads (see posts.threads)
+COMMENT_MAX_DEPTH = 32  # Deepest reply level accepted; paths are 10 characters per level
+COMMENT_PREVIEW_REPLIES = 3  # Replies embedded under each top-level comment in a post's comment list
+
+# Image pipeline (see uploads.images)
+IMAGE_WORKERS = 2  # Threads resizing uploaded images
+IMAGE_PROCESS_ASYNC = True  # Process images in the worker pool; False processes them in the request
+IMAGE_PROCESS_LEASE = 5 * 60  # Seconds a worker owns an asset it is processing before process_images may take it over
+IMAGE_ORIGINAL_QUALITY = 90  # Quality of originals re-encoded to strip their metadata
+IMAGE_VARIANTS = {  # Name: (longest side in pixels, format, quality)
+    'thumbnail': (320, 'WEBP', 80),
+    'medium': (1080, 'WEBP', 82),
+}
+
+# Resumable chunked uploads (see uploads.chunked)
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'chunked_uploads')  # Partial uploads, outside MEDIA_ROOT
+CHUNKED_UPLOAD_MAX_SIZE = 50 * 1024 * 1024  # Largest file accepted
+CHUNKED_UPLOAD_MAX_CHUNK = 8 * 1024 * 1024  # Largest chunk accepted per request
+CHUNKED_UPLOAD_MAX_ACTIVE = 10  # Unfinished uploads per user
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60  # Seconds an upload survives without receiving a chunk
+
+# Background account deletion (see users.deletion)
+ACCOUNT_DELETION_BATCH_SIZE = 500  # Rows deleted per transaction
+ACCOUNT_DELETION_LEASE = 60  # Seconds a worker owns a job without checkpointing before another worker may take it over
+ACCOUNT_DELETION_MAX_ATTEMPTS = 5  # Attempts before a job is marked as failed
+ACCOUNT_DELETION_RETRY_DELAY = 30  # Seconds before the first retry, doubled on every further attempt
+
+# Request instrumentation (see social_media_api.instrumentation)
+INSTRUMENTATION_ENABLED = True  # Count queries and time requests, per route
+INSTRUMENTATION_SERVER_TIMING = True  # Send the timings in a Server-Timing header
+QUERY_BUDGET = 30  # Queries per request above which a warning is logged (None for no limit)
+QUERY_BUDGETS = {}  # Budgets of particular routes by URL name, e.g. {'post_feed': 10}
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Bearer token required by /metrics/; without one it is served only with DEBUG
+
+# Response cache of post and profile representations (see social_media_api.caching)
+RESPONSE_CACHE_ENABLED = False  # Serve posts, post list pages and profiles from the cache, and validate them with ETags; needs a cache shared by all server processes
+RESPONSE_CACHE_ALIAS = 'default'  # Cache of CACHES used
+RESPONSE_CACHE_TIMEOUT = 60 * 60  # Seconds an entry is kept; writes invalidate entries before that
+RESPONSE_CACHE_LOCK_TIMEOUT = 5  # Seconds concurrent requests wait for the one rebuilding a missing entry
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# Query-count regression tests.
+#
+# QueryCountTestCase sends requests the way clients do, with a JWT access token, so the
+# query loading the authenticated user is counted like every other. assertMaxQueries()
+# bounds the queries of one request; assertConstantQueries() requests a list endpoint with
+# page sizes 1 and 50 and holds both to the same bound, so a serializer that starts
+# querying per row fails the test as soon as the page grows. The response cache (see
+# social_media_api.caching) is emptied before each test, so first requests are counted uncached.
+
+PAGE_SIZES = (1, 50)  # Page sizes every list endpoint is requested with
+
+
+class QueryCountTestCase(APITestCase):
+    def setUp(self):
+        # Cached entries outlive the rolled back test data
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+
+    def authenticate(self, user):
+        # Authenticate the following requests with a JWT access token, as clients do
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def assertMaxQueries(self, limit, method, url, data=None, status=200, **kwargs):
+        """
+        Send a request and check its status and that it ran at most `limit` queries.
+        Returns the response.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, **kwargs)
+        self.assertEqual(response.status_code, status, getattr(response, 'data', response))
+        self.assertLessEqual(
+            len(queries), limit,
+            f"{method.upper()} {url} ran {len(queries)} queries, more than {limit}:\n"
+            + '\n'.join(query['sql'] for query in queries.captured_queries),
+        )
+        return response
+
+    def assertConstantQueries(self, limit, url, params=None, results=lambda data: data['results']):
+        """
+        Request a list endpoint with every page size in PAGE_SIZES, check that each page is
+        full and that no page size runs more than `limit` queries.
+        """
+        for page_size in PAGE_SIZES:
+            with self.subTest(url=url, page_size=page_size):
+                response = self.assertMaxQueries(limit, 'get', url, {**(params or {}), 'page_size': page_size})
+                self.assertEqual(len(results(response.data)), page_size)
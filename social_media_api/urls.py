@@ -20,6 +20,7 @@ from django.urls import re_path
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from .instrumentation import metrics_view
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -37,6 +38,9 @@ urlpatterns = [
     path('user/', include("users.urls")),
     path('posts/', include("posts.urls")),
     path('notifications/', include("notifications.urls")),
+    path('uploads/', include("uploads.urls")),
+    path('transfer/', include("transfer.urls")),
+    path('metrics/', metrics_view, name='metrics'),  # Prometheus metrics, see social_media_api.instrumentation
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
@@ -0,0 +1,272 @@
+import datetime
+import json
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from notifications.models import Notification, NotificationActor
+from posts import threads
+from posts.models import Post, Comment, Like
+from social_media_api import caching
+
+User = get_user_model()  # Custom user model
+Follow = User.followers.through  # from_customuser is the followed user, to_customuser the follower
+
+# Bulk import and export of users, follows, posts, comments, likes, notifications and their
+# actors as JSON Lines: one record per line, {"type": "post", "id": 1, "author_id": 3, ...}, with
+# the model's column names as keys.
+#
+# export_lines() yields the records of each table in primary key order through
+# iterator(chunk_size=...), so memory stays flat whatever the number of rows; rows
+# written while an export runs may or may not be included. import_lines() reads records
+# one line at a time and inserts consecutive records of the same type in batches, one
+# transaction per batch. Records keep their IDs, so references between them survive,
+# and must come after the records they reference, as they do in an export.
+#
+# Password hashes and email addresses are only exported on request (credentials=True).
+# Users imported without them get an unusable password and a placeholder address,
+# <username>@users.invalid, since emails are unique and required.
+#
+# Derived data is not transferred: image variants (run process_images --backfill),
+# timelines (rebuild_timeline --all) and follow suggestions (compute_suggestions).
+# Counters are kept as exported; run reconcile_counters after importing hand-written files.
+
+# Record types in dependency order, with the columns left out and renamed in records.
+# Imported rows get new versions (see social_media_api.caching).
+KINDS = {
+    'user': {'model': User, 'exclude': {'avatar_id', 'version'}, 'rename': {}},
+    'follow': {'model': Follow, 'exclude': set(), 'rename': {'from_customuser_id': 'followed_id', 'to_customuser_id': 'follower_id'}},
+    'post': {'model': Post, 'exclude': {'image_id', 'version'}, 'rename': {}},
+    'comment': {'model': Comment, 'exclude': set(), 'rename': {}},
+    'like': {'model': Like, 'exclude': set(), 'rename': {}},
+    'notification': {'model': Notification, 'exclude': set(), 'rename': {'target_content_type_id': 'target_type'}},
+    'notification_actor': {'model': NotificationActor, 'exclude': set(), 'rename': {}},
+}
+
+# Columns exported only with credentials=True
+CREDENTIALS = {'user': {'password', 'email'}}
+PLACEHOLDER_EMAIL_DOMAIN = 'users.invalid'  # Reserved top-level domain: never delivered
+
+
+class RecordEncoder(DjangoJSONEncoder):
+    # Keep the microseconds that DjangoJSONEncoder rounds to milliseconds, so timestamps survive a round trip
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class RecordError(ValueError):
+    """A record that cannot be imported; the message names its line."""
+
+
+def columns(kind):
+    # Column attnames of a record type, in model order
+    spec = KINDS[kind]
+    return [field.attname for field in spec['model']._meta.concrete_fields if field.attname not in spec['exclude']]
+
+
+def parse_kinds(value):
+    # ["user", "post"] from "post,user", in dependency order, or None for every type
+    if not value:
+        return None
+    kinds = {kind.strip() for kind in value.split(',') if kind.strip()}
+    unknown = kinds - KINDS.keys()
+    if unknown:
+        raise ValueError(f"Unknown types: {', '.join(sorted(unknown))}.")
+    return [kind for kind in KINDS if kind in kinds]
+
+
+def _content_type_label(content_type_id):
+    content_type = ContentType.objects.get_for_id(content_type_id)
+    return f'{content_type.app_label}.{content_type.model}'
+
+
+def _content_type_id(label):
+    app_label, _, model = (label or '').partition('.')
+    try:
+        return ContentType.objects.get_by_natural_key(app_label, model).id
+    except ContentType.DoesNotExist:
+        raise RecordError(f"unknown target_type {label!r}")
+
+
+def export_lines(kinds=None, chunk_size=2000, credentials=False):
+    """
+    Yield every record of the given types (all by default) as JSON lines, with the
+    users' password hashes and emails only when credentials is true.
+    """
+    for kind in kinds or KINDS:
+        spec = KINDS[kind]
+        exported = [column for column in columns(kind) if credentials or column not in CREDENTIALS.get(kind, ())]
+        rows = spec['model'].objects.order_by('pk').values(*exported).iterator(chunk_size=chunk_size)
+        for row in rows:
+            record = {'type': kind}
+            for column, value in row.items():
+                if column == 'target_content_type_id':
+                    value = _content_type_label(value)  # Content type IDs differ between databases
+                record[spec['rename'].get(column, column)] = value
+            yield json.dumps(record, cls=RecordEncoder) + '\n'
+
+
+def _build(kind, number, record):
+    # Model instance from a record, without validation beyond the column names
+    spec = KINDS[kind]
+    fields = {}
+    renamed = {new: old for old, new in spec['rename'].items()}
+    known = set(columns(kind))
+    for key, value in record.items():
+        column = renamed.get(key, key)
+        if column not in known:
+            raise RecordError(f"Line {number}: unknown field {key!r} for type {kind!r}.")
+        if column == 'target_content_type_id':
+            try:
+                value = _content_type_id(value)
+            except RecordError as error:
+                raise RecordError(f"Line {number}: {error}.")
+        fields[column] = value
+    instance = spec['model'](**fields)
+
+    # Records written by hand may leave out the timestamps
+    for field in spec['model']._meta.concrete_fields:
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            if getattr(instance, field.attname) is None:
+                setattr(instance, field.attname, timezone.now())
+    return instance
+
+
+def _fill_comment_paths(comments):
+    # Thread paths for comments imported without them (see posts.threads); a reply's
+    # parent comes earlier in the file, in this batch or an earlier one
+    missing = [comment for comment in comments if not comment.path]
+    if not missing:
+        return
+    known = {comment.pk: (comment.path, comment.depth) for comment in comments if comment.path}
+    parent_ids = {comment.parent_id for comment in missing if comment.parent_id is not None} - known.keys()
+    known.update((pk, (path, depth)) for pk, path, depth in Comment.objects.filter(pk__in=parent_ids).values_list('pk', 'path', 'depth'))
+    for comment in missing:
+        if comment.pk is None:
+            raise RecordError("Comments without a path need an id.")
+        if comment.parent_id is None:
+            comment.path, comment.depth = threads.encode(comment.pk), 0
+        elif comment.parent_id in known:
+            parent_path, parent_depth = known[comment.parent_id]
+            comment.path, comment.depth = parent_path + threads.encode(comment.pk), parent_depth + 1
+        else:
+            raise RecordError(f"Comment {comment.pk} replies to unknown comment {comment.parent_id}.")
+        known[comment.pk] = (comment.path, comment.depth)
+
+
+def _insert(model, instances):
+    # One INSERT per row through executemany(), like benchmarks.synthetic.BatchWriter:
+    # bulk_create would stamp auto_now and auto_now_add columns with the current time,
+    # while the values are written here as _build() left them, those of the file.
+    # Rows without an id get one from the database.
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    with_pk = [obj for obj in instances if obj.pk is not None]
+    without_pk = [obj for obj in instances if obj.pk is None]
+    for group, group_fields in (
+        (with_pk, fields),
+        (without_pk, [field for field in fields if field is not model._meta.auto_field]),
+    ):
+        if not group:
+            continue
+        sql = (
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(field.column) for field in group_fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(group_fields))})"
+        )
+        rows = [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in group_fields] for obj in group]
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+def _setup_worker():
+    # Hashing processes started with "spawn" import Django afresh
+    import django
+    django.setup()
+
+
+def _hash_passwords(users, passwords, pool):
+    # Set the hashes of the given plain passwords, computed in the process pool when there is one
+    hashed = pool.map(make_password, passwords, chunksize=16) if pool else map(make_password, passwords)
+    for user, password in zip(users, hashed):
+        user.password = password
+
+
+def _write_batch(kind, batch, pool):
+    instances = []
+    to_hash, passwords = [], []
+    for number, record in batch:
+        raw_password = record.pop('raw_password', None) if kind == 'user' else None
+        instance = _build(kind, number, record)
+        if raw_password is not None:
+            to_hash.append(instance)
+            passwords.append(raw_password)
+        elif kind == 'user' and 'password' not in record:
+            instance.set_unusable_password()
+        if kind == 'user' and 'email' not in record:
+            instance.email = f'{instance.username}@{PLACEHOLDER_EMAIL_DOMAIN}'
+        instances.append(instance)
+    _hash_passwords(to_hash, passwords, pool)
+
+    first, last = batch[0][0], batch[-1][0]
+    try:
+        with transaction.atomic():
+            if kind == 'comment':
+                _fill_comment_paths(instances)
+            _insert(KINDS[kind]['model'], instances)
+    except RecordError as error:
+        raise RecordError(f"Lines {first}-{last}: {error}")
+    except (DatabaseError, ValidationError, ValueError, TypeError) as error:
+        raise RecordError(f"Lines {first}-{last} ({kind}): {error}")
+
+
+def import_lines(lines, batch_size=1000, hash_workers=0):
+    """
+    Import JSON lines (str or bytes). Returns the number of records imported per type.
+    Raises RecordError on the first bad line or batch; earlier batches stay imported.
+    """
+    imported = {kind: 0 for kind in KINDS}
+    pool = ProcessPoolExecutor(max_workers=hash_workers, initializer=_setup_worker) if hash_workers else None
+    batch, batch_kind = [], None
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                raise RecordError(f"Line {number}: invalid JSON ({error}).")
+            kind = record.pop('type', None) if isinstance(record, dict) else None
+            if kind not in KINDS:
+                raise RecordError(f"Line {number}: unknown or missing type {kind!r}.")
+            if batch and (kind != batch_kind or len(batch) >= batch_size):
+                _write_batch(batch_kind, batch, pool)
+                imported[batch_kind] += len(batch)
+                batch = []
+            batch_kind = kind
+            batch.append((number, record))
+        if batch:
+            _write_batch(batch_kind, batch, pool)
+            imported[batch_kind] += len(batch)
+    finally:
+        if pool:
+            pool.shutdown()
+        _reset_sequences([KINDS[kind]['model'] for kind, count in imported.items() if count])
+        if any(imported.values()):
+            caching.bump_all()  # Rows are inserted without signals
+    return imported
+
+
+def _reset_sequences(models):
+    # Databases with sequences (e.g. PostgreSQL) would otherwise hand out the imported IDs again
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
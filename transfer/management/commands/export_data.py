@@ -0,0 +1,30 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from transfer import jsonl
+
+
+class Command(BaseCommand):
+    help = "Stream users, follows, posts, comments, likes and notifications as JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="File to write (standard output by default).")
+        parser.add_argument('--types', help=f"Comma-separated record types, among {', '.join(jsonl.KINDS)} (all by default).")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched from the database at a time.")
+        parser.add_argument('--include-credentials', action='store_true', help="Include the users' password hashes and emails.")
+
+    def handle(self, *args, **options):
+        try:
+            kinds = jsonl.parse_kinds(options['types'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            written = 0
+            for line in jsonl.export_lines(kinds, chunk_size=options['chunk_size'], credentials=options['include_credentials']):
+                output.write(line)
+                written += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f"{written} records exported."))
+
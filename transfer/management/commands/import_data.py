@@ -0,0 +1,30 @@
+import sys
+import time
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from transfer import jsonl
+
+
+class Command(BaseCommand):
+    help = "Import users, follows, posts, comments, likes and notifications from JSON Lines, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="File to read (standard input by default).")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Records inserted per transaction.")
+        parser.add_argument('--hash-workers', type=int, default=0, help="Processes hashing the raw_password of user records (0 hashes in this process).")
+        parser.add_argument('--atomic', action='store_true', help="Import everything in a single transaction, or nothing on error.")
+
+    def handle(self, *args, **options):
+        source = open(options['path'], encoding='utf-8') if options['path'] else sys.stdin
+        started = time.monotonic()
+        try:
+            with transaction.atomic() if options['atomic'] else nullcontext():
+                imported = jsonl.import_lines(source, batch_size=options['batch_size'], hash_workers=options['hash_workers'])
+        except jsonl.RecordError as error:
+            raise CommandError(str(error))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        counts = ', '.join(f"{count} {kind}s" for kind, count in imported.items() if count) or "nothing"
+        self.stdout.write(self.style.SUCCESS(f"Imported {counts} in {time.monotonic() - started:.2f}s."))
@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import ExportView, ImportView
+
+urlpatterns = [
+    path('export/', ExportView.as_view(), name='data-export'),  # GET a JSON Lines export (admin only)
+    path('import/', ImportView.as_view(), name='data-import'),  # POST a JSON Lines file (admin only)
+]
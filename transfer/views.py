@@ -0,0 +1,48 @@
+from django.http import StreamingHttpResponse
+from rest_framework import status, views
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from . import jsonl
+
+
+# Stream a JSON Lines export of the database (admin only)
+class ExportView(views.APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Export data as JSON Lines",
+        operation_description="Stream users, follows, posts, comments, likes and notifications, one JSON record per line. Admin only.",
+        manual_parameters=[
+            openapi.Parameter('types', openapi.IN_QUERY, description="Comma-separated record types (all by default)", type=openapi.TYPE_STRING),
+            openapi.Parameter('include_credentials', openapi.IN_QUERY, description="Include the users' password hashes and emails (true or false, default false)", type=openapi.TYPE_BOOLEAN),
+        ],
+    )
+    def get(self, request):
+        try:
+            kinds = jsonl.parse_kinds(request.query_params.get('types'))
+        except ValueError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        credentials = request.query_params.get('include_credentials', '').lower() in ('true', '1')
+        response = StreamingHttpResponse(jsonl.export_lines(kinds, credentials=credentials), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="export.jsonl"'
+        return response
+
+
+# Import a JSON Lines file sent as the request body (admin only)
+class ImportView(views.APIView):
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Import data from JSON Lines",
+        operation_description="Send records in the export format as the raw request body (application/x-ndjson). They are inserted in batches as the body is read; on error, the batches before the bad line stay imported. Admin only.",
+    )
+    def post(self, request):
+        # Read the body line by line instead of parsing it as a whole
+        lines = iter(request.stream) if request.stream is not None else iter(())
+        try:
+            imported = jsonl.import_lines(lines)
+        except jsonl.RecordError as error:
+            return Response({'detail': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'imported': imported}, status=status.HTTP_201_CREATED)
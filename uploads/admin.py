@@ -0,0 +1,25 @@
+from django.contrib import admin
+from .models import ImageAsset, ChunkedUpload
+
+# Define the admin interface for the ImageAsset model
+class ImageAssetAdmin(admin.ModelAdmin):
+    # Specify the fields to display in the list view of images
+    list_display = ('sha256', 'width', 'height', 'size', 'status', 'created_at', 'processed_at')
+    # Add filters for the processing status
+    list_filter = ('status',)
+    # Enable search by hash
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'original', 'width', 'height', 'size', 'variants', 'status', 'error', 'created_at', 'processed_at')
+
+# Register the model with its admin configuration
+admin.site.register(ImageAsset, ImageAssetAdmin)
+
+# Define the admin interface for the ChunkedUpload model
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    # Specify the fields to display in the list view of uploads
+    list_display = ('id', 'user', 'filename', 'offset', 'size', 'status', 'created_at', 'expires_at')
+    list_filter = ('status',)
+    search_fields = ('filename', 'user__username')
+    readonly_fields = ('id', 'user', 'filename', 'size', 'offset', 'sha256', 'status', 'asset', 'created_at', 'expires_at')
+
+admin.site.register(ChunkedUpload, ChunkedUploadAdmin)
@@ -0,0 +1,189 @@
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File, locks
+from django.utils import timezone
+from PIL import Image
+from . import images
+from .models import ChunkedUpload
+
+# Resumable uploads.
+#
+# The client announces an upload (file name, size and SHA-256), then sends the file in
+# chunks, each one a PUT of raw bytes at the offset received so far. A chunk is streamed
+# into a file of its own in CHUNKED_UPLOAD_DIR, in blocks of READ_BLOCK bytes, so neither a
+# chunk nor the file is ever held in memory, and the bytes of a chunk cut off by a dropped
+# connection are kept. Requests on an upload then take turns on a lock of <id>.part: the
+# chunk is copied into it if the stored offset is still the chunk's, and only then does the
+# offset advance, with a single conditional UPDATE: no database lock is held while bytes are
+# copied, and a chunk sent twice at once is counted and written once. After a failure the
+# client reads the offset back and resumes from there. complete() checks the size and hash and hands the
+# file to the image pipeline (see uploads.images). Uploads not touched for
+# CHUNKED_UPLOAD_EXPIRY seconds are deleted with their files by expire(), which
+# expire_uploads runs for every user and each new upload for its user.
+
+READ_BLOCK = 64 * 1024  # Bytes read from the request and the file at a time
+
+# Outcomes of append() and complete()
+OK = 'ok'
+OFFSET_MISMATCH = 'offset_mismatch'  # The chunk does not start where the upload stands
+LENGTH_REQUIRED = 'length_required'  # The chunk has no Content-Length
+TOO_LARGE = 'too_large'  # The chunk is over CHUNKED_UPLOAD_MAX_CHUNK or goes past the announced size
+ALREADY_COMPLETE = 'already_complete'
+INCOMPLETE = 'incomplete'  # Not every byte was received yet
+HASH_MISMATCH = 'hash_mismatch'  # The bytes received do not match the announced hash; the upload is discarded
+NOT_IMAGE = 'not_image'  # The file is not an image Pillow can read; the upload is discarded
+
+
+def temp_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def _expiry():
+    return timezone.now() + timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY)
+
+
+def start(user, filename, size, sha256):
+    """
+    Create an upload and its empty temporary file.
+    """
+    expire(user=user)
+    upload = ChunkedUpload.objects.create(user=user, filename=filename, size=size, sha256=sha256.lower(), expires_at=_expiry())
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(temp_path(upload), 'wb').close()
+    return upload
+
+
+def append(upload, offset, stream, length):
+    """
+    Write a chunk of `length` bytes read from `stream` at `offset`.
+    Returns OK, OFFSET_MISMATCH, LENGTH_REQUIRED, TOO_LARGE or ALREADY_COMPLETE;
+    upload.offset is the offset reached either way.
+    """
+    if upload.status == ChunkedUpload.COMPLETE:
+        return ALREADY_COMPLETE
+    if offset != upload.offset:
+        return OFFSET_MISMATCH
+    if length is None:
+        return LENGTH_REQUIRED
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK or offset + length > upload.size:
+        return TOO_LARGE
+
+    received, chunk_path = _receive(upload, stream, length)
+    try:
+        with open(temp_path(upload), 'r+b') as part:
+            # Requests on this upload take turns until the file is closed. The chunk is
+            # written before the offset moves, outside any transaction; bytes past the
+            # offset are left over from a request that failed after writing them, and are replaced.
+            locks.lock(part, locks.LOCK_EX)
+            stored = ChunkedUpload.objects.filter(pk=upload.pk, status=ChunkedUpload.UPLOADING).values_list('offset', flat=True).first()
+            advanced = 0
+            if stored == offset:
+                with open(chunk_path, 'rb') as chunk:
+                    part.seek(offset)
+                    part.truncate()
+                    shutil.copyfileobj(chunk, part, READ_BLOCK)
+                part.flush()
+                # The only write to the database, a single conditional UPDATE
+                advanced = ChunkedUpload.objects.filter(pk=upload.pk, offset=offset, status=ChunkedUpload.UPLOADING).update(
+                    offset=offset + received, expires_at=_expiry(),
+                )
+    finally:
+        os.remove(chunk_path)
+    if not advanced:
+        # Another request wrote this chunk first
+        upload.refresh_from_db(fields=['offset', 'status'])
+        return OFFSET_MISMATCH
+    upload.offset = offset + received
+    return OK
+
+
+def _receive(upload, stream, length):
+    # Stream a chunk into a file of its own. Returns the number of bytes received and the file's path.
+    received = 0
+    with tempfile.NamedTemporaryFile(dir=settings.CHUNKED_UPLOAD_DIR, prefix=f'{upload.pk}.', suffix='.chunk', delete=False) as chunk:
+        try:
+            while received < length:
+                block = stream.read(min(READ_BLOCK, length - received))
+                if not block:
+                    break  # Connection cut off: keep what arrived, the client resumes from the new offset
+                chunk.write(block)
+                received += len(block)
+        except BaseException:
+            os.remove(chunk.name)
+            raise
+    return received, chunk.name
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for block in iter(lambda: part.read(READ_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete(upload):
+    """
+    Check the received file against the announced size and hash and ingest it as an
+    image. Returns OK, INCOMPLETE, HASH_MISMATCH or NOT_IMAGE; on OK upload.asset is set.
+    Completing an upload twice returns OK again.
+    """
+    if upload.status == ChunkedUpload.COMPLETE:
+        return OK
+    if upload.offset != upload.size:
+        return INCOMPLETE
+
+    path = temp_path(upload)
+    if _file_hash(path) != upload.sha256:
+        discard(upload)
+        return HASH_MISMATCH
+
+    with open(path, 'rb') as part:
+        try:
+            with Image.open(part) as image:
+                image.verify()
+            part.seek(0)
+            asset = images.ingest(File(part, name=upload.filename))
+        except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+            discard(upload)
+            return NOT_IMAGE
+
+    ChunkedUpload.objects.filter(pk=upload.pk).update(status=ChunkedUpload.COMPLETE, asset=asset)
+    upload.status, upload.asset = ChunkedUpload.COMPLETE, asset
+    _remove_file(upload)
+    return OK
+
+
+def _remove_file(upload):
+    # The upload's file, and the chunks of requests that died before removing them
+    paths = [temp_path(upload)] + glob.glob(os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{upload.pk}.*.chunk'))
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def discard(upload):
+    _remove_file(upload)
+    upload.delete()
+
+
+def expire(user=None):
+    """
+    Delete the uploads past their expiry time, with their temporary files.
+    Returns the number of uploads deleted.
+    """
+    stale = ChunkedUpload.objects.filter(expires_at__lte=timezone.now())
+    if user is not None:
+        stale = stale.filter(user=user)
+    expired = 0
+    for upload in stale.only('pk').iterator():
+        discard(upload)
+        expired += 1
+    return expired
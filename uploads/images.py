@@ -0,0 +1,229 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+from social_media_api import caching
+from .models import ImageAsset
+
+logger = logging.getLogger(__name__)
+
+# Image pipeline.
+#
+# ingest() runs in the request: it hashes the upload and stores it once under a
+# content-addressed name, images/<ab>/<cd>/<sha256>.<ext>, so the same picture uploaded
+# twice is one file and one ImageAsset. Resizing runs after the transaction commits, in a
+# pool of IMAGE_WORKERS threads: every variant in IMAGE_VARIANTS is written next to the
+# original, and the original is re-encoded without its metadata (EXIF, GPS position,
+# camera details) as <sha256>_stripped.<ext>. Stored names are never written twice: new
+# files are saved first, the asset and the posts and users showing it are pointed at them,
+# and only then are the files they replace deleted.
+#
+# The asset row is the queue: a worker claims a pending asset for IMAGE_PROCESS_LEASE
+# seconds before processing it, so assets whose work was lost with the pool (a restart)
+# are picked up by process_images, and never by two workers at once.
+
+# Formats whose originals are re-encoded to drop their metadata; other formats
+# (e.g. animated GIFs) are kept as uploaded
+REENCODE_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP'}
+EXTENSIONS = {'JPEG': 'jpg', 'MPO': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-worker')
+        return _executor
+
+
+def storage_name(sha256, suffix, extension):
+    return f'images/{sha256[:2]}/{sha256[2:4]}/{sha256}{suffix}.{extension}'
+
+
+def _hash(upload):
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def ingest(upload):
+    """
+    Store an uploaded image once per distinct content and queue its processing.
+    Returns the ImageAsset, new or existing.
+    """
+    sha256 = _hash(upload)
+    asset = ImageAsset.objects.filter(sha256=sha256).first()
+    if asset is not None:
+        return asset
+
+    with Image.open(upload) as image:
+        image_format = image.format
+        width, height = image.size
+    upload.seek(0)
+    extension = EXTENSIONS.get(image_format) or os.path.splitext(upload.name)[1].lstrip('.').lower() or 'img'
+    name = storage_name(sha256, '', extension)
+    if not default_storage.exists(name):
+        name = default_storage.save(name, upload)
+
+    try:
+        with transaction.atomic():
+            asset = ImageAsset.objects.create(sha256=sha256, original=name, width=width, height=height, size=upload.size)
+    except IntegrityError:
+        # The same image was ingested concurrently
+        return ImageAsset.objects.get(sha256=sha256)
+    transaction.on_commit(lambda: submit(asset.pk))
+    return asset
+
+
+def submit(asset_id):
+    # Process in the worker pool, or right away when IMAGE_PROCESS_ASYNC is off
+    if settings.IMAGE_PROCESS_ASYNC:
+        get_executor().submit(_process_in_worker, asset_id)
+    else:
+        process(asset_id)
+
+
+def _process_in_worker(asset_id):
+    try:
+        process(asset_id)
+    except Exception:
+        logger.exception("Processing image asset %s failed", asset_id)
+    finally:
+        close_old_connections()
+
+
+def _save(image, image_format, name, **options):
+    # Encode without passing exif or icc data, so no metadata is written. Returns the name
+    # saved under, which differs from name when a file of that name exists, and the size.
+    buffer = BytesIO()
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, image_format, **options)
+    return default_storage.save(name, ContentFile(buffer.getvalue())), buffer.tell()
+
+
+def _delete(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning("Could not delete replaced image file %s", name, exc_info=True)
+
+
+def claim(asset_id, retry_failed=False):
+    """
+    Take a pending asset (or a failed one, with retry_failed) for processing, unless
+    another worker holds it and its lease has not expired. Returns True if claimed.
+    """
+    now = timezone.now()
+    statuses = [ImageAsset.PENDING] + ([ImageAsset.FAILED] if retry_failed else [])
+    free = Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - timedelta(seconds=settings.IMAGE_PROCESS_LEASE))
+    return ImageAsset.objects.filter(free, pk=asset_id, status__in=statuses).update(claimed_at=now) == 1
+
+
+def unclaimed(older_than, retry_failed=False):
+    """
+    IDs of the assets process_images should process: pending for at least older_than
+    seconds (or failed, with retry_failed) and not held by a worker.
+    """
+    now = timezone.now()
+    statuses = [ImageAsset.PENDING] + ([ImageAsset.FAILED] if retry_failed else [])
+    free = Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - timedelta(seconds=settings.IMAGE_PROCESS_LEASE))
+    return ImageAsset.objects.filter(free, status__in=statuses, created_at__lte=now - timedelta(seconds=older_than)).values_list('id', flat=True)
+
+
+def repoint_references(asset_id, old_name, new_name):
+    # Posts and users store the original's name in their file field next to the asset
+    apps.get_model('posts', 'Post').objects.filter(image_id=asset_id, media=old_name).update(media=new_name)
+    get_user_model().objects.filter(avatar_id=asset_id, profile_picture=old_name).update(profile_picture=new_name)
+
+
+def process(asset_id, retry_failed=False):
+    """
+    Write the resized variants of an asset and strip the metadata of its original.
+    Returns False without doing anything when the asset is not due or another worker holds it.
+    """
+    if not claim(asset_id, retry_failed):
+        return False
+    asset = ImageAsset.objects.get(pk=asset_id)
+    written = []
+    try:
+        with default_storage.open(asset.original.name) as source:
+            image = Image.open(source)
+            image_format = image.format
+            image.load()
+        # Apply the EXIF orientation before the EXIF data is dropped
+        image = ImageOps.exif_transpose(image)
+
+        original, size = asset.original.name, asset.size
+        # An original stripped by an earlier run is kept, rather than losing quality to another encoding
+        stripped = os.path.basename(original).startswith(f'{asset.sha256}_stripped')
+        if image_format in REENCODE_FORMATS and not stripped:
+            encoded_format = REENCODE_FORMATS[image_format]
+            name = storage_name(asset.sha256, '_stripped', EXTENSIONS[encoded_format])
+            original, size = _save(image, encoded_format, name, quality=settings.IMAGE_ORIGINAL_QUALITY)
+            written.append(original)
+
+        variants = {}
+        for variant, (max_side, variant_format, quality) in settings.IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((max_side, max_side), Image.LANCZOS)
+            name, variant_size = _save(resized, variant_format, storage_name(asset.sha256, f'_{variant}', variant_format.lower()), quality=quality)
+            written.append(name)
+            variants[variant] = {'name': name, 'width': resized.width, 'height': resized.height, 'size': variant_size}
+    except Exception as error:
+        ImageAsset.objects.filter(pk=asset.pk).update(status=ImageAsset.FAILED, error=str(error), processed_at=timezone.now(), claimed_at=None)
+        invalidate_references(asset.pk)
+        _delete(written)
+        raise
+
+    with transaction.atomic():
+        ImageAsset.objects.filter(pk=asset.pk).update(
+            status=ImageAsset.READY, original=original, variants=variants, width=image.width, height=image.height,
+            size=size, error='', processed_at=timezone.now(), claimed_at=None,
+        )
+        if original != asset.original.name:
+            repoint_references(asset.pk, asset.original.name, original)
+    invalidate_references(asset.pk)
+
+    # Nothing refers to the files replaced any more
+    replaced = {data['name'] for data in asset.variants.values()}
+    if original != asset.original.name:
+        replaced.add(asset.original.name)
+    _delete(sorted(replaced - set(written)))
+    return True
+
+
+def invalidate_references(asset_id):
+    # Cached posts and profiles embed the asset's status and variant URLs (see social_media_api.caching)
+    post_ids = apps.get_model('posts', 'Post').objects.filter(image_id=asset_id).values_list('pk', flat=True)
+    user_ids = get_user_model().objects.filter(avatar_id=asset_id).values_list('pk', flat=True)
+    caching.bump(caching.POST, *post_ids)
+    caching.bump(caching.USER, *user_ids)
+
+
+def variant_urls(asset):
+    """
+    URLs of the original and of every variant written so far, {name: url}.
+    """
+    urls = {'original': asset.original.url}
+    for variant, data in asset.variants.items():
+        urls[variant] = default_storage.url(data['name'])
+    return urls
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from uploads import chunked
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads of every user past their expiry time, with their partial files, once or every --interval seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None, help="Keep running, sweeping expired uploads every this many seconds.")
+
+    def handle(self, *args, **options):
+        expired = 0
+        try:
+            while True:
+                expired += chunked.expire()
+                if options['interval'] is None:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"{expired} expired uploads deleted."))
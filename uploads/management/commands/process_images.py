@@ -0,0 +1,63 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from posts.models import Post
+from social_media_api import caching
+from uploads import images
+
+User = get_user_model()  # Custom user model
+
+
+class Command(BaseCommand):
+    help = "Process image assets left pending (e.g. by a restart), once or every --interval seconds, and optionally move older uploads into the image pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=5, help="Only process assets pending for at least this many minutes.")
+        parser.add_argument('--retry-failed', action='store_true', help="Process failed assets again.")
+        parser.add_argument('--backfill', action='store_true', help="Ingest post media and profile pictures uploaded before the image pipeline.")
+        parser.add_argument('--interval', type=float, default=None, help="Keep running, looking for assets left pending every this many seconds.")
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill(Post.objects.exclude(media='').filter(media__isnull=False, image__isnull=True), 'media', 'image')
+            self.backfill(User.objects.exclude(profile_picture='').filter(profile_picture__isnull=False, avatar__isnull=True), 'profile_picture', 'avatar')
+
+        processed = failed = 0
+        try:
+            while True:
+                done, errors = self.process_pending(options['older_than'] * 60, options['retry_failed'])
+                processed, failed = processed + done, failed + errors
+                if options['interval'] is None:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"{processed} images processed, {failed} failed."))
+
+    def process_pending(self, older_than, retry_failed):
+        # Assets held by a worker whose lease is still running are skipped, see uploads.images.claim
+        processed = failed = 0
+        for asset_id in images.unclaimed(older_than, retry_failed).iterator():
+            try:
+                processed += images.process(asset_id, retry_failed)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f"Image asset {asset_id}: {error}")
+        return processed, failed
+
+    def backfill(self, queryset, field, asset_field):
+        ingested = 0
+        for instance in queryset.only('pk', field).iterator():
+            image_file = getattr(instance, field)
+            try:
+                with transaction.atomic():
+                    with image_file.open('rb'):
+                        asset = images.ingest(image_file)
+                    queryset.model.objects.filter(pk=instance.pk).update(**{field: asset.original.name, asset_field: asset})
+                    caching.bump(caching.POST if queryset.model is Post else caching.USER, instance.pk)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f"{queryset.model.__name__} {instance.pk}: {error}")
+                continue
+            ingested += 1
+        self.stdout.write(f"{ingested} {queryset.model._meta.verbose_name_plural} backfilled.")
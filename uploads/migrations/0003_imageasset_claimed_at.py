@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploads', '0002_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageasset',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
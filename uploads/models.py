@@ -0,0 +1,66 @@
+import uuid
+from django.conf import settings
+from django.db import models
+
+
+# ImageAsset is one stored image, identified by the SHA-256 of the uploaded bytes.
+# Identical uploads share a single asset, and so a single set of files.
+class ImageAsset(models.Model):
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
+    sha256 = models.CharField(max_length=64, unique=True)  # Hash of the uploaded bytes, the deduplication key
+    original = models.ImageField(max_length=255)  # Content-addressed original, stripped of metadata once processed
+    width = models.PositiveIntegerField(default=0)
+    height = models.PositiveIntegerField(default=0)
+    size = models.PositiveIntegerField(default=0)  # Bytes of the stored original
+    variants = models.JSONField(default=dict, blank=True)  # {name: {'name', 'width', 'height', 'size'}}, see uploads.images
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True, default='')  # Why processing failed
+    claimed_at = models.DateTimeField(null=True, blank=True)  # When a worker started processing it, see uploads.images.claim
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='uploads_image_status'),  # Pending assets for process_images
+        ]
+
+    def __str__(self):
+        return self.sha256
+
+
+# ChunkedUpload is an upload received in pieces over several requests (see uploads.chunked).
+# Its bytes are written to a temporary file until it is completed and turned into an ImageAsset.
+class ChunkedUpload(models.Model):
+    UPLOADING = 'uploading'
+    COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (UPLOADING, 'Uploading'),
+        (COMPLETE, 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Upload token, not guessable
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chunked_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()  # Total bytes announced by the client
+    offset = models.PositiveBigIntegerField(default=0)  # Bytes received so far
+    sha256 = models.CharField(max_length=64)  # Expected hash of the whole file, checked on completion
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=UPLOADING)
+    asset = models.ForeignKey(ImageAsset, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()  # Pushed back by every chunk received
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='uploads_chunked_expires'),  # Stale uploads for expire_uploads
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
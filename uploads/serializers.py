@@ -0,0 +1,74 @@
+import re
+from django.conf import settings
+from rest_framework import serializers
+from social_media_api.instrumentation import TimedSerializerMixin
+from . import images
+from .models import ImageAsset, ChunkedUpload
+
+
+# Serializer for processed images: dimensions, processing status and the URL of every variant
+class ImageAssetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    urls = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageAsset
+        fields = ['id', 'width', 'height', 'status', 'urls']
+
+    def get_urls(self, obj):
+        # e.g. {"original": ..., "thumbnail": ..., "medium": ...}; variants appear once processed
+        return images.variant_urls(obj)
+
+
+# Sends uploaded image files through the image pipeline (see uploads.images) instead of
+# saving them as is: the file field then holds the content-addressed original and the
+# asset field links to its processed variants.
+class ImageUploadMixin:
+    image_fields = {}  # {file field: ImageAsset foreign key}
+
+    def ingest_images(self, validated_data):
+        for field, asset_field in self.image_fields.items():
+            upload = validated_data.get(field)
+            if upload:
+                asset = images.ingest(upload)
+                validated_data[field] = asset.original.name
+                validated_data[asset_field] = asset
+        return validated_data
+
+    def create(self, validated_data):
+        return super().create(self.ingest_images(validated_data))
+
+    def update(self, instance, validated_data):
+        return super().update(instance, self.ingest_images(validated_data))
+
+
+# Serializer for resumable uploads: the client announces the file, then follows its offset
+class ChunkedUploadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    asset = ImageAssetSerializer(read_only=True)
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'filename', 'size', 'sha256', 'offset', 'status', 'asset', 'created_at', 'expires_at']
+        read_only_fields = ['id', 'offset', 'status', 'asset', 'created_at', 'expires_at']
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Size must be positive.")
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Uploads are limited to {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes.")
+        return value
+
+    def validate_sha256(self, value):
+        if not re.fullmatch(r'[0-9a-fA-F]{64}', value):
+            raise serializers.ValidationError("Expected the hex SHA-256 of the whole file.")
+        return value.lower()
+
+
+# Where to attach a completed upload: one of the user's posts or their profile picture
+class ChunkedUploadCompleteSerializer(serializers.Serializer):
+    post = serializers.IntegerField(required=False)
+    profile = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs.get('post') is not None and attrs['profile']:
+            raise serializers.ValidationError("Attach the image to a post or to the profile, not both.")
+        return attrs
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+from posts.models import Post
+from . import chunked, images
+from .models import ChunkedUpload, ImageAsset
+
+User = get_user_model()  # Custom user model
+
+
+def jpeg(color='red'):
+    # A photo with the camera's make in its EXIF data
+    exif = Image.Exif()
+    exif[0x010F] = 'Camera maker'
+    buffer = BytesIO()
+    Image.new('RGB', (1600, 1200), color).save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class MediaTestCase(APITestCase):
+    # Files are stored in a temporary MEDIA_ROOT
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root))
+
+
+class ImagePipelineTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('photographer', 'photographer@example.com', 'password')
+        # Ingested, but its processing never ran: the commit callback is not executed
+        with self.captureOnCommitCallbacks():
+            self.asset = images.ingest(SimpleUploadedFile('photo.jpg', jpeg(), 'image/jpeg'))
+        self.post = Post.objects.create(author=self.user, title='Photo', content='content', media=self.asset.original.name, image=self.asset)
+
+    def test_files_are_replaced_after_the_new_ones_are_saved(self):
+        uploaded = self.asset.original.name
+        delete = default_storage.delete
+
+        def checked_delete(name):
+            # Nothing refers to a file when it is deleted, and what replaces it exists
+            asset = ImageAsset.objects.get()
+            self.assertNotIn(name, [asset.original.name, Post.objects.get().media.name])
+            self.assertTrue(default_storage.exists(asset.original.name))
+            deleted.append(name)
+            delete(name)
+
+        deleted = []
+        with mock.patch.object(default_storage, 'delete', checked_delete):
+            self.assertTrue(images.process(self.asset.pk))
+        self.assertEqual(deleted, [uploaded])
+
+        asset = ImageAsset.objects.get()
+        self.assertEqual(asset.status, ImageAsset.READY)
+        self.assertTrue(asset.original.name.endswith('_stripped.jpg'))
+        self.assertEqual(Post.objects.get().media.name, asset.original.name)
+        with default_storage.open(asset.original.name) as stripped:
+            self.assertEqual(dict(Image.open(stripped).getexif()), {})
+        for data in asset.variants.values():
+            self.assertTrue(default_storage.exists(data['name']))
+
+        # Processed again: new variant files, then the earlier ones go
+        ImageAsset.objects.filter(pk=asset.pk).update(status=ImageAsset.FAILED)
+        deleted = []
+        with mock.patch.object(default_storage, 'delete', checked_delete):
+            self.assertTrue(images.process(asset.pk, retry_failed=True))
+        reprocessed = ImageAsset.objects.get()
+        self.assertEqual(sorted(deleted), sorted(data['name'] for data in asset.variants.values()))
+        for data in reprocessed.variants.values():
+            self.assertTrue(default_storage.exists(data['name']))
+
+    def test_pending_assets_are_processed_after_a_restart(self):
+        # Another worker holds the asset: it is left alone until its lease expires
+        self.assertTrue(images.claim(self.asset.pk))
+        self.assertFalse(images.process(self.asset.pk))
+        call_command('process_images', older_than=0, stdout=StringIO())
+        self.assertEqual(ImageAsset.objects.get().status, ImageAsset.PENDING)
+
+        expired = timezone.now() - timedelta(seconds=settings.IMAGE_PROCESS_LEASE + 1)
+        ImageAsset.objects.update(claimed_at=expired)
+        call_command('process_images', older_than=0, stdout=StringIO())
+        asset = ImageAsset.objects.get()
+        self.assertEqual((asset.status, asset.claimed_at), (ImageAsset.READY, None))
+        self.assertEqual(set(asset.variants), set(settings.IMAGE_VARIANTS))
+
+
+class ChunkedUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir)
+        self.enterContext(self.settings(CHUNKED_UPLOAD_DIR=upload_dir))
+        self.user = User.objects.create_user('uploader', 'uploader@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.data = jpeg()
+
+    def start(self, user=None):
+        return chunked.start(user or self.user, 'photo.jpg', len(self.data), hashlib.sha256(self.data).hexdigest())
+
+    def put(self, upload, offset, end):
+        return self.client.put(f"{reverse('chunked-upload', args=[upload.pk])}?offset={offset}", self.data[offset:end],
+                               content_type='application/octet-stream')
+
+    def test_resume(self):
+        upload = self.start()
+        self.assertEqual(self.put(upload, 0, 1000).data['offset'], 1000)
+
+        # The connection drops 400 bytes into the next chunk: those bytes are kept
+        upload.refresh_from_db()
+        self.assertEqual(chunked.append(upload, 1000, BytesIO(self.data[1000:1400]), 1000), chunked.OK)
+        self.assertEqual(self.client.get(reverse('chunked-upload', args=[upload.pk])).data['offset'], 1400)
+
+        # A chunk sent again from an earlier offset is refused with the offset to resume from
+        response = self.put(upload, 1000, 2000)
+        self.assertEqual((response.status_code, response.data['offset']), (409, 1400))
+
+        self.assertEqual(self.put(upload, 1400, len(self.data)).data['offset'], len(self.data))
+        with self.captureOnCommitCallbacks():
+            response = self.client.post(reverse('chunked-upload-complete', args=[upload.pk]), {'profile': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        with default_storage.open(self.user.avatar.original.name) as stored:
+            self.assertEqual(stored.read(), self.data)
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_DIR), [])
+
+    def test_concurrent_chunk_is_written_once(self):
+        upload = self.start()
+        # Both requests loaded the upload at offset 0; the first one advances the offset
+        stale = ChunkedUpload.objects.get(pk=upload.pk)
+        self.assertEqual(chunked.append(upload, 0, BytesIO(self.data[:1000]), 1000), chunked.OK)
+        self.assertEqual(chunked.append(stale, 0, BytesIO(b'x' * 1000), 1000), chunked.OFFSET_MISMATCH)
+        self.assertEqual(stale.offset, 1000)
+        with open(chunked.temp_path(upload), 'rb') as part:
+            self.assertEqual(part.read(), self.data[:1000])
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_DIR), [f'{upload.pk}.part'])
+
+    def test_expiry(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        expired = [self.start(), self.start(other)]
+        active = self.start()
+        ChunkedUpload.objects.filter(pk__in=[upload.pk for upload in expired]).update(expires_at=timezone.now())
+
+        # Every user's expired uploads go, with their files
+        call_command('expire_uploads', stdout=StringIO())
+        self.assertEqual(list(ChunkedUpload.objects.values_list('pk', flat=True)), [active.pk])
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_DIR), [f'{active.pk}.part'])
+        self.assertEqual(self.client.get(reverse('chunked-upload', args=[expired[0].pk])).status_code, 404)
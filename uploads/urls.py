@@ -0,0 +1,8 @@
+from django.urls import path
+from .views import ChunkedUploadStartView, ChunkedUploadView, ChunkedUploadCompleteView
+
+urlpatterns = [
+    path('chunked/', ChunkedUploadStartView.as_view(), name='chunked-upload-start'),  # POST to announce a file
+    path('chunked/<uuid:upload_id>/', ChunkedUploadView.as_view(), name='chunked-upload'),  # GET the offset, PUT a chunk, DELETE to cancel
+    path('chunked/<uuid:upload_id>/complete/', ChunkedUploadCompleteView.as_view(), name='chunked-upload-complete'),  # POST to verify and attach
+]
@@ -0,0 +1,135 @@
+from io import BytesIO
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import status, views
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from posts.models import Post
+from . import chunked
+from .models import ChunkedUpload
+from .serializers import ChunkedUploadSerializer, ChunkedUploadCompleteSerializer
+
+# Error responses for the outcomes of chunked.append() and chunked.complete()
+CHUNK_ERRORS = {
+    chunked.OFFSET_MISMATCH: ("The chunk does not start at the current offset.", status.HTTP_409_CONFLICT),
+    chunked.ALREADY_COMPLETE: ("This upload is already complete.", status.HTTP_409_CONFLICT),
+    chunked.LENGTH_REQUIRED: ("A Content-Length header is required.", status.HTTP_411_LENGTH_REQUIRED),
+    chunked.TOO_LARGE: ("The chunk is too large or goes past the announced size.", status.HTTP_413_REQUEST_ENTITY_TOO_LARGE),
+}
+COMPLETE_ERRORS = {
+    chunked.INCOMPLETE: ("Not every byte of the file was received yet.", status.HTTP_400_BAD_REQUEST),
+    chunked.HASH_MISMATCH: ("The file does not match its SHA-256; the upload was discarded.", status.HTTP_400_BAD_REQUEST),
+    chunked.NOT_IMAGE: ("The file is not a valid image; the upload was discarded.", status.HTTP_400_BAD_REQUEST),
+}
+
+
+def chunk_error(errors, outcome, upload):
+    detail, code = errors[outcome]
+    return Response({'detail': detail, 'offset': upload.offset, 'size': upload.size}, status=code)
+
+
+def get_upload(request, upload_id):
+    # The user's own upload, as long as it has not expired
+    return get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user, expires_at__gt=timezone.now())
+
+
+# Start a resumable upload
+class ChunkedUploadStartView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Start a chunked upload",
+        operation_description="Announce a file with its name, size and SHA-256, then send its bytes in chunks with PUT",
+        request_body=ChunkedUploadSerializer,
+    )
+    def post(self, request):
+        serializer = ChunkedUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        active = ChunkedUpload.objects.filter(
+            user=request.user, status=ChunkedUpload.UPLOADING, expires_at__gt=timezone.now(),
+        ).count()
+        if active >= settings.CHUNKED_UPLOAD_MAX_ACTIVE:
+            return Response({'detail': 'Too many unfinished uploads.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        upload = chunked.start(request.user, **serializer.validated_data)
+        return Response(ChunkedUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+# Progress, chunks and cancellation of a resumable upload
+class ChunkedUploadView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Chunked upload status",
+        operation_description="This returns the offset reached by an upload, where the next chunk starts",
+    )
+    def get(self, request, upload_id):
+        return Response(ChunkedUploadSerializer(get_upload(request, upload_id)).data)
+
+    @swagger_auto_schema(
+        operation_summary="Send a chunk",
+        operation_description="Send the raw bytes of the file starting at the given offset. On 409 the response carries the offset to resume from.",
+        manual_parameters=[
+            openapi.Parameter('offset', openapi.IN_QUERY, description="Position of the chunk in the file", type=openapi.TYPE_INTEGER, required=True),
+        ],
+    )
+    def put(self, request, upload_id):
+        upload = get_upload(request, upload_id)
+        try:
+            offset = int(request.query_params['offset'])
+        except (KeyError, ValueError):
+            return Response({'detail': 'offset must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            length = None
+
+        # Read the raw request stream, so the chunk is never loaded into memory as a whole
+        # (request.stream is None for an empty body)
+        outcome = chunked.append(upload, offset, request.stream or BytesIO(), length)
+        if outcome in CHUNK_ERRORS:
+            return chunk_error(CHUNK_ERRORS, outcome, upload)
+        return Response({'offset': upload.offset, 'size': upload.size})
+
+    @swagger_auto_schema(
+        operation_summary="Cancel a chunked upload",
+        operation_description="Delete an upload and the bytes received so far",
+    )
+    def delete(self, request, upload_id):
+        chunked.discard(get_upload(request, upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# Finish a resumable upload and attach the image
+class ChunkedUploadCompleteView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Complete a chunked upload",
+        operation_description="Check the file against its SHA-256, store it as an image and attach it to one of your posts (post) or to your profile (profile)",
+        request_body=ChunkedUploadCompleteSerializer,
+    )
+    def post(self, request, upload_id):
+        upload = get_upload(request, upload_id)
+        serializer = ChunkedUploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        # Find the post before completing, so a wrong post ID does not use up the upload
+        post = None
+        if serializer.validated_data.get('post') is not None:
+            post = get_object_or_404(Post.objects.only('id', 'author_id'), pk=serializer.validated_data['post'], author=request.user)
+
+        outcome = chunked.complete(upload)
+        if outcome in COMPLETE_ERRORS:
+            return chunk_error(COMPLETE_ERRORS, outcome, upload)
+
+        asset = upload.asset
+        if post is not None:
+            post.media, post.image = asset.original.name, asset
+            post.save(update_fields=['media', 'image', 'updated_at'])
+        elif serializer.validated_data['profile']:
+            request.user.profile_picture, request.user.avatar = asset.original.name, asset
+            request.user.save(update_fields=['profile_picture', 'avatar'])
+        return Response(ChunkedUploadSerializer(upload).data)
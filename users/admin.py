@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth import get_user_model
+from .models import AccountDeletion
 
 # Get the custom user model
 User = get_user_model()
@@ -35,3 +36,12 @@ class CustomUserAdmin(UserAdmin):
 
 # Register the custom user model with the custom admin interface
 admin.site.register(User, CustomUserAdmin)
+
+# Define the admin interface for background account deletions
+class AccountDeletionAdmin(admin.ModelAdmin):
+    list_display = ('user_pk', 'username', 'status', 'stage', 'attempts', 'requested_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('username',)
+    readonly_fields = ('user_pk', 'username', 'status', 'stage', 'progress', 'attempts', 'available_at', 'claim_token', 'last_error', 'requested_at', 'finished_at')
+
+admin.site.register(AccountDeletion, AccountDeletionAdmin)
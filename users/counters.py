@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from posts.counters import shifted
+from social_media_api import caching
+
+User = get_user_model()  # Custom user model
+Follow = User.followers.through  # Follow edges: from_customuser is followed by to_customuser
+
+
+def adjust_follow_counts(follower_id, followee_id, delta):
+    """
+    Apply a follow (delta=1) or an unfollow (delta=-1) to both users' counters.
+    """
+    version = caching.new_version()
+    User.objects.filter(pk=follower_id).update(following_count=shifted('following_count', delta), version=version)
+    User.objects.filter(pk=followee_id).update(follower_count=shifted('follower_count', delta), version=version)
+    caching.bump(caching.USER, follower_id, followee_id, stored=True)
+
+
+def edge_count(column):
+    # Actual number of follow edges per user on one side of the relation, as a correlated subquery
+    counts = Follow.objects.filter(**{column: OuterRef('pk')}).order_by().values(column).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def release_follow_counts(user):
+    """
+    Take a user's follow edges off the counters of the users on the other side,
+    before the user is deleted and the edges are removed by the cascade.
+    """
+    follower_ids = list(user.followers.values_list('pk', flat=True))
+    followed_ids = list(user.following.values_list('pk', flat=True))
+    version = caching.new_version()
+    User.objects.filter(pk__in=follower_ids).update(following_count=shifted('following_count', -1), version=version)
+    User.objects.filter(pk__in=followed_ids).update(follower_count=shifted('follower_count', -1), version=version)
+    caching.bump(caching.USER, *follower_ids, *followed_ids, stored=True)
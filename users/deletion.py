@@ -0,0 +1,264 @@
+import logging
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from notifications.dispatch import detach_actor
+from notifications.models import Notification, NotificationEvent
+from posts import threads, timeline
+from posts.counters import shifted
+from posts.models import Post, Comment, Like, TimelineEntry
+from social_media_api import caching
+from uploads import chunked
+from uploads.models import ChunkedUpload
+from .models import CustomUser, AccountDeletion, FollowSuggestion, SuggestionRefresh
+
+logger = logging.getLogger(__name__)
+
+Follow = CustomUser.followers.through  # from_customuser is the followed user, to_customuser the follower
+
+# Background account deletion.
+#
+# Deleting an active user in one go cascades through every post, comment, like, follow
+# edge and notification in a single transaction, holding the SQLite write lock for
+# seconds and loading the related rows into memory for Django's collector. Instead,
+# request_deletion() only deactivates the account (its tokens stop working) and queues an
+# AccountDeletion job. The worker (process_account_deletions) runs the STAGES in order,
+# each one deleting at most ACCOUNT_DELETION_BATCH_SIZE rows per transaction and keeping
+# the counters of the other users' rows right as it goes, then deletes the emptied user
+# row. Every batch re-reads what is left, so a job interrupted at any point resumes from
+# its recorded stage. Jobs are claimed with a lease like notification events: a crashed
+# worker's job is picked up again once its lease expires.
+
+
+def _ids(queryset, batch_size, *fields):
+    # The primary keys of the next batch of rows of a queryset, or (pk, *fields) tuples
+    rows = queryset.order_by('pk')
+    rows = rows.values_list('pk', *fields) if fields else rows.values_list('pk', flat=True)
+    return list(rows[:batch_size])
+
+
+def delete_likes(user, batch_size):
+    rows = _ids(Like.objects.filter(user=user), batch_size, 'post_id')
+    Like.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+    # A user likes a post at most once
+    Post.objects.filter(pk__in=[post_id for _, post_id in rows]).update(like_count=shifted('like_count', -1), version=caching.new_version())
+    caching.bump(caching.POST, *[post_id for _, post_id in rows], stored=True)
+    return len(rows)
+
+
+def delete_comments(user, batch_size):
+    # The user's comments on other users' posts, with the replies under them. Sorting by
+    # path puts a thread before its replies: the first comment is an outermost one, taken
+    # apart batch_size rows at a time from its deepest replies up.
+    comment = Comment.objects.filter(author=user).exclude(post__author=user).order_by('path').only('id', 'post_id', 'parent_id', 'path').first()
+    if comment is None:
+        return 0
+    return threads.remove_batch(comment, batch_size)
+
+
+def delete_post_comments(user, batch_size):
+    # Comments on the user's posts, deepest first, so no batch cascades into replies
+    rows = list(Comment.objects.filter(post__author=user).order_by('-depth', 'pk').values_list('pk', 'post_id')[:batch_size])
+    Comment.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+    caching.bump(caching.POST, *[post_id for _, post_id in rows])
+    return len(rows)
+
+
+def delete_post_likes(user, batch_size):
+    rows = _ids(Like.objects.filter(post__author=user), batch_size, 'post_id')
+    Like.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+    caching.bump(caching.POST, *[post_id for _, post_id in rows])
+    return len(rows)
+
+
+def delete_post_timeline_entries(user, batch_size):
+    # The user's posts in their followers' feeds
+    ids = _ids(TimelineEntry.objects.filter(author=user), batch_size)
+    TimelineEntry.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def delete_posts(user, batch_size):
+    ids = _ids(Post.objects.filter(author=user), batch_size)
+    Post.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def delete_timeline(user, batch_size):
+    ids = _ids(TimelineEntry.objects.filter(user=user), batch_size)
+    TimelineEntry.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def delete_following(user, batch_size):
+    # Edges where the user follows someone: the followed users lose a follower
+    rows = _ids(Follow.objects.filter(to_customuser=user), batch_size, 'from_customuser_id')
+    Follow.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+    CustomUser.objects.filter(pk__in=[followed for _, followed in rows]).update(follower_count=shifted('follower_count', -1), version=caching.new_version())
+    timeline.followers_removed([followed for _, followed in rows])
+    caching.bump(caching.USER, *[followed for _, followed in rows], stored=True)
+    return len(rows)
+
+
+def delete_followers(user, batch_size):
+    # Edges where someone follows the user: the followers follow one user less
+    rows = _ids(Follow.objects.filter(from_customuser=user), batch_size, 'to_customuser_id')
+    Follow.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+    CustomUser.objects.filter(pk__in=[follower for _, follower in rows]).update(following_count=shifted('following_count', -1), version=caching.new_version())
+    caching.bump(caching.USER, *[follower for _, follower in rows], stored=True)
+    return len(rows)
+
+
+def delete_received_notifications(user, batch_size):
+    ids = _ids(Notification.objects.filter(recipient=user), batch_size)
+    Notification.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def delete_sent_notifications(user, batch_size):
+    # Notifications the user acted on: coalesced ones pass to their other actors, the others
+    # are deleted, off their recipients' unread counters
+    return detach_actor(user, batch_size)
+
+
+def delete_notification_events(user, batch_size):
+    ids = _ids(NotificationEvent.objects.filter(Q(recipient=user) | Q(actor=user)), batch_size)
+    NotificationEvent.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def delete_suggestions(user, batch_size):
+    SuggestionRefresh.objects.filter(user=user).delete()
+    ids = _ids(FollowSuggestion.objects.filter(Q(user=user) | Q(suggested=user)), batch_size)
+    FollowSuggestion.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def delete_uploads(user, batch_size):
+    uploads = list(ChunkedUpload.objects.filter(user=user).only('pk')[:batch_size])
+    for upload in uploads:
+        chunked.discard(upload)  # With its partial file
+    return len(uploads)
+
+
+# Deletion stages in order: (name, function deleting one batch and returning the number of rows deleted)
+STAGES = [
+    ('likes', delete_likes),
+    ('comments', delete_comments),
+    ('post_comments', delete_post_comments),
+    ('post_likes', delete_post_likes),
+    ('post_timeline_entries', delete_post_timeline_entries),
+    ('posts', delete_posts),
+    ('timeline', delete_timeline),
+    ('following', delete_following),
+    ('followers', delete_followers),
+    ('received_notifications', delete_received_notifications),
+    ('sent_notifications', delete_sent_notifications),
+    ('notification_events', delete_notification_events),
+    ('suggestions', delete_suggestions),
+    ('uploads', delete_uploads),
+]
+
+
+def request_deletion(user):
+    """
+    Deactivate an account and queue the deletion of its data. Returns the AccountDeletion.
+    """
+    with transaction.atomic():
+        CustomUser.objects.filter(pk=user.pk).update(is_active=False)
+        user.is_active = False
+        job, _ = AccountDeletion.objects.get_or_create(user_pk=user.pk, defaults={'username': user.username})
+    return job
+
+
+def fail_abandoned(now):
+    # Jobs whose worker died during their last attempt are not claimed again: mark them failed
+    failed = AccountDeletion.objects.filter(
+        status=AccountDeletion.RUNNING, available_at__lte=now, attempts__gte=settings.ACCOUNT_DELETION_MAX_ATTEMPTS,
+    ).update(status=AccountDeletion.FAILED, last_error='Lease expired during the last attempt')
+    if failed:
+        logger.error("%s account deletions failed: their lease expired during the last attempt", failed)
+
+
+def claim():
+    # Take ownership of a due job, including one whose previous worker's lease expired,
+    # unless it already had all its attempts
+    now = timezone.now()
+    fail_abandoned(now)
+    due = (Q(status=AccountDeletion.PENDING) | Q(status=AccountDeletion.RUNNING)) & Q(
+        available_at__lte=now, attempts__lt=settings.ACCOUNT_DELETION_MAX_ATTEMPTS,
+    )
+    job_id = AccountDeletion.objects.filter(due).order_by('id').values_list('id', flat=True).first()
+    if job_id is None:
+        return None
+    token = uuid.uuid4().hex
+    claimed = AccountDeletion.objects.filter(due, id=job_id).update(
+        status=AccountDeletion.RUNNING,
+        claim_token=token,
+        attempts=F('attempts') + 1,
+        available_at=now + timedelta(seconds=settings.ACCOUNT_DELETION_LEASE),
+    )
+    return AccountDeletion.objects.get(pk=job_id) if claimed else None
+
+
+def _checkpoint(job, **fields):
+    # Record progress and extend the lease; False if another worker took the job over
+    return AccountDeletion.objects.filter(pk=job.pk, claim_token=job.claim_token).update(
+        available_at=timezone.now() + timedelta(seconds=settings.ACCOUNT_DELETION_LEASE), **fields,
+    ) == 1
+
+
+def run(job, batch_size=None):
+    """
+    Run a claimed job from its recorded stage to the end. Returns True once the user is deleted.
+    """
+    batch_size = batch_size or settings.ACCOUNT_DELETION_BATCH_SIZE
+    user = CustomUser.objects.filter(pk=job.user_pk).first()
+    if user is not None:
+        names = [name for name, _ in STAGES]
+        start = names.index(job.stage) if job.stage in names else 0
+        for name, delete_batch in STAGES[start:]:
+            while True:
+                with transaction.atomic():
+                    deleted = delete_batch(user, batch_size)
+                if not deleted:
+                    break
+                job.progress[name] = job.progress.get(name, 0) + deleted
+                if not _checkpoint(job, stage=name, progress=job.progress):
+                    return False
+        # Only the user row is left; the pre_delete counter handlers find nothing more to release
+        with transaction.atomic():
+            user.delete()
+    _checkpoint(job, stage='', status=AccountDeletion.DONE, finished_at=timezone.now(), last_error='')
+    return True
+
+
+def retry_later(job, error):
+    if job.attempts >= settings.ACCOUNT_DELETION_MAX_ATTEMPTS:
+        status, available_at = AccountDeletion.FAILED, timezone.now()
+        logger.error("Deletion of user %s failed after %s attempts: %s", job.user_pk, job.attempts, error)
+    else:
+        delay = settings.ACCOUNT_DELETION_RETRY_DELAY * 2 ** (job.attempts - 1)
+        status, available_at = AccountDeletion.PENDING, timezone.now() + timedelta(seconds=delay)
+        logger.warning("Deletion of user %s failed, retrying in %ss: %s", job.user_pk, delay, error)
+    AccountDeletion.objects.filter(pk=job.pk, claim_token=job.claim_token).update(
+        status=status, available_at=available_at, last_error=str(error),
+    )
+
+
+def process_next(batch_size=None):
+    """
+    Claim and run one due job. Returns the job, or None when there was nothing to do.
+    """
+    job = claim()
+    if job is None:
+        return None
+    try:
+        run(job, batch_size)
+    except Exception as error:
+        # Whatever goes wrong counts as an attempt, so a job that always fails ends up failed
+        retry_later(job, error)
+    return job
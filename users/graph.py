@@ -0,0 +1,81 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.constants import OnConflict
+from posts import timeline
+from .counters import adjust_follow_counts
+from .suggestions import mark_for_refresh
+
+User = get_user_model()  # Custom user model
+Follow = User.followers.through  # Follow edges: from_customuser is followed by to_customuser
+
+# Social graph operations on the follow table. Every check is a lookup on the
+# (from_customuser, to_customuser) unique index, so none of them depends on how
+# many accounts a user follows.
+
+
+def _insert_edge(follower_id, followee_id):
+    # INSERT OR IGNORE / ON CONFLICT DO NOTHING on the unique index, in the syntax of the
+    # database backend: True if the edge is new, whether or not a concurrent request raced it
+    table = connection.ops.quote_name(Follow._meta.db_table)
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    suffix = connection.ops.on_conflict_suffix_sql([], OnConflict.IGNORE, [], [])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"{insert} {table} (from_customuser_id, to_customuser_id) VALUES (%s, %s) {suffix}",
+            [followee_id, follower_id],
+        )
+        return cursor.rowcount == 1
+
+
+def follow(follower, followee):
+    """
+    Add a follow edge and count it on both users. Returns False if it already existed.
+    """
+    # One conditional insert instead of an existence check, and no savepoint to recover from a
+    # conflicting insert: inside a caller's transaction, the writes join it
+    with transaction.atomic(savepoint=False):
+        if not _insert_edge(follower.id, followee.id):
+            return False
+        adjust_follow_counts(follower.id, followee.id, 1)
+        mark_for_refresh([follower.id])
+    return True
+
+
+def unfollow(follower, followee):
+    """
+    Remove a follow edge and uncount it on both users. Returns False if it did not exist.
+    """
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(from_customuser_id=followee.id, to_customuser_id=follower.id).delete()
+        if deleted:
+            adjust_follow_counts(follower.id, followee.id, -1)
+            mark_for_refresh([follower.id])
+            timeline.followers_removed([followee.id])
+    return bool(deleted)
+
+
+def relationships(user, user_ids):
+    """
+    Follow state between a user and each of the given users, answered with one query:
+    {user_id: {'following': ..., 'followed_by': ..., 'mutual': ...}}
+    """
+    edges = Follow.objects.filter(
+        Q(to_customuser_id=user.id, from_customuser_id__in=user_ids)
+        | Q(from_customuser_id=user.id, to_customuser_id__in=user_ids)
+    ).values_list('from_customuser_id', 'to_customuser_id')
+
+    following, followed_by = set(), set()
+    for followee_id, follower_id in edges:
+        if follower_id == user.id:
+            following.add(followee_id)
+        if followee_id == user.id:
+            followed_by.add(follower_id)
+    return {
+        user_id: {
+            'following': user_id in following,
+            'followed_by': user_id in followed_by,
+            'mutual': user_id in following and user_id in followed_by,
+        }
+        for user_id in user_ids
+    }
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand
+from users import suggestions
+
+
+class Command(BaseCommand):
+    help = "Compute friends-of-friends follow suggestions for every user, or only for users whose follows changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help="Only recompute users marked since the last run.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        users, written = suggestions.compute_suggestions(incremental=options['incremental'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{users} users, {written} suggestions written in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from users import deletion
+
+
+class Command(BaseCommand):
+    help = "Delete the data of deactivated accounts in batches until interrupted (or once with --once)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the due deletions once and exit.")
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows deleted per transaction.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to wait when no deletion is due.")
+
+    def handle(self, *args, **options):
+        finished = 0
+        try:
+            while True:
+                job = deletion.process_next(options['batch_size'])
+                if job is not None:
+                    job.refresh_from_db()
+                    deleted = sum(job.progress.values())
+                    self.stdout.write(f"User {job.user_pk} ({job.username}): {job.status}, {deleted} rows deleted.")
+                    finished += job.status == job.DONE
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Deleted {finished} accounts."))
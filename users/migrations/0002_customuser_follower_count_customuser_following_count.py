@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:38
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counts(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Follow = CustomUser.followers.through
+
+    def count(column):
+        rows = Follow.objects.filter(**{column: OuterRef('pk')}).order_by().values(column).annotate(total=Count('*')).values('total')
+        return Coalesce(Subquery(rows, output_field=IntegerField()), Value(0))
+
+    # from_customuser is the followed user, to_customuser the follower
+    CustomUser.objects.update(follower_count=count('from_customuser'), following_count=count('to_customuser'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
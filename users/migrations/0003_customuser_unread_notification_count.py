@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:44
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_unread_counts(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Notification = apps.get_model('notifications', 'Notification')
+    unread = (
+        Notification.objects.filter(recipient=OuterRef('pk'), is_read=False)
+        .order_by().values('recipient').annotate(total=Count('*')).values('total')
+    )
+    CustomUser.objects.update(unread_notification_count=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_customuser_follower_count_customuser_following_count'),
+        ('notifications', '0003_notificationevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='unread_notification_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_unread_counts, migrations.RunPython.noop),
+    ]
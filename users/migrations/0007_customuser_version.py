@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:31
+
+import social_media_api.caching
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_accountdeletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='version',
+            field=models.CharField(default=social_media_api.caching.new_version, editable=False, max_length=24),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_customuser_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='notification_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
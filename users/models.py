@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.utils import timezone
+from social_media_api import caching
 
 # Custom manager for user creation
 class CustomUserManager(BaseUserManager):
@@ -22,16 +24,121 @@ class CustomUserManager(BaseUserManager):
         return self.create_user(username, email, password, **extra_fields)
 
 
+# Keeps denormalized counter columns out of the full saves of existing rows. The counters
+# are only written by atomic UPDATEs (see posts.counters, users.counters): an instance loaded
+# before a concurrent like or follow holds stale values, which a full save would write back.
+class CounterFieldsMixin(models.Model):
+    counter_fields = ()  # Names of the counter fields
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+# Stored version of a row, changed by every write to its representation (see social_media_api.caching).
+# Saves write a new one in the same statement; other writes go through caching.bump().
+class VersionedMixin(models.Model):
+    version = models.CharField(max_length=24, default=caching.new_version, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.version = caching.new_version()
+        if kwargs.get('update_fields'):
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+
+
 # Custom user model extending AbstractUser
-class CustomUser(AbstractUser):
+class CustomUser(AbstractUser, VersionedMixin, CounterFieldsMixin):
     email = models.EmailField(unique=True, null=False, blank=False) # Email is unique and required
     bio = models.CharField(max_length=250, blank=True, null=True)  # Optional Bio field
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True) # Optional Profile Picture field
+    avatar = models.ForeignKey('uploads.ImageAsset', on_delete=models.SET_NULL, blank=True, null=True, related_name='+', editable=False)  # Processed variants of profile_picture
     followers = models.ManyToManyField('self', symmetrical=False, related_name='following', blank=True)  # Many-to-many field for users to follow each other
+    follower_count = models.PositiveIntegerField(default=0, editable=False)  # Denormalized number of followers, see users.counters
+    following_count = models.PositiveIntegerField(default=0, editable=False)  # Denormalized number of followed users, see users.counters
+    unread_notification_count = models.PositiveIntegerField(default=0, editable=False)  # Denormalized number of unread notifications, see notifications.counters
+    notification_version = models.PositiveIntegerField(default=0, editable=False)  # Goes up with every change of the unread notifications, see notifications.counters
    
+    counter_fields = ('follower_count', 'following_count', 'unread_notification_count', 'notification_version')
+
     REQUIRED_FIELDS = ['email']  # Specify the fields that are required when creating a user (excluding the username)
    
     objects = CustomUserManager()  # Custom manager for handling user creation
 
     def __str__(self):
         return self.username
+
+
+# Precomputed "people you may know" suggestion, written by the compute_suggestions command
+class FollowSuggestion(models.Model):
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='follow_suggestions')  # User the suggestion is shown to
+    suggested = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')  # Suggested user to follow
+    mutual_count = models.PositiveIntegerField()  # Followed users who follow the suggested user
+    score = models.FloatField()  # Ranking: mutual connections weighted by the suggested user's recent activity
+    computed_at = models.DateTimeField()  # Start of the batch run that computed the suggestion
+
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [
+            # Serves a user's suggestions best first
+            models.Index(fields=['user', '-score', '-id'], name='users_suggestion_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.suggested} for {self.user}"
+
+
+# Users whose follow edges changed since their suggestions were computed,
+# refreshed by compute_suggestions --incremental
+class SuggestionRefresh(models.Model):
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    marked_at = models.DateTimeField()  # Last edge change; markers newer than a run are kept for the next one
+
+    def __str__(self):
+        return f"Refresh suggestions for {self.user}"
+
+
+# Account being deleted in the background by process_account_deletions (see users.deletion).
+# Kept after the user row is gone, as a record of the deletion.
+class AccountDeletion(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user_pk = models.BigIntegerField(unique=True)  # ID of the deleted user; not a foreign key, the row outlives the user
+    username = models.CharField(max_length=150)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    stage = models.CharField(max_length=30, blank=True)  # Stage being worked on, resumed from after a crash
+    progress = models.JSONField(default=dict, blank=True)  # Rows deleted so far per stage
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Not picked up before this time (retry backoff or worker lease)
+    claim_token = models.CharField(max_length=32, blank=True)  # Identifies the worker currently running the job
+    last_error = models.TextField(blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='users_deletion_status'),
+        ]
+
+    def __str__(self):
+        return f"Deletion of {self.username} ({self.status})"
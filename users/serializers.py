@@ -1,10 +1,13 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from uploads.serializers import ImageAssetSerializer, ImageUploadMixin
+from social_media_api.instrumentation import TimedSerializerMixin
+from .models import FollowSuggestion
 
 User = get_user_model() # Custom user
 
     # Serializer for user registration
-class RegistrationSerializer(serializers.ModelSerializer):
+class RegistrationSerializer(ImageUploadMixin, serializers.ModelSerializer):
      # Define fields for password and profile_picture
     password = serializers.CharField(write_only=True)
     profile_picture = serializers.ImageField(required=False)
@@ -13,8 +16,12 @@ class RegistrationSerializer(serializers.ModelSerializer):
         model = User
         fields = ["username", "email", "password", "bio", "profile_picture"]
 
+    image_fields = {"profile_picture": "avatar"}
+
        # Override the create method to handle user creation logic
     def create(self, validated_data):
+        # Store the profile picture through the image pipeline
+        self.ingest_images(validated_data)
         user = User.objects.create_user(**validated_data)
         return user # Return the created user instance
      
@@ -24,19 +31,20 @@ class LoginSerializer(serializers.Serializer):
     password = serializers.CharField(write_only=True)
     
     # Serializer for viewing the user's profile
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     profile_picture = serializers.SerializerMethodField()
+    avatar = ImageAssetSerializer(read_only=True)  # Resized variants of profile_picture
 
     class Meta:
         model = User
-        fields = ["id", "username", "email", "bio", "profile_picture"]
+        fields = ["id", "username", "email", "bio", "profile_picture", "avatar", "follower_count", "following_count"]
 
     def get_profile_picture(self, obj):
         # Return URL or None if no profile picture exists
         return obj.profile_picture.url if obj.profile_picture else None
 
     # Serializer for updating a user's profile
-class UserProfileUpdateSerializer(serializers.ModelSerializer):
+class UserProfileUpdateSerializer(TimedSerializerMixin, ImageUploadMixin, serializers.ModelSerializer):
     profile_picture = serializers.ImageField(required=False, allow_null=True)
     password = serializers.CharField(write_only=True, required=False, allow_blank=True)
 
@@ -44,7 +52,12 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
         model = User
         fields = ["id", "username", "email", "password", "bio", "profile_picture"]
 
+    image_fields = {"profile_picture": "avatar"}
+
     def update(self, instance, validated_data):
+        # Store a new profile picture through the image pipeline, which also sets avatar
+        self.ingest_images(validated_data)
+
         # Handle profile_picture
         profile_picture = validated_data.pop("profile_picture", None)
 
@@ -64,3 +77,24 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
         # Save the instance
         instance.save()
         return instance
+
+    # Compact serializer for users listed in follower and following lists
+class UserSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    profile_picture = serializers.SerializerMethodField()
+    avatar = ImageAssetSerializer(read_only=True)
+
+    class Meta:
+        model = User
+        fields = ["id", "username", "profile_picture", "avatar", "follower_count", "following_count"]
+
+    def get_profile_picture(self, obj):
+        # Return URL or None if no profile picture exists
+        return obj.profile_picture.url if obj.profile_picture else None
+
+    # Serializer for follow suggestions
+class FollowSuggestionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    suggested = UserSummarySerializer(read_only=True)
+
+    class Meta:
+        model = FollowSuggestion
+        fields = ["id", "suggested", "mutual_count", "score", "computed_at"]
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from social_media_api import caching
+from .counters import release_follow_counts
+from .models import CustomUser
+
+
+# Keep follower counters right when a user's follow edges are removed by a cascade delete
+@receiver(pre_delete, sender=CustomUser, dispatch_uid='users_release_follow_counts')
+def user_pre_delete(sender, instance, **kwargs):
+    release_follow_counts(instance)
+
+
+# Invalidate the cached profile of a saved or deleted user
+@receiver(post_save, sender=CustomUser, dispatch_uid='users_invalidate_profile')
+@receiver(post_delete, sender=CustomUser, dispatch_uid='users_invalidate_deleted_profile')
+def user_changed(sender, instance, **kwargs):
+    caching.bump(caching.USER, instance.pk, stored=True)  # Saved with a new version, or gone
@@ -0,0 +1,164 @@
+import heapq
+import math
+from array import array
+from collections import Counter
+from datetime import timedelta
+from itertools import chain
+from operator import mul, neg
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from posts.models import Post
+from .models import FollowSuggestion, SuggestionRefresh
+
+User = get_user_model()  # Custom user model
+Follow = User.followers.through  # Follow edges: from_customuser is followed by to_customuser
+
+# Friends-of-friends suggestions, computed offline by the compute_suggestions command.
+#
+# The whole follow table is loaded once into a compressed sparse row adjacency held in
+# flat arrays (two integers per edge, no Python object per edge). The candidates of a
+# user are the users followed by the users they follow; their mutual count is the number
+# of such two-hop paths. Scores weight the mutual count by the candidate's recent posting
+# activity, and the best SUGGESTIONS_PER_USER are stored in FollowSuggestion.
+#
+# Following or unfollowing marks the follower in SuggestionRefresh, and an incremental
+# run only recomputes the marked users. The suggestions of their followers are refreshed
+# by the next full run.
+
+CHUNK_SIZE = 1000  # Users computed and written per transaction
+
+
+class FollowGraph:
+    """
+    Follow graph in compressed sparse row form: the users followed by the user at dense
+    index i are indices[indptr[i]:indptr[i + 1]], in ascending order.
+    """
+
+    def __init__(self, user_ids, index, indptr, indices):
+        self.user_ids = user_ids  # Dense index -> user ID
+        self.index = index  # User ID -> dense index
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def followees(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+
+def load_graph():
+    """
+    Read every follow edge into a FollowGraph, streaming the rows in follower order.
+    """
+    user_ids = array('q', User.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=10000))
+    index = {user_id: i for i, user_id in enumerate(user_ids)}
+    indptr = array('q', bytes(8 * (len(user_ids) + 1)))
+    indices = array('q')
+    edges = Follow.objects.order_by('to_customuser_id', 'from_customuser_id').values_list('to_customuser_id', 'from_customuser_id')
+    for follower_id, followee_id in edges.iterator(chunk_size=10000):
+        follower, followee = index.get(follower_id), index.get(followee_id)
+        if follower is None or followee is None:
+            continue  # User created after the user list was read
+        indptr[follower + 1] += 1
+        indices.append(followee)
+    for i in range(len(user_ids)):
+        indptr[i + 1] += indptr[i]
+    return FollowGraph(user_ids, index, indptr, indices)
+
+
+def activity_weights(graph):
+    # Score multiplier per user: 1, plus a log-scaled boost for each recent post
+    weights = array('d', [1.0]) * len(graph)
+    since = timezone.now() - timedelta(days=settings.SUGGESTIONS_ACTIVITY_DAYS)
+    recent = Post.objects.filter(created_at__gte=since).order_by().values('author_id').annotate(total=Count('*'))
+    for row in recent.values_list('author_id', 'total'):
+        i = graph.index.get(row[0])
+        if i is not None:
+            weights[i] = 1.0 + settings.SUGGESTIONS_ACTIVITY_WEIGHT * math.log1p(row[1])
+    return weights
+
+
+def rank(graph, rows, weights, limit):
+    """
+    Yield (dense index, [(candidate index, mutual count, score), ...]) for each row,
+    best candidates first.
+    """
+    followees = graph.followees
+    for i in rows:
+        followed = followees(i)
+        # Two-hop paths counted in one pass over the followees' adjacency slices, in C
+        paths = Counter(chain.from_iterable(map(followees, followed)))
+        # Drop the users already followed and the user themselves, fewer than the candidates
+        for k in followed:
+            paths.pop(k, None)
+        paths.pop(i, None)
+        # (score, mutual count, -candidate) tuples compare best first without a key function,
+        # and are built by map() and zip() rather than one generator step per candidate
+        candidates, mutual = list(paths), list(paths.values())
+        scores = map(mul, mutual, map(weights.__getitem__, candidates))
+        best = heapq.nlargest(limit, zip(scores, mutual, map(neg, candidates)))
+        yield i, [(-k, count, score) for score, count, k in best]
+
+
+def _write(graph, ranked, computed_at):
+    # Replace the stored suggestions of one chunk of users. The rows go through a single
+    # executemany, as compiling hundreds of thousands of model instances into bulk_create
+    # statements costs far more than computing them.
+    user_ids, rows = [], []
+    computed_at = connection.ops.adapt_datetimefield_value(computed_at)
+    for i, candidates in ranked:
+        user_id = graph.user_ids[i]
+        user_ids.append(user_id)
+        rows.extend((user_id, graph.user_ids[k], mutual, score, computed_at) for k, mutual, score in candidates)
+    table = connection.ops.quote_name(FollowSuggestion._meta.db_table)
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id__in=user_ids).delete()
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table} (user_id, suggested_id, mutual_count, score, computed_at) VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+    return len(rows)
+
+
+def compute_suggestions(incremental=False):
+    """
+    Recompute the suggestions of every user, or only of the users marked for refresh.
+    Returns the number of users and of suggestions written.
+    """
+    started = timezone.now()
+    graph = load_graph()
+    if incremental:
+        marked = SuggestionRefresh.objects.filter(marked_at__lte=started).values_list('user_id', flat=True)
+        rows = sorted(graph.index[user_id] for user_id in marked if user_id in graph.index)
+    else:
+        rows = range(len(graph))
+
+    weights = activity_weights(graph)
+    written, chunk = 0, []
+    for ranked in rank(graph, rows, weights, settings.SUGGESTIONS_PER_USER):
+        chunk.append(ranked)
+        if len(chunk) >= CHUNK_SIZE:
+            written += _write(graph, chunk, started)
+            chunk = []
+    if chunk:
+        written += _write(graph, chunk, started)
+
+    # Users marked while the run was in progress stay marked for the next one
+    SuggestionRefresh.objects.filter(marked_at__lte=started).delete()
+    return len(rows), written
+
+
+def mark_for_refresh(user_ids):
+    """
+    Queue users whose follow edges changed for the next incremental run.
+    """
+    now = timezone.now()
+    SuggestionRefresh.objects.bulk_create(
+        [SuggestionRefresh(user_id=user_id, marked_at=now) for user_id in user_ids],
+        update_conflicts=True, unique_fields=['user'], update_fields=['marked_at'],
+    )
@@ -1,3 +1,345 @@
-from django.test import TestCase
+import math
+import random
+from collections import Counter
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from notifications import dispatch
+from notifications.models import Notification, NotificationActor
+from posts import likes
+from posts.models import Post, Comment
+from social_media_api.testing import QueryCountTestCase
+from uploads.models import ImageAsset
+from . import deletion, graph, suggestions
+from .models import AccountDeletion, FollowSuggestion
+from .serializers import UserProfileUpdateSerializer
 
-# Create your tests here.
+User = get_user_model()  # Custom user model
+
+
+class UserQueryCountTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        image = ImageAsset.objects.create(
+            sha256='0' * 64, original='images/00/0.jpg', width=640, height=480, status=ImageAsset.READY,
+            variants={'thumbnail': {'name': 'images/00/0_thumbnail.webp', 'width': 320, 'height': 240, 'size': 100}},
+        )
+        cls.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'password', avatar=image)
+
+        # 60 followers and 60 followed users, every other one with an avatar, and 60 suggestions
+        others = [
+            User.objects.create_user(f'user{i}', f'user{i}@example.com', None, avatar=image if i % 2 else None)
+            for i in range(180)
+        ]
+        cls.followers, cls.following, cls.suggested = others[:60], others[60:120], others[120:]
+        for user in cls.followers:
+            graph.follow(user, cls.viewer)
+        for user in cls.following:
+            graph.follow(cls.viewer, user)
+        FollowSuggestion.objects.bulk_create(
+            FollowSuggestion(user=cls.viewer, suggested=user, mutual_count=i + 1, score=float(i), computed_at=timezone.now())
+            for i, user in enumerate(cls.suggested)
+        )
+        for user in cls.suggested[:5]:
+            Post.objects.create(author=user, title=f'Post by {user.username}', content='content')
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.viewer)
+
+    def test_tokens(self):
+        self.client.credentials()
+        response = self.assertMaxQueries(1, 'post', reverse('token_obtain_pair'), {'username': 'viewer', 'password': 'password'})
+        self.assertMaxQueries(0, 'post', reverse('token_refresh'), {'refresh': response.data['refresh']})
+        self.assertMaxQueries(1, 'post', reverse('login'), {'username': 'viewer', 'password': 'password'})
+
+    def test_register(self):
+        self.client.credentials()
+        self.assertMaxQueries(3, 'post', reverse('register'),
+                              {'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'password'}, status=201)
+
+    def test_profile(self):
+        # User, avatar
+        self.assertMaxQueries(2, 'get', reverse('profile'))
+        self.assertMaxQueries(2, 'put', reverse('profile_update'), {'bio': 'Gardener'})
+
+    @override_settings(RESPONSE_CACHE_ENABLED=True)
+    def test_profile_cache(self):
+        self.client.get(reverse('profile'))
+        # User only
+        response = self.assertMaxQueries(1, 'get', reverse('profile'))
+        self.assertEqual(response.data['following_count'], 60)
+        self.client.post(reverse('follow_user', args=[self.suggested[0].id]))
+        self.assertEqual(self.client.get(reverse('profile')).data['following_count'], 61)
+        self.client.put(reverse('profile_update'), {'bio': 'Gardener'})
+        self.assertEqual(self.client.get(reverse('profile')).data['bio'], 'Gardener')
+
+    @override_settings(RESPONSE_CACHE_ENABLED=True)
+    def test_profile_conditional(self):
+        self.client.get(reverse('profile'))
+        etag = self.client.get(reverse('profile'))['ETag']
+        # User only
+        self.assertMaxQueries(1, 'get', reverse('profile'), status=304, HTTP_IF_NONE_MATCH=etag)
+        self.client.post(reverse('unfollow_user', args=[self.following[0].id]))
+        response = self.client.get(reverse('profile'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['following_count']), (200, 59))
+
+    def test_profile_update_keeps_counters(self):
+        # The user loaded before a follow and a notification, as by a concurrent edit
+        viewer = User.objects.get(pk=self.viewer.pk)
+        self.authenticate(self.suggested[0])
+        self.client.post(reverse('follow_user', args=[viewer.id]))
+        dispatch.drain()
+        graph.follow(viewer, self.suggested[1])
+        serializer = UserProfileUpdateSerializer(viewer, data={'bio': 'Gardener'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.authenticate(self.viewer)
+        self.client.put(reverse('profile_update'), {'bio': 'Beekeeper'})
+
+        viewer.refresh_from_db()
+        self.assertEqual(
+            (viewer.bio, viewer.follower_count, viewer.following_count, viewer.unread_notification_count),
+            ('Beekeeper', 61, 61, 1),
+        )
+
+    def test_profile_delete(self):
+        self.assertMaxQueries(8, 'delete', reverse('profile_delete'), status=202)
+
+    def test_follow_lists(self):
+        # User, the listed user, page with avatars
+        self.assertConstantQueries(3, reverse('user_followers', args=[self.viewer.id]))
+        self.assertConstantQueries(3, reverse('user_following', args=[self.viewer.id]))
+
+    def test_follow_and_unfollow(self):
+        user = self.suggested[0]
+        # User, followed user; the edge insert, both counters, the suggestion refresh mark and the
+        # notification event in one transaction (a savepoint and its release, in tests); the content
+        # type of the notification target, cached after the first request; the followed user's latest
+        # posts and their timeline entries
+        self.assertMaxQueries(12, 'post', reverse('follow_user', args=[user.id]))
+        self.assertMaxQueries(7, 'post', reverse('follow_user', args=[user.id]), status=400)
+        self.assertMaxQueries(10, 'post', reverse('unfollow_user', args=[user.id]))  # With the check for the followed user dropping below the fan-out threshold
+        self.assertMaxQueries(5, 'post', reverse('unfollow_user', args=[user.id]), status=400)
+
+    def relationship(self, user):
+        return self.client.get(reverse('relationships'), {'ids': str(user.id)}).data[user.id]
+
+    def counts(self, *users):
+        return [tuple(User.objects.filter(pk=user.pk).values_list('follower_count', 'following_count').get()) for user in users]
+
+    def test_follow_state_and_counters(self):
+        user, follower = self.suggested[0], self.followers[0]
+        self.assertEqual(self.counts(self.viewer, user), [(60, 60), (0, 0)])
+        self.assertEqual(self.relationship(user), {'following': False, 'followed_by': False, 'mutual': False})
+
+        self.client.post(reverse('follow_user', args=[user.id]))
+        self.assertEqual(self.relationship(user), {'following': True, 'followed_by': False, 'mutual': False})
+        self.assertEqual(self.counts(self.viewer, user), [(60, 61), (1, 0)])
+        # Following again is refused and counts nothing
+        self.assertEqual(self.client.post(reverse('follow_user', args=[user.id])).status_code, 400)
+        self.assertEqual(self.counts(self.viewer, user), [(60, 61), (1, 0)])
+
+        # Following back a follower makes the follow mutual
+        self.assertEqual(self.relationship(follower), {'following': False, 'followed_by': True, 'mutual': False})
+        self.client.post(reverse('follow_user', args=[follower.id]))
+        self.assertEqual(self.relationship(follower), {'following': True, 'followed_by': True, 'mutual': True})
+        self.assertEqual(self.counts(self.viewer, follower), [(60, 62), (1, 1)])
+
+        self.client.post(reverse('unfollow_user', args=[user.id]))
+        self.assertEqual(self.relationship(user), {'following': False, 'followed_by': False, 'mutual': False})
+        self.assertEqual(self.counts(self.viewer, user), [(60, 61), (0, 0)])
+        self.assertEqual(self.client.post(reverse('unfollow_user', args=[user.id])).status_code, 400)
+        self.assertEqual(self.counts(self.viewer, user), [(60, 61), (0, 0)])
+
+    def test_relationships(self):
+        for users in (self.followers[:1], self.followers[:25] + self.following[:25]):
+            with self.subTest(ids=len(users)):
+                response = self.assertMaxQueries(2, 'get', reverse('relationships'), {'ids': ','.join(str(user.id) for user in users)})
+                self.assertEqual(len(response.data), len(users))
+
+    def test_suggestions(self):
+        # User, page with the suggested users and their avatars
+        self.assertConstantQueries(2, reverse('follow_suggestions'))
+
+
+@override_settings(ACCOUNT_DELETION_MAX_ATTEMPTS=2)
+class AccountDeletionTests(QueryCountTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('leaving', 'leaving@example.com', 'password')
+        cls.friend = User.objects.create_user('friend', 'friend@example.com', 'password')
+        cls.own_post = Post.objects.create(author=cls.user, title='Leaving post', content='content')
+        cls.friend_post = Post.objects.create(author=cls.friend, title='Staying post', content='content')
+
+    def setUp(self):
+        super().setUp()
+        graph.follow(self.user, self.friend)
+        graph.follow(self.friend, self.user)
+        likes.like(self.user, self.friend_post.id)
+        likes.like(self.friend, self.own_post.id)
+        # A thread under the user's comment on the friend's post, and the friend's comments on the user's post
+        self.authenticate(self.user)
+        comment = self.client.post(reverse('post_comments', args=[self.friend_post.id]), {'content': 'Bye'}).data
+        self.authenticate(self.friend)
+        reply = self.client.post(reverse('post_comments', args=[self.friend_post.id]), {'content': 'Why?', 'parent': comment['id']}).data
+        self.client.post(reverse('post_comments', args=[self.friend_post.id]), {'content': 'Stays'})
+        self.client.post(reverse('post_comments', args=[self.own_post.id]), {'content': 'Nice'})
+        self.authenticate(self.user)
+        self.client.post(reverse('post_comments', args=[self.friend_post.id]), {'content': 'Because', 'parent': reply['id']})
+        dispatch.drain()
+
+    def make_due(self):
+        AccountDeletion.objects.update(available_at=timezone.now())
+
+    def test_job_completes(self):
+        self.client.delete(reverse('profile_delete'))
+        # Small batches, so every stage takes several of them
+        while deletion.process_next(batch_size=1):
+            pass
+        job = AccountDeletion.objects.get()
+        self.assertEqual(job.status, AccountDeletion.DONE)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+        # The rows of the friend stay, with counters that no longer count the user
+        self.friend_post.refresh_from_db()
+        self.friend.refresh_from_db()
+        self.assertEqual(list(Comment.objects.values_list('content', flat=True)), ['Stays'])
+        self.assertEqual((self.friend_post.like_count, self.friend_post.comment_count), (0, 1))
+        self.assertEqual((self.friend.follower_count, self.friend.following_count), (0, 0))
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(self.friend.unread_notification_count, 0)
+
+    def test_coalesced_notifications_keep_other_actors(self):
+        # The user and another user like the friend's post: one notification with two actors
+        other = User.objects.create_user('staying', 'staying@example.com', 'password')
+        for actor in (other, self.user):
+            dispatch.notify(recipient=self.friend, actor=actor, verb='liked your post', target=self.friend_post)
+        dispatch.drain()
+        notification = Notification.objects.get(verb='liked your post', target_object_id=self.friend_post.id)
+        self.assertEqual((notification.actor_id, notification.actor_count), (self.user.id, 2))
+
+        self.client.delete(reverse('profile_delete'))
+        while deletion.process_next(batch_size=1):
+            pass
+        # The other user's like is still notified, as theirs alone
+        notification.refresh_from_db()
+        self.assertEqual((notification.actor_id, notification.actor_count, notification.recent_actors), (other.id, 1, [other.id]))
+        self.assertEqual(list(NotificationActor.objects.values_list('notification', 'actor')), [(notification.id, other.id)])
+        self.friend.refresh_from_db()
+        self.assertEqual(self.friend.unread_notification_count, Notification.objects.filter(recipient=self.friend, is_read=False).count())
+
+    def test_failures_are_retried(self):
+        self.client.delete(reverse('profile_delete'))
+        with mock.patch.object(deletion, 'run', side_effect=RuntimeError('broken')), self.assertLogs('users.deletion'):
+            deletion.process_next()
+            job = AccountDeletion.objects.get()
+            self.assertEqual((job.status, job.attempts, job.last_error), (AccountDeletion.PENDING, 1, 'broken'))
+            self.assertIsNone(deletion.process_next())  # Backing off
+            self.make_due()
+            deletion.process_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (AccountDeletion.FAILED, 2))
+        self.make_due()
+        self.assertIsNone(deletion.process_next())
+
+    def test_lease_takeover(self):
+        self.client.delete(reverse('profile_delete'))
+        # A worker claims the job and dies: nobody else takes it before the lease expires
+        first = deletion.claim()
+        self.assertIsNone(deletion.claim())
+        self.make_due()
+        second = deletion.claim()
+        self.assertEqual((second.pk, second.attempts), (first.pk, 2))
+        # The first worker's checkpoints are refused from now on
+        self.assertFalse(deletion.run(first, batch_size=1))
+        self.assertTrue(deletion.run(second))
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+    def test_comment_threads_are_deleted_in_batches(self):
+        # Seven more replies under the user's comment, down to depth 4
+        root = Comment.objects.get(content='Bye')
+        parents = [root, Comment.objects.get(content='Why?'), Comment.objects.get(content='Because')]
+        self.authenticate(self.friend)
+        for i in range(7):
+            parent = parents[i % len(parents)] if i < 4 else parents[-1]
+            data = self.client.post(reverse('post_comments', args=[self.friend_post.id]), {'content': f'Reply {i}', 'parent': parent.id}).data
+            parents.append(Comment.objects.get(pk=data['id']))
+
+        batches = []
+        while True:
+            with transaction.atomic():
+                deleted = deletion.delete_comments(self.user, 2)
+            if not deleted:
+                break
+            batches.append(deleted)
+            # Every batch leaves whole threads, with counters matching the rows left
+            self.friend_post.refresh_from_db()
+            comments = Comment.objects.filter(post=self.friend_post)
+            self.assertEqual(self.friend_post.comment_count, comments.count())
+            for comment in comments:
+                self.assertEqual(comment.reply_count, comments.filter(parent=comment).count())
+                self.assertTrue(comment.parent_id is None or comments.filter(pk=comment.parent_id).exists())
+        self.assertEqual(batches, [2, 2, 2, 2, 2])
+        self.assertEqual(list(Comment.objects.filter(post=self.friend_post).values_list('content', flat=True)), ['Stays'])
+
+
+class SuggestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, cls.alice, cls.bob, cls.carol, cls.dave = [
+            User.objects.create_user(name, f'{name}@example.com', None) for name in ('viewer', 'alice', 'bob', 'carol', 'dave')
+        ]
+        # The viewer follows Alice and Bob, who both follow Carol; Alice also follows Dave,
+        # Bob and the viewer, who are not suggested to the viewer
+        for follower, followee in [
+            (cls.viewer, cls.alice), (cls.viewer, cls.bob), (cls.alice, cls.carol), (cls.bob, cls.carol),
+            (cls.alice, cls.dave), (cls.alice, cls.bob), (cls.bob, cls.viewer),
+        ]:
+            graph.follow(follower, followee)
+
+    def suggested(self, user):
+        return list(FollowSuggestion.objects.filter(user=user).order_by('-score', 'id').values_list('suggested', 'mutual_count'))
+
+    def test_mutual_counts(self):
+        suggestions.compute_suggestions()
+        self.assertEqual(self.suggested(self.viewer), [(self.carol.id, 2), (self.dave.id, 1)])
+        self.assertEqual(self.suggested(self.bob), [(self.alice.id, 1)])
+
+    def test_activity_boosts_the_score(self):
+        # Recent posts weigh Dave's single path, still below Carol's two
+        for i in range(3):
+            Post.objects.create(author=self.dave, title=f'Post {i}', content='content')
+        suggestions.compute_suggestions()
+        scores = dict(FollowSuggestion.objects.filter(user=self.viewer).values_list('suggested', 'score'))
+        self.assertAlmostEqual(scores[self.dave.id], 1 + settings.SUGGESTIONS_ACTIVITY_WEIGHT * math.log1p(3))
+        self.assertEqual(scores[self.carol.id], 2)
+
+    def test_incremental_run(self):
+        suggestions.compute_suggestions()
+        graph.follow(self.viewer, self.carol)  # Marks the viewer for refresh
+        self.assertEqual(suggestions.compute_suggestions(incremental=True), (1, 1))
+        self.assertEqual(self.suggested(self.viewer), [(self.dave.id, 1)])
+
+    def test_matches_a_direct_count(self):
+        # Ranking on the adjacency arrays agrees with counting two-hop paths over sets
+        rng = random.Random(0)
+        users = list(User.objects.order_by('id')) + [
+            User.objects.create_user(f'user{i}', f'user{i}@example.com', None) for i in range(25)
+        ]
+        for follower in users:
+            for followee in rng.sample(users, 6):
+                if followee != follower:
+                    graph.follow(follower, followee)
+        follow_graph = suggestions.load_graph()
+        weights = suggestions.activity_weights(follow_graph)
+        for i, ranked in suggestions.rank(follow_graph, range(len(follow_graph)), weights, 5):
+            followed = set(follow_graph.followees(i))
+            paths = Counter(k for j in followed for k in follow_graph.followees(j) if k not in followed and k != i)
+            expected = sorted(paths.items(), key=lambda item: (-item[1] * weights[item[0]], -item[1], item[0]))[:5]
+            self.assertEqual([(k, mutual) for k, mutual, _ in ranked], expected)
@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import RegisterView, LoginView, UserProfileView, UpdateProfileAPIView, UserProfileDelete, FollowUser, UnfollowUser
+from .views import (RegisterView, LoginView, UserProfileView, UpdateProfileAPIView, UserProfileDelete, FollowUser, UnfollowUser,
+    FollowerListView, FollowingListView, RelationshipStatusView, FollowSuggestionListView)
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -15,4 +16,8 @@ urlpatterns = [
     path('profile/delete/', UserProfileDelete.as_view(), name='profile_delete'),  # DELETE profile
     path('follow/<int:user_id>/', FollowUser.as_view(), name='follow_user'),
     path('unfollow/<int:user_id>/', UnfollowUser.as_view(), name='unfollow_user'),
+    path('<int:user_id>/followers/', FollowerListView.as_view(), name='user_followers'),  # GET followers of a user
+    path('<int:user_id>/following/', FollowingListView.as_view(), name='user_following'),  # GET users a user follows
+    path('relationships/', RelationshipStatusView.as_view(), name='relationships'),  # GET ?ids=1,2,3
+    path('suggestions/', FollowSuggestionListView.as_view(), name='follow_suggestions'),  # GET follow suggestions
 ]
\ No newline at end of file
@@ -1,13 +1,20 @@
 from django.shortcuts import render, get_object_or_404
 from rest_framework import status, views, generics
 from django.contrib.auth import authenticate, get_user_model
-from .serializers import RegistrationSerializer, LoginSerializer, UserProfileSerializer, UserProfileUpdateSerializer
+from .serializers import RegistrationSerializer, LoginSerializer, UserProfileSerializer, UserProfileUpdateSerializer, UserSummarySerializer, FollowSuggestionSerializer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
-from notifications.models import Notification
-from django.contrib.contenttypes.models import ContentType
+from notifications.dispatch import notify
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from django.db import transaction
+from posts import timeline
+from social_media_api import caching
+from social_media_api.conditional import ConditionalGetMixin
+from social_media_api.pagination import KeysetPagination
+from . import deletion, graph
+from .models import FollowSuggestion
 
 User = get_user_model()  # Custom user model
 
@@ -67,7 +74,7 @@ class LoginView(views.APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserProfileView(views.APIView):
+class UserProfileView(ConditionalGetMixin, views.APIView):
     # Restrict access to authenticated users only
     permission_classes = [IsAuthenticated]
 
@@ -79,15 +86,18 @@ class UserProfileView(views.APIView):
         # Get the currently authenticated user from the request object
         user = request.user
         
-        # Serialize the user data to return in the response
-        serializer = UserProfileSerializer(user)
-        
-        # If serialization is successful, return the user data with HTTP status 200 (OK)
-        if serializer:
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        
-        # If there's an issue with the serializer, return the errors with HTTP status 400 (Bad Request)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        def respond():
+            # Serialize the user data, or reuse the cached copy until the user changes (see social_media_api.caching)
+            data = caching.fetch(caching.USER, user.pk, 'profile', lambda: UserProfileSerializer(user).data)
+
+            # Return the user data with HTTP status 200 (OK)
+            return Response(data, status=status.HTTP_200_OK)
+
+        # Conditional requests are validated with the user's version alone, read with the user by authentication
+        def state(response=None):
+            return [user.pk], [caching.versions(caching.USER, [user.pk], {user.pk: user})[user.pk]]
+
+        return self.conditional_get(state, respond, state)
 
 class UpdateProfileAPIView(views.APIView):
     # Ensure only authenticated users can access this view
@@ -123,17 +133,14 @@ class UserProfileDelete(views.APIView):
 
     @swagger_auto_schema(
         operation_summary="Delete user profile",
-        operation_description="This deletes a user's profile"
+        operation_description="This deactivates the user's account at once and deletes it with all its data in the background"
     )
     def delete(self, request):
-        # Get the current authenticated user instance (the one making the request)
-        instance = request.user
-        
-        # Delete the user account from the database
-        instance.delete()
+        # Deactivate the account and queue the deletion of its posts, comments, likes, follows and notifications
+        deletion.request_deletion(request.user)
 
-        # Return a success message indicating the account was deleted, with HTTP status 204 (No Content)
-        return Response({"Message": "Account was deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
+        # Return a message indicating the deletion was accepted, with HTTP status 202 (Accepted)
+        return Response({"message": "Account was deactivated and will be deleted shortly."}, status=status.HTTP_202_ACCEPTED)
 
 class FollowUser(views.APIView):
     permission_classes = [IsAuthenticated]
@@ -143,30 +150,32 @@ class FollowUser(views.APIView):
         operation_description="This follows a user"
     )
     def post(self, request, user_id):
-        # Get the user to follow or return 404 if not found
-        user_to_follow = get_object_or_404(User, id=user_id)
+        # Get the user to follow or return 404 if not found (or being deleted)
+        user_to_follow = get_object_or_404(User, id=user_id, is_active=True)
 
         # Prevent users from following themselves
         if request.user == user_to_follow:
             return Response({"message": "sorry, you cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if the user is already following the user
-        if user_to_follow in request.user.following.all():
+        # Add the user to the following list (an indexed existence check, then the insert),
+        # count the new edge on both users, and queue a notification for the user being followed
+        with transaction.atomic():
+            followed = graph.follow(request.user, user_to_follow)
+            if followed:
+                notify(
+                    recipient=user_to_follow,  # The user being followed
+                    actor=request.user,        # The user who is following
+                    verb='followed you',       # Verb explaining the action
+                    target=user_to_follow,     # The specific user being followed
+                    key=f'follow:{request.user.id}:{user_to_follow.id}',  # Following again after an unfollow does not notify twice
+                )
+
+        # Check if the user was already following the user
+        if not followed:
             return Response({"message": "sorry, you've already followed this user."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Add the user to the following list
-        request.user.following.add(user_to_follow)
-        
-         # Create a notification for the user being followed
-        notification = Notification(
-            recipient=user_to_follow,  # The user being followed
-            actor=request.user,        # The user who is following
-            verb='followed you',       # Verb explaining the action
-            # Use ContentType to link the notification to the User model
-            target_content_type=ContentType.objects.get_for_model(User),  # The content type for User model
-            target_object_id=user_to_follow.id,  # The specific user being followed
-        )
-        notification.save()
+
+        # Copy the followed user's latest posts into the follower's timeline
+        timeline.backfill_author(request.user, user_to_follow)
 
         return Response({"message": "user followed successfully."}, status=status.HTTP_200_OK)
 
@@ -185,12 +194,99 @@ class UnfollowUser(views.APIView):
         if request.user == user_to_unfollow:
             return Response({"message": "sorry, you cannot unfollow yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if the user is in the following list
-        if user_to_unfollow not in request.user.following.all():
+        # Remove the user from the following list and uncount the edge on both users;
+        # nothing is deleted if the user is not in the following list
+        if not graph.unfollow(request.user, user_to_unfollow):
             return Response({"message": "sorry, this user is not in your following list."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Remove the user from the following list
-        request.user.following.remove(user_to_unfollow)
+        # Drop the unfollowed user's posts from the follower's timeline
+        timeline.remove_author(request.user, user_to_unfollow)
 
         return Response({"message": "user unfollowed successfully."}, status=status.HTTP_200_OK)
 
+# Keyset pagination for follower and following lists
+class FollowPagination(KeysetPagination):
+    page_size = 20
+
+# List the followers of a user, newest accounts first
+class FollowerListView(generics.ListAPIView):
+    serializer_class = UserSummarySerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = FollowPagination
+
+    def get_queryset(self):
+        # Return 404 if the user does not exist
+        user = get_object_or_404(User, id=self.kwargs['user_id'])
+        return user.followers.only('id', 'username', 'profile_picture', 'avatar', 'follower_count', 'following_count').select_related('avatar').order_by('-id')
+
+    @swagger_auto_schema(
+        operation_summary="List followers",
+        operation_description="This lists the users following a user"
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+# List the users a user follows, newest accounts first
+class FollowingListView(FollowerListView):
+    def get_queryset(self):
+        # Return 404 if the user does not exist
+        user = get_object_or_404(User, id=self.kwargs['user_id'])
+        return user.following.only('id', 'username', 'profile_picture', 'avatar', 'follower_count', 'following_count').select_related('avatar').order_by('-id')
+
+    @swagger_auto_schema(
+        operation_summary="List followed users",
+        operation_description="This lists the users a user follows"
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+# Follow status between the authenticated user and a batch of users
+class RelationshipStatusView(views.APIView):
+    permission_classes = [IsAuthenticated]
+    max_ids = 200  # Largest number of user IDs accepted per request
+
+    @swagger_auto_schema(
+        operation_summary="Relationship status",
+        operation_description="This returns, for each user ID, whether you follow them, they follow you, and whether the follow is mutual",
+        manual_parameters=[
+            openapi.Parameter('ids', openapi.IN_QUERY, description="Comma-separated user IDs", type=openapi.TYPE_STRING, required=True),
+        ],
+    )
+    def get(self, request):
+        # Parse the comma-separated list of user IDs
+        try:
+            user_ids = list(dict.fromkeys(int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()))
+        except ValueError:
+            return Response({"message": "ids must be a comma-separated list of user IDs."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not user_ids:
+            return Response({"message": "ids must be a comma-separated list of user IDs."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(user_ids) > self.max_ids:
+            return Response({"message": f"sorry, at most {self.max_ids} user IDs can be checked at once."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One query on the follow table answers every user ID
+        return Response(graph.relationships(request.user, user_ids), status=status.HTTP_200_OK)
+
+# List precomputed follow suggestions for the authenticated user, best first
+class FollowSuggestionListView(generics.ListAPIView):
+    serializer_class = FollowSuggestionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = FollowPagination
+
+    def get_queryset(self):
+        # Skip users followed since the suggestions were computed
+        followed = graph.Follow.objects.filter(to_customuser_id=self.request.user.id).values('from_customuser_id')
+        return (
+            FollowSuggestion.objects.filter(user=self.request.user)
+            .exclude(suggested_id__in=followed)
+            .select_related('suggested', 'suggested__avatar')
+            .order_by('-score', '-id')
+        )
+
+    @swagger_auto_schema(
+        operation_summary="Follow suggestions",
+        operation_description="This lists users followed by the users you follow, ranked by mutual connections and recent activity"
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)